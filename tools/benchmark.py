@@ -0,0 +1,430 @@
+#! /usr/bin/env python3
+# encoding: utf-8
+import argparse
+import gc
+import json
+import math
+import os
+import platform
+import shutil
+import sys
+import time
+import warnings
+from contextlib import contextmanager, redirect_stdout
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+import polib
+from functions import merge_yml, pddf2po, update_with_older_po
+from parse_cache import default_cache_dir
+from run_report import QUIET, report
+from synthetic_install import SYNTHETIC_VERSION, generate_install
+from synthetic_install import parser as synthetic_parser
+from vanilla_index import open_vanilla_index
+
+import export_vanilla_XML
+import import_mod_language_XML
+import read_vanilla_XML
+
+STAGES = [
+    "read_xmls",
+    "update_with_older_po",
+    "export_modules",
+    "normalize_string_ids",
+    "merge_language_file",
+    "pddf2po",
+]
+
+parser = argparse.ArgumentParser()
+parser.add_argument(
+    "--sizes",
+    nargs="*",
+    type=int,
+    default=[10000, 100000],
+    help="numbers of strings of the synthetic installs. Default: 10000 100000 (1000000 is also practical)",
+)
+parser.add_argument("--stages", nargs="*", default=None, help=f"Default: {STAGES}")
+parser.add_argument(
+    "--workdir",
+    type=Path,
+    default=None,
+    help=f"folder to keep the synthetic installs and outputs. Default: {default_cache_dir.joinpath('benchmark')}",
+)
+parser.add_argument(
+    "--output",
+    type=Path,
+    default=None,
+    help="JSON file to record the results. Default: <workdir>/results.json",
+)
+parser.add_argument(
+    "--baseline",
+    type=Path,
+    default=None,
+    help="JSON file of a previous result to compare with",
+)
+parser.add_argument(
+    "--tolerance",
+    type=float,
+    default=1.25,
+    help="fail if a stage is slower than this ratio of the baseline. Default: 1.25",
+)
+parser.add_argument(
+    "--max-exponent",
+    type=float,
+    default=1.25,
+    help="fail if the time of a stage grows faster than size ** this between sizes. Default: 1.25",
+)
+parser.add_argument(
+    "--min-seconds",
+    type=float,
+    default=0.05,
+    help="timings shorter than this are too noisy to be judged. Default: 0.05",
+)
+parser.add_argument(
+    "--repeat",
+    type=int,
+    default=3,
+    help="the best of N runs is recorded. Default: 3",
+)
+parser.add_argument("--seed", type=int, default=0)
+parser.add_argument(
+    "--regenerate", action="store_true", help="regenerate the synthetic installs"
+)
+parser.add_argument(
+    "--verbose", action="store_true", help="show the output of each stage"
+)
+
+
+@contextmanager
+def quiet(verbose: bool) -> Iterator[None]:
+    """
+    各処理が出すログと警告を計測中は捨てる
+    """
+    if verbose:
+        yield
+        return
+    with (
+        open(os.devnull, "w", encoding="utf-8") as devnull,
+        redirect_stdout(devnull),
+        warnings.catch_warnings(),
+    ):
+        warnings.simplefilter("ignore")
+        yield
+
+
+@contextmanager
+def working_directory(path: Path) -> Iterator[None]:
+    """
+    相対パスに書き出すデバッグ用ファイルを計測用のフォルダに閉じ込める
+    """
+    cwd = Path.cwd()
+    path.mkdir(parents=True, exist_ok=True)
+    os.chdir(path)
+    try:
+        yield
+    finally:
+        os.chdir(cwd)
+
+
+def prepare_install(size: int, args: argparse.Namespace) -> dict:
+    """
+    合成したインストールフォルダを用意する. 同じ条件で作ったものがあれば使い回す
+    """
+    root = args.workdir.joinpath(f"install-{size}")
+    fp_summary = root.joinpath("synthetic.json")
+    if fp_summary.exists() and not args.regenerate:
+        with fp_summary.open("r", encoding="utf-8") as f:
+            summary = json.load(f)
+        if (
+            summary.get("version") == SYNTHETIC_VERSION
+            and summary["size"] == size
+            and summary["seed"] == args.seed
+        ):
+            return summary
+    if root.exists():
+        shutil.rmtree(root)
+    synthetic_args = synthetic_parser.parse_args(
+        [root.as_posix(), "--size", str(size), "--seed", str(args.seed)]
+    )
+    with quiet(args.verbose):
+        synthetic_args = merge_yml(
+            Path(__file__).parent.joinpath("default.yml"),
+            synthetic_args,
+            synthetic_parser.parse_args([root.as_posix()]),
+        )
+        return generate_install(synthetic_args)
+
+
+def run_stages(
+    root: Path, install: dict, args: argparse.Namespace
+) -> Tuple[Dict[str, float], Dict[str, int]]:
+    """
+    各処理を合成データに対して一度ずつ実行する. 入力の準備にかかる時間は含めない
+    Returns: 処理ごとの経過秒数と, 処理ごとの入力の行数
+    """
+    timings: Dict[str, float] = dict()
+    rows: Dict[str, int] = dict()
+    scratch = args.workdir.joinpath(f"run-{install['size']}")
+    if scratch.exists():
+        shutil.rmtree(scratch)
+    langshort, langid = install["langshort"], install["langid"]
+    report.reset(verbosity=QUIET)
+
+    def timed(stage: str, func: Callable, *a, n_rows: Optional[int] = None, **kw):
+        # 選ばれていない処理も後の処理の入力を作るために実行するが, 記録はしない
+        # n_rows: 入力の行数. Mod の文字列はバニラと重なった分が除かれるので, 大きさに比例しない
+        with quiet(args.verbose), working_directory(scratch):
+            # 入力の準備で出たごみの回収を計測に含めない
+            gc.collect()
+            t = time.perf_counter()
+            result = func(*a, **kw)
+            t = time.perf_counter() - t
+        if stage in args.stages:
+            timings[stage] = t
+            rows[stage] = install["size"] if n_rows is None else n_rows
+            print(f"  {stage}: {t:.3f}s")
+        return result
+
+    # read_vanilla_XML.py
+    read_args = argparse.Namespace(
+        vanilla_modules=install["modules"],
+        mb2dir=root,
+        langshort=langshort,
+        drop_multiplayer=False,
+        jobs=None,
+        no_cache=True,
+        cache_dir=None,
+        cache_size=None,
+        clear_cache=None,
+    )
+    if "read_xmls" in args.stages:
+        timed("read_xmls", read_vanilla_XML.read_xmls, read_args, how_join="outer")
+    if "update_with_older_po" in args.stages:
+        with quiet(args.verbose):
+            old_po = polib.pofile(root.joinpath(f"text/MB2BL-{langshort}-old.po"))
+            new_po = polib.pofile(root.joinpath(f"text/MB2BL-{langshort}.po"))
+        timed(
+            "update_with_older_po",
+            update_with_older_po,
+            old_po,
+            new_po,
+            False,
+            ignore_facial=False,
+        )
+        del old_po, new_po
+    # export_vanilla_XML.py. 前回の記録を使わないようにキャッシュは毎回作り直す
+    export_args = export_vanilla_XML.parser.parse_args(
+        [
+            "--input",
+            root.joinpath(f"text/MB2BL-{langshort}.po").as_posix(),
+            "--output",
+            scratch.joinpath("Modules").as_posix(),
+            "--modules",
+            *install["modules"],
+            "--langshort",
+            langshort,
+            "--langid",
+            langid,
+            "--langsuffix",
+            install["langsuffix"],
+            "--cache-dir",
+            scratch.joinpath("cache").as_posix(),
+            "--suppress-missing-id",
+        ]
+    )
+    with quiet(args.verbose):
+        export_args = merge_yml(
+            Path(__file__).parent.joinpath("default.yml"),
+            export_args,
+            export_vanilla_XML.parser.parse_args([]),
+        )
+    export_args.mb2dir = root
+    export_args.langfolder_output = langshort
+    if "export_modules" in args.stages:
+        timed(
+            "export_modules", export_vanilla_XML.export_modules, export_args, "module"
+        )
+    # import_mod_language_XML.py
+    module_data_dir = root.joinpath(f"Modules/{install['mod_name']}/ModuleData")
+    d_mod = None
+    if {"normalize_string_ids", "merge_language_file", "pddf2po"} & set(args.stages):
+        with quiet(args.verbose):
+            d_mod = import_mod_language_XML.extract_all_text_from_xml(module_data_dir)
+            vanilla_index = open_vanilla_index(
+                root.joinpath(f"text/MB2BL-{langshort}.po"),
+                root,
+                scratch.joinpath("cache"),
+            )
+        # import_mod_language_XML.main と同じく, モジュール名から ASCII 以外と空白を除いたもの
+        autoid_prefix = (
+            install["mod_name"]
+            .encode("ascii", errors="ignore")
+            .decode()
+            .replace(" ", "")
+        )
+        d_mod = timed(
+            "normalize_string_ids",
+            import_mod_language_XML.normalize_string_ids,
+            n_rows=d_mod.shape[0],
+            data=d_mod,
+            how_distinct="context",
+            exclude_pattern="!",
+            keep_redundancies=False,
+            autoid_digits=8,
+            keep_vanilla_id=False,
+            vanilla_index=vanilla_index,
+            convert_exclam=False,
+            autoid_prefix=autoid_prefix,
+        )
+    if d_mod is not None:
+        with quiet(args.verbose):
+            d_mod_lang = import_mod_language_XML.read_mod_languages(
+                langid, module_data_dir.joinpath("Languages")
+            )
+            d_po = import_mod_language_XML.read_po_as_df(
+                root.joinpath(f"text/{install['mod_name']}.po")
+            ).drop(columns=["duplication"])
+        d_mod = timed(
+            "merge_language_file",
+            import_mod_language_XML.merge_language_file,
+            d_mod,
+            d_mod_lang,
+            d_po,
+            "both",
+            n_rows=d_mod.shape[0],
+        )
+    if d_mod is not None and "pddf2po" in args.stages:
+        if "text" not in d_mod.columns:
+            d_mod["text"] = ""
+        if "flags" in d_mod:
+            d_mod = d_mod.assign(flags=lambda d: [list(s) for s in d["flags"]])
+        else:
+            d_mod = d_mod.assign(flags=lambda d: [["fuzzy"]] * d.shape[0])
+        timed(
+            "pddf2po",
+            pddf2po,
+            d_mod,
+            n_rows=d_mod.shape[0],
+            with_id=False,
+            make_distinct=False,
+            regacy_mode=False,
+            col_id_text="text_EN",
+            col_text="text",
+            col_comments="note",
+            col_context="context",
+            col_locations="file",
+            col_flags="flags",
+        )
+    return timings, rows
+
+
+def find_regressions(
+    results: Dict[str, Dict[str, float]],
+    baseline: Dict[str, Dict[str, float]],
+    args: argparse.Namespace,
+) -> List[str]:
+    """
+    基準の結果より `--tolerance` 倍以上遅くなった処理
+    """
+    failures = []
+    for size, timings in results.items():
+        for stage, t in timings.items():
+            t_base = baseline.get(size, dict()).get(stage)
+            if t_base is None:
+                continue
+            if t > t_base * args.tolerance and t - t_base > args.min_seconds:
+                failures += [
+                    f"{stage} at {size} strings: {t:.3f}s (baseline {t_base:.3f}s, x{t / t_base:.2f})"
+                ]
+    return failures
+
+
+def find_superlinear(
+    results: Dict[str, Dict[str, float]],
+    rows: Dict[str, Dict[str, int]],
+    args: argparse.Namespace,
+) -> List[str]:
+    """
+    大きさを変えたとき, 処理時間が入力の行数の `--max-exponent` 乗より速く増える処理
+    """
+    failures = []
+    sizes = sorted(results, key=int)
+    for small, large in zip(sizes[:-1], sizes[1:]):
+        for stage, t_small in results[small].items():
+            t_large = results[large].get(stage)
+            if t_large is None or t_small < args.min_seconds:
+                continue
+            n_small, n_large = rows[small][stage], rows[large][stage]
+            if n_large <= n_small:
+                continue
+            exponent = math.log(t_large / t_small) / math.log(n_large / n_small)
+            if exponent > args.max_exponent:
+                failures += [
+                    f"{stage} from {n_small} to {n_large} rows: {t_small:.3f}s -> {t_large:.3f}s (~ n^{exponent:.2f})"
+                ]
+    return failures
+
+
+def main():
+    args = parser.parse_args()
+    if args.workdir is None:
+        args.workdir = default_cache_dir.joinpath("benchmark")
+    args.workdir = args.workdir.resolve()
+    if args.output is None:
+        args.output = args.workdir.joinpath("results.json")
+    if args.stages is None:
+        args.stages = STAGES
+    unknown = [x for x in args.stages if x not in STAGES]
+    if len(unknown) > 0:
+        parser.error(f"unknown stages: {unknown}. choose from {STAGES}")
+    results: Dict[str, Dict[str, float]] = dict()
+    rows: Dict[str, Dict[str, int]] = dict()
+    for size in sorted(args.sizes):
+        print(f"---- {size} strings ----")
+        install = prepare_install(size, args)
+        root = args.workdir.joinpath(f"install-{size}")
+        for i in range(args.repeat):
+            timings, rows[str(size)] = run_stages(root, install, args)
+            best = results.setdefault(str(size), timings)
+            for stage, t in timings.items():
+                best[stage] = min(best[stage], t)
+    failures = find_superlinear(results, rows, args)
+    if args.baseline is not None:
+        with args.baseline.open("r", encoding="utf-8") as f:
+            failures += find_regressions(results, json.load(f)["results"], args)
+    record = dict(
+        created=datetime.now().isoformat(timespec="seconds"),
+        python=sys.version.split()[0],
+        platform=platform.platform(),
+        seed=args.seed,
+        repeat=args.repeat,
+        results=results,
+        rows=rows,
+        failures=failures,
+    )
+    args.output.parent.mkdir(parents=True, exist_ok=True)
+    with args.output.open("w", encoding="utf-8") as f:
+        json.dump(record, f, indent=2)
+    print(f"WRITE AT: {args.output}")
+    header = f"{'stage':<22}" + "".join([f"{s:>12}" for s in results])
+    print(header)
+    for stage in args.stages:
+        print(
+            f"{stage:<22}"
+            + "".join(
+                [
+                    f"{results[s][stage]:>11.3f}s" if stage in results[s] else " " * 12
+                    for s in results
+                ]
+            )
+        )
+    if len(failures) > 0:
+        for x in failures:
+            print(f"FAIL: {x}")
+        sys.exit(1)
+    print("no regression detected")
+
+
+if __name__ == "__main__":
+    main()
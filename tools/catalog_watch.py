@@ -0,0 +1,141 @@
+#! /usr/bin/env python3
+# encoding: utf-8
+from collections import Counter
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+import polib
+
+# 一度に変わった項目がこれより多ければ1項目ずつ解析せずに全体を読み直す
+MAX_INCREMENTAL_BLOCKS = 2000
+
+
+def split_po_blocks(text: str) -> List[str]:
+    """
+    PO のテキストを空行で項目ごとに分ける. ヘッダーも1項目として含む.
+    PO の文字列は行ごとに引用されるので, 項目の途中に空行は現れない
+    """
+    return [
+        x.strip("\n")
+        for x in text.replace("\r\n", "\n").split("\n\n")
+        if x.strip() != ""
+    ]
+
+
+def parse_po_blocks(blocks: Iterable[str]) -> polib.POFile:
+    return polib.pofile("\n\n".join(blocks) + "\n")
+
+
+def catalog_entry_id(entry: polib.POEntry) -> str:
+    """
+    `po2pddf` と同じ規則で msgid から文字列IDを取り出す
+    """
+    return entry.msgid.split("/")[0].replace("%%", "%")
+
+
+class WatchedCatalog:
+    """
+    PO ファイルを項目 (空行で区切られたブロック) ごとに覚えておき,
+    保存されるたびに前回と異なるブロックだけを解析して変わった項目を求める
+    """
+
+    def __init__(self, fpath: Path):
+        self.fpath = fpath
+        self.stat: Optional[Tuple[int, int]] = None
+        self.blocks: List[str] = []
+        # ブロック -> 項目. ヘッダーやコメントだけのブロックは None
+        self.entries: Dict[str, Optional[polib.POEntry]] = dict()
+
+    def current_stat(self) -> Optional[Tuple[int, int]]:
+        try:
+            stat = self.fpath.stat()
+        except FileNotFoundError:
+            # 保存中に一時的に消えることがある
+            return None
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def modified(self) -> bool:
+        stat = self.current_stat()
+        return stat is not None and stat != self.stat
+
+    def load(self) -> polib.POFile:
+        """
+        全体を読み直す. 各項目とブロックの対応はファイル全体の解析結果と並び順で合わせる
+        """
+        stat = self.current_stat()
+        text = self.read_text()
+        pof = polib.pofile(text)
+        blocks = split_po_blocks(text)
+        n_headers = len(blocks) - len(pof)
+        if n_headers in [0, 1]:
+            self.entries = dict(zip(blocks[n_headers:], pof))
+            if n_headers == 1:
+                self.entries[blocks[0]] = None
+        else:
+            # コメントだけのブロックなどがあって対応が取れない. 遅いが1つずつ解析する
+            self.entries = {x: self.parse_block(x) for x in blocks}
+        self.blocks = blocks
+        self.stat = stat
+        return pof
+
+    def read_text(self) -> str:
+        """
+        Raises: 読めないか, 保存途中で UTF-8 として解読できないときは OSError
+        """
+        try:
+            return self.fpath.read_text(encoding="utf-8")
+        except UnicodeDecodeError as e:
+            raise OSError(f"{self.fpath} is not valid UTF-8: {e}") from e
+
+    @staticmethod
+    def parse_block(block: str) -> Optional[polib.POEntry]:
+        pof = parse_po_blocks([block])
+        return pof[0] if len(pof) > 0 else None
+
+    def update(self) -> Optional[Set[str]]:
+        """
+        保存された内容を読み, 追加・削除・変更された項目のIDを返す.
+        変わった項目が多すぎて全体を読み直したときは None
+        Raises: 保存途中などで読めないときは OSError. 解析できないときは polib の例外 (OSError) で, 次に保存されるまで待つ
+        """
+        stat = self.current_stat()
+        # 読めなければ self.stat は変えず, 次に確かめたときに読み直す
+        blocks = split_po_blocks(self.read_text())
+        counts_old, counts_new = Counter(self.blocks), Counter(blocks)
+        added = list(counts_new - counts_old)
+        removed = list(counts_old - counts_new)
+        try:
+            if len(added) > MAX_INCREMENTAL_BLOCKS:
+                self.load()
+                return None
+            entries_added = {x: self.parse_block(x) for x in added}
+        except OSError:
+            self.stat = stat
+            raise
+        ids = {
+            catalog_entry_id(entry)
+            for entry in [self.entries[x] for x in removed]
+            + list(entries_added.values())
+            if entry is not None and entry.msgid != ""
+        }
+        for x in removed:
+            if counts_new[x] == 0:
+                del self.entries[x]
+        self.entries.update(entries_added)
+        self.blocks = blocks
+        self.stat = stat
+        return ids
+
+    def entries_with_ids(self, ids: Optional[Set[str]]) -> List[polib.POEntry]:
+        """
+        指定したIDの項目をファイルの並び順で返す. None ならすべての項目.
+        同じブロックが重複していればその数だけ返す
+        """
+        entries = [self.entries[x] for x in self.blocks]
+        return [
+            x
+            for x in entries
+            if x is not None
+            and x.msgid != ""
+            and (ids is None or catalog_entry_id(x) in ids)
+        ]
@@ -0,0 +1,43 @@
+#! /usr/bin/env python3
+# encoding: utf-8
+import argparse
+import sys
+from pathlib import Path
+
+from run_report import add_report_arguments, configure_report, report
+from text_markup import FUNCTIONS_FILE, check_markup
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--catalog", type=Path, default=Path("text/MB2BL-JP.po"))
+parser.add_argument(
+    "--functions-file",
+    type=Path,
+    default=FUNCTIONS_FILE,
+    help="XML of the language functions such as PLURAL that translations may call",
+)
+parser.add_argument(
+    "--output",
+    type=Path,
+    default=Path("markup-report.csv"),
+    help="CSV of the flagged entries keyed by msgctxt and msgid",
+)
+parser.add_argument(
+    "--strict",
+    default=False,
+    action="store_true",
+    help="exit with status 1 if any entry is flagged, to stop the following export",
+)
+add_report_arguments(parser)
+
+
+def main():
+    args = parser.parse_args()
+    configure_report(args)
+    d = check_markup(args.catalog, args.output, args.functions_file)
+    report.finish(args, "check-markup")
+    if args.strict and d.shape[0] > 0:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,47 @@
+#! /usr/bin/env python3
+# encoding: utf-8
+import argparse
+import sys
+from pathlib import Path
+
+from run_report import add_report_arguments, configure_report, report
+from terminology import TERMINOLOGY_FILES, check_terminology
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--catalog", type=Path, default=Path("text/MB2BL-JP.po"))
+parser.add_argument(
+    "--terms",
+    type=Path,
+    nargs="*",
+    default=TERMINOLOGY_FILES,
+    help="terminology CSVs with text_EN, text and text_wrong columns",
+)
+parser.add_argument(
+    "--output",
+    type=Path,
+    default=Path("terminology-report.csv"),
+    help="CSV of the flagged entries keyed by msgctxt and msgid",
+)
+parser.add_argument(
+    "--skip-fuzzy", default=False, action="store_true", help="ignore fuzzy entries"
+)
+parser.add_argument(
+    "--strict",
+    default=False,
+    action="store_true",
+    help="exit with status 1 if any entry is flagged, to stop the following export",
+)
+add_report_arguments(parser)
+
+
+def main():
+    args = parser.parse_args()
+    configure_report(args)
+    d = check_terminology(args.catalog, args.output, args.terms, not args.skip_fuzzy)
+    report.finish(args, "check-terminology")
+    if args.strict and d.shape[0] > 0:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+#! /usr/bin/env python3
+# encoding: utf-8
+import json
+import os
+from pathlib import Path
+from typing import Dict, List, Optional
+
+MANIFEST_VERSION = 1
+
+
+class ExportManifest:
+    """
+    書き出したファイルごとに, 入力 (元のXML, 対応する翻訳, オプション) の指紋と変更件数を記録する.
+    指紋が変わらず, 出力ファイルも前回書き出したときのままなら書き直しを省略できる
+    """
+
+    def __init__(self, fpath: Path):
+        self.fpath = fpath
+        self.records: Dict[str, dict] = dict()
+        self.stale: List[Path] = []
+        self.n_skipped = 0
+        if self.fpath.exists():
+            with self.fpath.open("r", encoding="utf-8") as f:
+                manifest = json.load(f)
+            if manifest.get("version") == MANIFEST_VERSION:
+                self.records = manifest["outputs"]
+
+    @staticmethod
+    def key(fpath: Path) -> str:
+        return str(fpath.resolve())
+
+    def lookup(self, fpath: Path, fingerprint: str) -> Optional[dict]:
+        """
+        Returns: 書き直す必要がなければ前回の記録. そうでなければ None
+        """
+        record = self.records.get(self.key(fpath))
+        if record is None or record["fingerprint"] != fingerprint:
+            return None
+        if not fpath.exists():
+            return None
+        stat = fpath.stat()
+        if stat.st_size != record["size"] or stat.st_mtime_ns != record["mtime_ns"]:
+            return None
+        self.n_skipped += 1
+        return record
+
+    def put(self, fpath: Path, fingerprint: str, **counts: int) -> None:
+        """
+        書き出した直後に呼ぶ
+        """
+        stat = fpath.stat()
+        self.records[self.key(fpath)] = dict(
+            fingerprint=fingerprint,
+            size=stat.st_size,
+            mtime_ns=stat.st_mtime_ns,
+            **counts,
+        )
+
+    def save(self) -> None:
+        if not self.fpath.parent.exists():
+            self.fpath.parent.mkdir(parents=True)
+        fp_tmp = self.fpath.with_suffix(".tmp")
+        with fp_tmp.open("w", encoding="utf-8") as f:
+            json.dump(dict(version=MANIFEST_VERSION, outputs=self.records), f)
+        os.replace(fp_tmp, self.fpath)
@@ -6,6 +6,8 @@ from pathlib import Path
 import lxml.etree as ET
 import polib
 from functions import merge_yml, po2pddf_easy
+from profiling import add_profile_arguments, open_profiler
+from xml_writer import write_string_xml
 
 parser = argparse.ArgumentParser()
 parser.add_argument("target_module", type=str)
@@ -21,6 +23,7 @@ parser.add_argument(
     default=None,
     help="default: <output directory>/strings_<nodule folder name>.po",
 )
+add_profile_arguments(parser)
 
 if __name__ == "__main__":
     args = parser.parse_args()
@@ -39,54 +42,36 @@ if __name__ == "__main__":
     if args.pofile is None:
         args.pofile = args.outdir.joinpath(f"{args.target_module}.po")
     print(args)
+    profiler = open_profiler(args, "export_mod_language_XML")
 
-pof = polib.pofile(args.pofile, encoding="utf-8")
-d_new = po2pddf_easy(pof, with_id=args.with_id)
-if not args.output_blank:
-    d_new = d_new.loc[lambda d: d["text"] != ""]
+with profiler.stage("parse"):
+    pof = polib.pofile(args.pofile, encoding="utf-8")
+    d_new = po2pddf_easy(pof, with_id=args.with_id)
+    if not args.output_blank:
+        d_new = d_new.loc[lambda d: d["text"] != ""]
 # d_new = pd.read_excel(args.outdir.joinpath(f'strings_{args.target_module}.xlsx'))
 
-xml = ET.fromstring(
-    f"""
-    <base>
-    <tags>
-    <tag language="{args.langid}" />
-    </tags>
-    <strings>
-    </strings>
-    </base>
-    """
-)
-strings = xml.find("strings")
-for i, r in d_new.iterrows():
-    tmp = ET.fromstring("""<string id="PLAHECOLHDER" text="[PLACEHOLDER]" />""")
-    tmp.attrib["id"] = r["id"]
-    tmp.attrib["text"] = r["text"]
-    strings.append(tmp)
-xml = ET.ElementTree(xml)
-ET.indent(xml, space="  ", level=0)
-xml.write(
-    args.outdir.joinpath(
-        f"{args.target_module}/ModuleData/Languages/{args.langshort}/strings-{args.langshort}.xml"
-    ),
-    pretty_print=True,
-    xml_declaration=True,
-    encoding="utf-8",
-)
+with profiler.stage("XML write"):
+    write_string_xml(
+        args.outdir.joinpath(
+            f"{args.target_module}/ModuleData/Languages/{args.langshort}/strings-{args.langshort}.xml"
+        ),
+        [args.langid],
+        zip(d_new["id"], d_new["text"]),
+    )
 
-xml = ET.fromstring(
-    f"""
+    xml = ET.fromstring(f"""
     <LanguageData id="{args.langid}">
       <LanguageFile xml_path="{args.langshort}/strings-{args.langshort}.xml" />
-    </LanguageData>"""
-)
-xml = ET.ElementTree(xml)
-ET.indent(xml, space="  ", level=0)
-xml.write(
-    args.outdir.joinpath(
-        f"{args.target_module}/ModuleData/Languages/{args.langshort}/language_data.xml"
-    ),
-    pretty_print=True,
-    xml_declaration=True,
-    encoding="utf-8",
-)
+    </LanguageData>""")
+    xml = ET.ElementTree(xml)
+    ET.indent(xml, space="  ", level=0)
+    xml.write(
+        args.outdir.joinpath(
+            f"{args.target_module}/ModuleData/Languages/{args.langshort}/language_data.xml"
+        ),
+        pretty_print=True,
+        xml_declaration=True,
+        encoding="utf-8",
+    )
+profiler.save()
@@ -1,15 +1,52 @@
 #! /usr/bin/env python3
 # encoding: utf-8
 import argparse
-import html
+import copy
+import hashlib
+import json
+import time
 import warnings
+from collections import ChainMap
+from concurrent.futures import (
+    Executor,
+    Future,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+)
 from pathlib import Path
-from typing import Iterable, List, Optional, Tuple
+from typing import Any, Callable, Dict, Iterable, List, Mapping, Optional, Set, Tuple
 
 import lxml.etree as ET
 import pandas as pd
 import polib
-from functions import merge_yml, po2pddf, public_po, removeannoyingchars
+from catalog_watch import WatchedCatalog
+from export_manifest import ExportManifest
+from functions import (
+    format_po_head,
+    merge_yml,
+    mo2pddf,
+    po2pddf,
+    public_po,
+    public_po_columns,
+    read_language_strings_packed,
+    removeannoyingchars,
+    unpack_language_strings,
+    write_mo_columns,
+    write_po_columns,
+)
+from parse_cache import ParseCache, default_cache_dir, hash_file
+from profiling import StageProfiler, add_profile_arguments, open_profiler
+from run_report import add_report_arguments, configure_report, report
+from table_store import read_table, write_table
+from terminology import check_terminology
+from text_markup import check_markup
+from xml_writer import (
+    XMLWriteQueue,
+    serialize_xml,
+    write_bytes_atomic,
+    write_string_xml,
+    write_xml_atomic,
+)
 
 pofile = Path("text/MB2BL-Jp.po")
 output = Path("Modules")
@@ -100,6 +137,78 @@ parser.add_argument(
 parser.add_argument(
     "--verbose", default=None, action="store_true", help="output verbose log"
 )
+parser.add_argument(
+    "--plan",
+    default=None,
+    action="store_true",
+    help="list the files to be rewritten without writing anything",
+)
+parser.add_argument(
+    "--force",
+    default=None,
+    action="store_true",
+    help="rewrite all files even if their inputs are unchanged",
+)
+parser.add_argument(
+    "--jobs",
+    type=int,
+    default=None,
+    help="number of processes to rewrite the language files. the output is the same as without it. Default: 1 (no parallel)",
+)
+parser.add_argument(
+    "--cache-dir",
+    type=Path,
+    default=None,
+    help=f"folder to keep the export manifest and the parse cache. Default: {default_cache_dir}",
+)
+parser.add_argument(
+    "--watch",
+    default=None,
+    action="store_true",
+    help="after exporting, keep running and rewrite only the language files affected by each saved change of the input PO. Stop with Ctrl+C",
+)
+parser.add_argument(
+    "--watch-interval",
+    type=float,
+    default=0.5,
+    help="seconds between checks of the input file in --watch mode",
+)
+parser.add_argument(
+    "--xlsx",
+    default=None,
+    action="store_true",
+    help="with --debug-tables, also write them as .xlsx",
+)
+parser.add_argument(
+    "--debug-tables",
+    default=None,
+    action="store_true",
+    help="write the intermediate tables for debugging",
+)
+parser.add_argument(
+    "--check-terminology",
+    type=Path,
+    nargs="?",
+    const=Path("terminology-report.csv"),
+    default=None,
+    help="before exporting, check the input against the terminology CSVs and write the flagged entries. Default path: terminology-report.csv",
+)
+parser.add_argument(
+    "--check-markup",
+    type=Path,
+    nargs="?",
+    const=Path("markup-report.csv"),
+    default=None,
+    help="before exporting, compare the variables and control tokens of the source and the translations and write the flagged entries. Default path: markup-report.csv",
+)
+add_profile_arguments(parser)
+add_report_arguments(parser)
+
+# 出力する言語ファイルの内容に影響するオプション. 変更されたら全ファイルを書き直す
+FINGERPRINT_OPTIONS = ["langid", "langalias", "with_id", "all_entries"]
+# 書き出すファイルの作り方 (文字の置き換え, 訳の補正, 公開用カタログの加工など) を変えたら上げる.
+# 指紋に含まれるので, 上げると前回から入力が変わっていないファイルも書き直す
+EXPORT_FORMAT_VERSION = 1
 
 
 def main():
@@ -110,18 +219,47 @@ def main():
     if args.langfolder_output is None:
         args.langfolder_output = args.langshort
     print(args)
+    configure_report(args)
+    profiler = open_profiler(args, "export_vanilla_XML")
     if args.output_type == "both":
-        for x in ["module", "overwriter"]:
-            export_modules(args, x)
-    elif args.output_type == "module":
-        export_modules(args, "module")
-    elif args.output_type == "overwriter":
-        export_modules(args, "overwriter")
+        run_types = ["module", "overwriter"]
+    elif args.output_type in ["module", "overwriter"]:
+        run_types = [args.output_type]
     else:
+        run_types = []
         warnings.warn(
             f'{args.output_type} must be "module", "overwriter", or "both" ',
             UserWarning,
         )
+    if args.check_terminology is not None and args.input.exists():
+        with profiler.stage("terminology"):
+            check_terminology(args.input, args.check_terminology)
+    if args.check_markup is not None and args.input.exists():
+        with profiler.stage("markup"):
+            check_markup(
+                args.input,
+                args.check_markup,
+                Path(__file__).parent.parent.joinpath("Modules", args.functions),
+            )
+    watcher = None
+    if args.watch:
+        if args.plan or args.legacy_id or args.input.suffix != ".po":
+            warnings.warn(
+                "--watch supports only a .po input without --plan and --legacy_id. exporting once",
+                UserWarning,
+            )
+        else:
+            # 書き出しの途中で保存されても取りこぼさないよう, 先に読んでおく
+            watcher = ExportWatcher(args, run_types)
+    for x in run_types:
+        export_modules(args, x, profiler)
+    if watcher is not None:
+        try:
+            watcher.run(args.watch_interval, profiler)
+        except KeyboardInterrupt:
+            print("stopped watching")
+    report.finish(args, "export_vanilla_XML")
+    profiler.save()
 
 
 # TODO: 挙動が非常に不可解. 重複を削除するとかえって動かなくなる? language_data 単位でsanity checkがなされている?
@@ -132,10 +270,20 @@ def main():
 # TODO: too intricate to localize
 
 
-def export_modules(args: argparse.Namespace, run_type: str) -> None:
+def export_modules(
+    args: argparse.Namespace,
+    run_type: str,
+    profiler: Optional[StageProfiler] = None,
+    catalog: Optional[polib.POFile] = None,
+    df_original: Optional[pd.DataFrame] = None,
+) -> None:
     """
     type: 'module' or 'overwriter'
+    catalog: 読み込み済みのカタログ. 渡せば `args.input` は読まず, 公開用カタログも書き出さない
+    df_original: 原文と公式訳の表. 渡さなければ必要なときに `text/MB2BL-{langshort}.parquet` を一度だけ読む
     """
+    if profiler is None:
+        profiler = StageProfiler("export_vanilla_XML")
 
     # df_to_be_dropped = pd.read_csv(Path(__file__).parent.joinpath('duplications.csv'))
     df_duplication_suspected = pd.read_csv(
@@ -143,24 +291,209 @@ def export_modules(args: argparse.Namespace, run_type: str) -> None:
     )
 
     print(f"output type: {run_type}")
-    if args.input.exists():
-        if args.input.suffix == ".po":
-            print(f"reading {args.input}")
-            pof = polib.pofile(args.input)
-        elif args.input.suffix == ".mo":
-            print(f"reading {args.input}")
-            pof = polib.pofile(args.input)
-        else:
-            raise ("input file is invalid", UserWarning)
-    pof_pub = public_po(pof)
-    pof_pub.save(
-        args.input.parent.joinpath(args.input.with_suffix("").name + "-pub.po")
-    )
-    pof_pub.save_as_mofile(
-        args.input.parent.joinpath(args.input.with_suffix("").name + "-pub.mo")
+    cache_dir = default_cache_dir if args.cache_dir is None else Path(args.cache_dir)
+    manifest = ExportManifest(cache_dir.joinpath("export-manifest.json"))
+    ids_cache = ParseCache(cache_dir, max_bytes=512 * 1024**2)
+    publishing: Optional[Future] = None
+    with profiler.stage("parse"):
+        if catalog is not None:
+            d = po2pddf(catalog, drop_prefix_id=False)
+        elif args.input.exists():
+            if args.input.suffix == ".po":
+                print(f"reading {args.input}")
+                pof = polib.pofile(args.input)
+                d = po2pddf(pof, drop_prefix_id=False)
+                # 公開用の書き出しは別スレッドに任せ, 以下の処理と重ねる
+                publishing = publish_public_catalog(pof, manifest, args)
+                del pof
+            elif args.input.suffix == ".mo":
+                print(f"reading {args.input}")
+                d = mo2pddf(args.input, drop_prefix_id=False)
+            else:
+                raise ("input file is invalid", UserWarning)
+    with profiler.stage("normalize"):
+        d = normalize_catalog(d, args)
+        if args.debug_tables and not args.plan:
+            write_table(d, Path("あほしね.parquet"), xlsx=args.xlsx)
+        n = d.shape[0]
+        d = select_catalog_entries(d, args)
+        if args.distinct:
+            print(f"""{n - d.shape[0]} duplicated entries dropped""")
+        d_duplication_entries = d.merge(
+            df_duplication_suspected[["id"]], on=["id"], how="inner"
+        )
+        text_lookups = build_text_lookups(d, d_duplication_entries, args)
+    if df_original is None and not args.suppress_missing_id and args.missing_modulewise:
+        df_original = read_table(Path(f"text/MB2BL-{args.langshort}.parquet"))
+    with profiler.stage("XML write"):
+        n_entries_total: int = 0
+        n_change_total: int = 0
+        d_used: Set[str] = set()
+        executor: Optional[Executor] = None
+        writer: Optional[XMLWriteQueue] = None
+        if args.jobs is not None and args.jobs > 1 and not args.plan:
+            print(f"exporting with {args.jobs} processes")
+            executor = ProcessPoolExecutor(
+                max_workers=args.jobs,
+                initializer=init_export_worker,
+                initargs=(text_lookups, args, report.verbosity),
+            )
+        elif not args.plan:
+            writer = XMLWriteQueue()
+        results: List[Tuple[int, int, Set[str]]] = []
+        finishers: List[Callable[[], Tuple[int, int, Set[str]]]] = []
+        try:
+            for module in args.modules:
+                output_dir = module_output_dir(args, run_type, module)
+                if not output_dir.exists() and not args.plan:
+                    output_dir.mkdir(parents=True)
+                finish = start_module_export(
+                    d,
+                    text_lookups,
+                    module,
+                    output_dir,
+                    run_type,
+                    args,
+                    manifest,
+                    ids_cache,
+                    df_original,
+                    executor,
+                    writer,
+                )
+                if executor is None:
+                    results.append(finish())
+                else:
+                    finishers.append(finish)
+            # 並列のときは全モジュールのファイルを投入してから, モジュールの順に集計する
+            results += [finish() for finish in finishers]
+        finally:
+            if executor is not None:
+                executor.shutdown(cancel_futures=True)
+            if writer is not None:
+                writer.shutdown()
+        for x, y, used_id in results:
+            n_change_total += x
+            n_entries_total += y
+            d_used |= used_id
+        if run_type == "module" and not args.no_english_overwriting:
+            lang_data_patch = generate_language_data_xml(module="", lang_id="English")
+            lang_data_patch.getroot().append(
+                generate_languageFile_element(
+                    f"{args.langfolder_output}/Native/std_global_strings_xml_{args.langsuffix}.xml"
+                )
+            )
+            write_xml_if_changed(
+                lang_data_patch,
+                output_dir.joinpath("../../language_data.xml"),
+                manifest,
+                args,
+            )
+        if run_type == "module" and args.langalias is not None and not args.plan:
+            language_data_alias = ET.parse(
+                args.output.joinpath(
+                    f"CL{args.langshort}-Common/ModuleData/Languages/{args.langfolder_output}/Native/language_data.xml"
+                )
+            )
+            language_data = language_data_alias.find("LanguageData", recursive=False)
+            language_data.attrib["id"] = args.langalias
+            language_data.attrib["name"] = args.langalias
+            xml_list = args.output.joinpath(
+                f"CL{args.langshort}-Common/ModuleData/Languages/{args.langfolder_output}"
+            ).rglob("language_data.xml")
+            for fp in xml_list:
+                if fp.parent != "Native":
+                    langauage_data2 = ET.parse(fp)
+                    for xml_languagefile in langauage_data2.findall("LanguageFile"):
+                        language_data_alias.getroot().append(xml_languagefile)
+            output_fp = args.output.joinpath(
+                f"CL{args.langshort}-Common/ModuleData/Languages/{args.langfolder_output}2/language_data.xml"
+            )
+            if not output_fp.parent.exists():
+                output_fp.parent.mkdir(parents=True)
+            write_xml_with_default_setting(language_data_alias, output_fp)
+    if n_entries_total > 0:
+        print(
+            f"""SUMMARY: {n_change_total}/{n_entries_total} ({100 * n_change_total/n_entries_total:.0f}%) text entries are changed totally"""
+        )
+    ids_leftover = set(d["id"]) - d_used
+    d_leftover = (
+        d[["id", "text"]].loc[lambda d: d["id"].isin(ids_leftover)].drop_duplicates()
     )
-    del pof_pub
-    d = po2pddf(pof, drop_prefix_id=False)
+    if (
+        not args.suppress_missing_id
+        and not args.missing_modulewise > 0
+        and not args.plan
+    ):
+        write_missings(n_entries_total, d_leftover, output_dir, args)
+    ids_cache.save()
+    if args.plan:
+        print(f"PLAN: {len(manifest.stale)} files would be rewritten")
+        for fp in manifest.stale:
+            print(f"  {fp}")
+    else:
+        if publishing is not None:
+            with profiler.stage("PO write"):
+                publishing.result()
+        manifest.save()
+        print(
+            f"{manifest.n_skipped} files are unchanged, {len(manifest.stale)} files are rewritten"
+        )
+
+
+def publish_public_catalog(
+    pof: polib.POFile, manifest: ExportManifest, args: argparse.Namespace
+) -> Optional[Future]:
+    """
+    公開用の PO/MO (`-pub.po`, `-pub.mo`) をバックグラウンドで書き出す. 元の PO が前回の公開時から
+    変わっていなければ何もしない. 公開用の msgid の列はこのスレッドで作るので, 呼び出し後に `pof` を変えてもよい
+    Returns: 書き出しの完了を待つための Future. 書き出さないときは None
+    """
+    fps = [
+        args.input.parent.joinpath(args.input.with_suffix("").name + suffix)
+        for suffix in ["-pub.po", "-pub.mo"]
+    ]
+    source_hash = f"{EXPORT_FORMAT_VERSION}:{hash_file(args.input)}"
+    records = [None if args.force else manifest.lookup(fp, source_hash) for fp in fps]
+    if all(record is not None for record in records):
+        print("public catalogs are up to date")
+        return None
+    manifest.stale += fps
+    if args.plan:
+        return None
+
+    columns = public_po_columns(pof) if pof.encoding.lower() == "utf-8" else None
+    if columns is not None:
+        head = format_po_head(pof)
+        metadata = pof.metadata_as_entry().msgstr
+
+        def write() -> None:
+            write_po_columns(columns, fps[0], head=head)
+            write_mo_columns(columns, fps[1], metadata=metadata)
+            for fp in fps:
+                manifest.put(fp, source_hash)
+
+    else:
+        # 列にできない項目 (obsolete など) があれば polib で書く
+        pof = public_po(pof)
+
+        def write() -> None:
+            pof.save(fps[0])
+            pof.save_as_mofile(fps[1])
+            for fp in fps:
+                manifest.put(fp, source_hash)
+
+    executor = ThreadPoolExecutor(max_workers=1)
+    publishing = executor.submit(write)
+    executor.shutdown(wait=False)
+    return publishing
+
+
+def normalize_catalog(data: pd.DataFrame, args: argparse.Namespace) -> pd.DataFrame:
+    """
+    `po2pddf` の結果の context を module, file 列に分け, 言語ファイル名と突き合わせられる形にする.
+    行ごとの処理なので一部の行だけに適用しても結果は変わらない
+    """
+    d = data
     if not args.legacy_id:
         d = pd.concat(
             [
@@ -176,13 +509,20 @@ def export_modules(args: argparse.Namespace, run_type: str) -> None:
     d["module"] = d["module"].str.replace("^Hardcoded, ", "", regex=True)
     d["file"] = d["file"].str.replace("^Hardcoded, ", "", regex=True)
     d["file"] = d["file"].str.replace(f"_{args.langsuffix}.xml", ".xml")
-    d.to_csv("あほしね.csv", index=False)
+    return d
+
+
+def select_catalog_entries(
+    data: pd.DataFrame, args: argparse.Namespace
+) -> pd.DataFrame:
+    """
+    `--skip-blank_vanilla`, `--distinct` に従って書き出しに使う行を選ぶ.
+    ID ごとに決まるので, あるIDの行をすべて渡せばそのIDについては全体に適用したときと同じ結果になる
+    """
+    d = data
     if args.skip_blank_vanilla:
         d = d.loc[lambda d: d["text"] != ""]
-    del pof
-
     if args.distinct:
-        n = d.shape[0]
         d = (
             d.assign(isnative=lambda d: d["module"] == "Native")
             .sort_values(["id", "isnative"])
@@ -191,257 +531,613 @@ def export_modules(args: argparse.Namespace, run_type: str) -> None:
             .reset_index()
             .drop(columns=["isnative"])
         )
-        print(f"""{n - d.shape[0]} duplicated entries dropped""")
     if "duplication" not in d.columns:
         d["duplication"] = 1
-    d_duplication_entries = d.merge(
-        df_duplication_suspected[["id"]], on=["id"], how="inner"
-    )
-    n_entries_total: int = 0
-    n_change_total: int = 0
-    d_used = pd.DataFrame({"id": []})
-    for module in args.modules:
-        if run_type == "module":
-            output_dir = args.output.joinpath(
-                f"CL{args.langshort}-Common/ModuleData/Languages/{args.langfolder_output}"
-            ).joinpath(module)
-        elif run_type == "overwriter":
-            output_dir = args.output.joinpath(
-                f"{module}/ModuleData/Languages/{args.langfolder_output}"
-            )
-        if not output_dir.exists():
-            output_dir.mkdir(parents=True)
-        x, y, used_id = correct_xml_in_folder_with_counting_and_writing(
-            d, d_duplication_entries, module, output_dir, run_type, args
-        )
-        n_change_total += x
-        n_entries_total += y
-        d_used = pd.concat((d_used, used_id)).drop_duplicates()
-    if run_type == "module" and not args.no_english_overwriting:
-        lang_data_patch = generate_language_data_xml(module="", lang_id="English")
-        lang_data_patch.getroot().append(
-            generate_languageFile_element(
-                f"{args.langfolder_output}/Native/std_global_strings_xml_{args.langsuffix}.xml"
-            )
+    return d
+
+
+def module_output_dir(args: argparse.Namespace, run_type: str, module: str) -> Path:
+    """
+    モジュールの言語ファイルの書き出し先
+    """
+    if run_type == "module":
+        return args.output.joinpath(
+            f"CL{args.langshort}-Common/ModuleData/Languages/{args.langfolder_output}"
+        ).joinpath(module)
+    elif run_type == "overwriter":
+        return args.output.joinpath(
+            f"{module}/ModuleData/Languages/{args.langfolder_output}"
         )
-        write_xml_with_default_setting(
-            lang_data_patch, output_dir.joinpath("../../language_data.xml")
+
+
+class ExportWatcher:
+    """
+    `--watch` 用. 翻訳ファイルの項目, ID -> text の辞書, 元の言語ファイルの解析結果をメモリに置いたまま
+    翻訳ファイルの保存を待ち, 訳が変わったIDを含む言語ファイルだけを書き直す.
+    モジュールごとの language_data.xml や未翻訳IDの一覧は更新しないので, 必要なら通常どおり書き出し直す
+    """
+
+    def __init__(self, args: argparse.Namespace, run_types: List[str]):
+        self.args = args
+        self.run_types = run_types
+        self.cache_dir = (
+            default_cache_dir if args.cache_dir is None else Path(args.cache_dir)
         )
-    if run_type == "module" and args.langalias is not None:
-        with args.output.joinpath(
-            f"CL{args.langshort}-Common/ModuleData/Languages/{args.langfolder_output}/Native/language_data.xml"
-        ) as fp:
-            language_data_alias = ET.parse(fp)
-        language_data = language_data_alias.find("LanguageData", recursive=False)
-        language_data.attrib["id"] = args.langalias
-        language_data.attrib["name"] = args.langalias
-        xml_list = args.output.joinpath(
-            f"CL{args.langshort}-Common/ModuleData/Languages/{args.langfolder_output}"
-        ).rglob("language_data.xml")
-        for fp in xml_list:
-            if fp.parent != "Native":
-                langauage_data2 = ET.parse(fp)
-                for xml_languagefile in langauage_data2.findall("LanguageFile"):
-                    language_data_alias.getroot().append(xml_languagefile)
-        output_fp = args.output.joinpath(
-            f"CL{args.langshort}-Common/ModuleData/Languages/{args.langfolder_output}2/language_data.xml"
+        self.suspects = pd.read_csv(
+            Path(__file__).parent.joinpath("duplications-suspects.csv")
+        )[["id"]]
+        self.catalog = WatchedCatalog(args.input)
+        print(f"reading {args.input} for --watch")
+        self.text_lookups = self.build_lookups(self.catalog.load())
+        ids_cache = ParseCache(self.cache_dir, max_bytes=512 * 1024**2)
+        # 元の言語ファイル -> (モジュール名, 含まれるID, 解析したXML)
+        self.sources: Dict[Path, Tuple[str, List[str], ET.ElementTree]] = dict()
+        self.files_by_id: Dict[str, List[Path]] = dict()
+        for module in args.modules:
+            for xml_path in source_language_xmls(args, module):
+                xml = ET.parse(xml_path)
+                if xml.getroot().tag != "base":
+                    continue
+                ids = read_string_ids(xml_path, module, ids_cache)
+                self.sources[xml_path] = (module, ids, xml)
+                for id in set(ids):
+                    self.files_by_id.setdefault(id, []).append(xml_path)
+        ids_cache.save()
+
+    def build_lookups(self, entries: Iterable[polib.POEntry]) -> Dict[str, dict]:
+        """
+        `export_modules` と同じ手順で ID -> text の辞書を作る
+        """
+        entries = list(entries)
+        if len(entries) == 0:
+            return dict(all=dict(), dup=dict(), file=dict())
+        d = po2pddf(entries, drop_prefix_id=False)
+        d = select_catalog_entries(normalize_catalog(d, self.args), self.args)
+        return build_text_lookups(
+            d, d.merge(self.suspects, on=["id"], how="inner"), self.args
         )
-        if not output_fp.parent.exists():
-            output_fp.parent.mkdir(parents=True)
-        write_xml_with_default_setting(language_data_alias, output_fp)
-    if n_entries_total > 0:
-        print(
-            f"""SUMMARY: {n_change_total}/{n_entries_total} ({100 * n_change_total/n_entries_total:.0f}%) text entries are changed totally"""
+
+    def update_lookups(self, ids: Optional[Set[str]]) -> Set[str]:
+        """
+        変わった項目のIDについてだけ辞書を作り直して差し替える. `None` なら全体を作り直す.
+        `normalize_catalog`, `select_catalog_entries` は ID ごとに閉じているので, 該当IDの項目だけで足りる
+        Returns: 訳が変わったID
+        """
+        if ids is None:
+            lookups = self.build_lookups(self.catalog.entries_with_ids(None))
+            ids = set(self.text_lookups["all"]) | set(lookups["all"])
+        else:
+            lookups = self.build_lookups(self.catalog.entries_with_ids(ids))
+        changed = {
+            id
+            for id in ids
+            if self.text_lookups["all"].get(id) != lookups["all"].get(id)
+            or self.text_lookups["dup"].get(id) != lookups["dup"].get(id)
+        }
+        for key in ["all", "dup"]:
+            for id in ids:
+                self.text_lookups[key].pop(id, None)
+            self.text_lookups[key].update(lookups[key])
+        if "file" in self.text_lookups:
+            # ファイルごとの辞書は比べず, 該当IDはすべて変わったものとして扱う
+            changed |= ids
+            for lookup in self.text_lookups["file"].values():
+                for id in ids:
+                    lookup.pop(id, None)
+            for name, lookup in lookups["file"].items():
+                self.text_lookups["file"].setdefault(name, dict()).update(lookup)
+        return changed
+
+    def rewrite(self, xml_path: Path, manifest: ExportManifest) -> int:
+        """
+        1つの言語ファイルを出力先ごとに書き直す
+        Returns: 実際に内容が変わったファイルの数
+        """
+        module, ids, source = self.sources[xml_path]
+        en_xml_name = geneatae_en_xml_names(xml_path, self.args)
+        lookup = select_text_lookup(self.text_lookups, module, en_xml_name, self.args)
+        fingerprint = fingerprint_language_xml(xml_path, ids, lookup, self.args)
+        n_written = 0
+        for run_type in self.run_types:
+            output_dir = module_output_dir(self.args, run_type, module)
+            if not output_dir.exists():
+                output_dir.mkdir(parents=True)
+            output_fp = output_dir.joinpath(xml_path.name)
+            xml = copy.deepcopy(source)
+            n_change_xml, n_entries_xml, _ = correct_xml_translations_with_count(
+                xml, lookup, module, xml_path, self.args
+            )
+            if write_xml_if_changed(xml, output_fp, manifest, self.args):
+                n_written += 1
+                report.note("watch_rewritten", "{} is rewritten", output_fp)
+            manifest.put(
+                output_fp,
+                fingerprint,
+                n_changes=n_change_xml,
+                n_entries=n_entries_xml,
+            )
+        return n_written
+
+    def run(self, interval: float, profiler: StageProfiler) -> None:
+        """
+        Ctrl+C (KeyboardInterrupt) まで翻訳ファイルの更新を待ち続ける
+        """
+        # 最初の書き出しで更新された記録を読み直す
+        manifest = ExportManifest(self.cache_dir.joinpath("export-manifest.json"))
+        print(f"watching {self.args.input} ... press Ctrl+C to stop")
+        while True:
+            time.sleep(interval)
+            if not self.catalog.modified():
+                continue
+            wall = time.perf_counter()
+            with profiler.stage("watch update"):
+                try:
+                    ids = self.catalog.update()
+                except OSError as e:
+                    warnings.warn(f"failed to read {self.args.input}: {e}", UserWarning)
+                    continue
+                changed = self.update_lookups(ids)
+                xml_paths = sorted(
+                    {x for id in changed for x in self.files_by_id.get(id, [])}
+                )
+                n_written = sum([self.rewrite(x, manifest) for x in xml_paths])
+                manifest.save()
+            print(
+                f"{len(changed)} entries changed, {n_written} files rewritten in {time.perf_counter() - wall:.2f}s"
+            )
+
+
+def first_text_by_id(data: pd.DataFrame) -> Dict[str, str]:
+    """
+    ID -> text の辞書. 同じIDが複数あれば最初の行を優先する
+    """
+    data = data[["id", "text"]].drop_duplicates(["id"])
+    return dict(zip(data["id"], data["text"]))
+
+
+def build_text_lookups(
+    data: pd.DataFrame, data_dup: pd.DataFrame, args: argparse.Namespace
+) -> Dict[str, dict]:
+    """
+    XMLの各stringを探索するための辞書を実行ごとに一度だけ作る
+    Returns:
+        all: ID -> text
+        dup: 重複が疑われるIDの ID -> text
+        file: ファイル名 -> (ID -> text)
+        module_file: (モジュール名, ファイル名) -> (ID -> text). legacy_id のときのみ
+        module: モジュール名 -> (ID -> text). legacy_id のときのみ
+    """
+    lookups = dict(all=first_text_by_id(data), dup=first_text_by_id(data_dup))
+    if args.legacy_id:
+        lookups["module_file"] = {
+            k: first_text_by_id(g)
+            for k, g in data.groupby(["module", "file"], sort=False)
+        }
+        lookups["module"] = {
+            k: first_text_by_id(g) for k, g in data.groupby("module", sort=False)
+        }
+    elif not args.missing_modulewise:
+        lookups["file"] = {
+            k: first_text_by_id(g) for k, g in data.groupby("file", sort=False)
+        }
+    return lookups
+
+
+def select_text_lookup(
+    lookups: Dict[str, dict],
+    module_name: str,
+    en_xml_name: str,
+    args: argparse.Namespace,
+) -> Mapping[str, str]:
+    """
+    XMLファイルに対応する ID -> text の辞書を選ぶ. 優先順位は従来の DataFrame の部分集合と同じ
+    """
+    if args.legacy_id:
+        lookup = lookups["module_file"].get((module_name, en_xml_name))
+        if lookup is None:
+            warnings.warn(
+                f"no match entries with {en_xml_name}! subsettings skipped, which cause a bit low performance."
+            )
+            lookup = lookups["module"].get(module_name, dict())
+    elif args.missing_modulewise:
+        lookup = lookups["all"]
+    else:
+        lookup = ChainMap(lookups["file"].get(en_xml_name, dict()), lookups["dup"])
+        if len(lookup) == 0:
+            lookup = lookups["all"]
+            warnings.warn(
+                f"no match entries with {en_xml_name}! subsettings skipped, which cause a bit low performance."
+            )
+    # TODO: language files get messed since v1.2.
+    # ファイルごとに分けることが無意味になった. IDさえ一意ならいいので元のファイルの分け方を守る必要もなさそうだが, 正誤率を知りたいのでこうする
+    return lookup
+
+
+def source_language_xmls(args: argparse.Namespace, module_name: str) -> List[Path]:
+    """
+    ゲーム本体のモジュールにある翻訳対象の言語ファイル
+    """
+    base_langauge_path = (
+        f"""Modules/{module_name}/ModuleData/languages/{args.langshort}"""
+    )
+    return [
+        x
+        for x in args.mb2dir.joinpath(base_langauge_path).glob("*.xml")
+        if x.name
+        not in ["language_data.xml", f"{args.langshort.lower()}_functions.xml"]
+    ]
+
+
+def correct_xml_translations_with_count(
+    xml: ET.ElementTree,
+    lookup: Mapping[str, str],
+    module_name: str,
+    xml_path: Path,
+    args: argparse.Namespace,
+) -> Tuple[int, int, Set[str]]:
+    """
+    指定されたXMLを修正して修正箇所の数を返す. この関数内では書き込み処理を行っていない
+    Returns:
+        変更箇所の数
+        確認箇所の数 (つまり分母)
+        一致したID
+    """
+    ids_matched: Set[str] = set()
+    if xml.find("tags/tag").attrib["language"] != args.langid:
+        xml.xpath("tags").append(generate_tag_element(args.langid))
+    if args.langalias is not None:
+        xml.xpath("tags").append(generate_tag_element(args.langalias))
+    if xml.find("strings") is not None:
+        n_change_xml, n_entries_xml = (0, 0)
+        for string in xml.xpath("strings/string"):
+            text = lookup.get(string.attrib["id"], "")
+            n_entries_xml += 1
+            if text != "":
+                ids_matched.add(string.attrib["id"])
+                new_str = removeannoyingchars(text)
+                if string.attrib["text"] != new_str or args.all_entries:
+                    string.attrib["text"] = new_str
+                    n_change_xml += 1
+            else:
+                report.note(
+                    "id_not_found",
+                    "ID not found: {} in {}/{}",
+                    string.attrib["id"],
+                    module_name,
+                    xml_path.name,
+                    warning=args.legacy_id,
+                )
+                normalized_str = removeannoyingchars(string.attrib["text"])
+                if normalized_str != string.attrib["text"]:
+                    report.note(
+                        "irregular_characters",
+                        "this text could contain irregular characters (some control characters or zenkaku blanks): {}",
+                        string.attrib["text"],
+                        warning=True,
+                    )
+                    n_change_xml += 1
+                    string.attrib["text"] = normalized_str
+            if args.with_id:
+                string.attrib["text"] = (
+                    f"""[{string.attrib['id']}]{string.attrib['text']}"""
+                )
+        if n_entries_xml > 0:
+            report.note(
+                "changed_entries",
+                "{}/{} ({:.0%}) text entries are changed in {}",
+                n_change_xml,
+                n_entries_xml,
+                n_change_xml / n_entries_xml,
+                xml_path.name,
+            )
+        else:
+            report.note(
+                "no_translation_entries",
+                "no translation entries in {}",
+                xml_path.name,
+            )
+    else:
+        report.note(
+            "no_strings_tag",
+            "{} is has no strings tag! processing skipped",
+            xml_path,
+            warning=True,
         )
-    d_leftover = (
-        d[["id", "text"]]
-        .merge(d_used, on=["id"], how="outer", indicator=True)
-        .loc[lambda d: d["_merge"] != "both"]
-        .drop(columns=["_merge"])
-        .drop_duplicates()
+
+    return (n_change_xml, n_entries_xml, ids_matched)
+
+
+def geneatae_en_xml_names(p: Path, args: argparse.Namespace) -> pd.Series:
+    return (
+        pd.Series(p.with_suffix("").name).str.replace(
+            f"""{args.filename_sep}{args.langsuffix}""", ""
+        )[0]
+        + ".xml"
     )
-    if not args.suppress_missing_id and not args.missing_modulewise > 0:
-        write_missings(n_entries_total, d_leftover, output_dir, args)
 
 
 def correct_xml_in_folder_with_counting_and_writing(
     data: pd.DataFrame,
-    data_dup: pd.DataFrame,
+    text_lookups: Dict[str, dict],
     module_name: str,
     output_dir: Path,
     run_type: str,
     args: argparse.Namespace,
-) -> Tuple[int, int, pd.DataFrame]:
+    manifest: ExportManifest,
+    ids_cache: ParseCache,
+    df_original: Optional[pd.DataFrame] = None,
+) -> Tuple[int, int, Set[str]]:
     """
-    モジュール(≒フォルダ)単位の置換処理をして変更箇所の数を返す. ファイルの書き込みもここで行う
+    モジュール(≒フォルダ)単位の置換処理をして変更箇所の数を返す. ファイルの書き込みもここで行う.
+    入力が前回から変わっていないファイルは読み書きせず, manifest に記録した件数を使う.
+    `df_original` は未翻訳IDの確認に使う原文と公式訳の表
     Returns:
         変更箇所の数
         確認箇所の数
-        使用したIDのDF
+        使用したIDの集合
+    """
+    return start_module_export(
+        data,
+        text_lookups,
+        module_name,
+        output_dir,
+        run_type,
+        args,
+        manifest,
+        ids_cache,
+        df_original,
+    )()
+
+
+def start_module_export(
+    data: pd.DataFrame,
+    text_lookups: Dict[str, dict],
+    module_name: str,
+    output_dir: Path,
+    run_type: str,
+    args: argparse.Namespace,
+    manifest: ExportManifest,
+    ids_cache: ParseCache,
+    df_original: Optional[pd.DataFrame] = None,
+    executor: Optional[Executor] = None,
+    writer: Optional[XMLWriteQueue] = None,
+) -> Callable[[], Tuple[int, int, Set[str]]]:
+    """
+    `correct_xml_in_folder_with_counting_and_writing` の前半. 書き直すファイルを決めて処理を始め,
+    残り (結果の集計, language_data.xml と未翻訳IDの書き出し) を行う関数を返す.
+    `executor` があればファイルごとの読み込み・置換・書き込みを `init_export_worker` で初期化したワーカーに任せる.
+    なければこのプロセスで処理し, `writer` があれば書き込みだけをスレッドに回す.
+    返した関数を呼んだ順に集計するので, 出力は逐次処理と同じになる
     """
     n_changes: int = 0
     n_entries: int = 0
     base_langauge_path = (
         f"""Modules/{module_name}/ModuleData/languages/{args.langshort}"""
     )
-    xml_list: List[Path] = [
-        x
-        for x in args.mb2dir.joinpath(base_langauge_path).glob("*.xml")
-        if x.name
-        not in ["language_data.xml", f"{args.langshort.lower()}_functions.xml"]
-    ]
+    xml_list = source_language_xmls(args, module_name)
 
-    def correct_xml_translations_with_count(
-        xml: ET.ElementTree,
-        data: pd.DataFrame,
-        module_name: str,
-        xml_path: Path,
-        args: argparse.Namespace,
-    ) -> Tuple[int, int, pd.DataFrame]:
-        """
-        指定されたXMLを修正して修正箇所の数を返す. この関数内では書き込み処理を行っていない
-        Returns:
-            変更箇所の数
-            確認箇所の数 (つまり分母)
-            一致したID
-        """
-        ids_matched: List[str] = []
-        if xml.find("tags/tag").attrib["language"] != args.langid:
-            xml.xpath("tags").append(generate_tag_element(args.langid))
-        if args.langalias is not None:
-            xml.xpath("tags").append(generate_tag_element(args.langalias))
-        if xml.find("strings") is not None:
-            n_change_xml, n_entries_xml = (0, 0)
-            for string in xml.xpath("strings/string"):
-                tmp = data.loc[lambda d: d["id"] == string.attrib["id"]]
-                n_entries_xml += 1
-                if tmp.shape[0] > 0 and tmp["text"].values[0] != "":
-                    ids_matched += [string.attrib["id"]]
-                    new_str = removeannoyingchars(tmp["text"].values[0])
-                    if string.attrib["text"] != new_str or args.all_entries:
-                        string.attrib["text"] = new_str
-                        n_change_xml += 1
-                else:
-                    if args.legacy_id:
-                        warnings.warn(
-                            f"""ID not found: {string.attrib["id"]} in {module_name}/{xml_path.name}"""
-                        )
-                    elif args.verbose:
-                        warnings.warn(
-                            f"""ID not found: {string.attrib["id"]} in {module_name}/{xml_path.name}"""
-                        )
-                    normalized_str = removeannoyingchars(string.attrib["text"])
-                    if normalized_str != string.attrib["text"]:
-                        warnings.warn(
-                            f"""this text could contain irregular characters (some control characters or zenkaku blanks): {string.attrib['text']}""",
-                            UserWarning,
-                        )
-                        n_change_xml += 1
-                        string.attrib["text"] = normalized_str
-                    if args.distinct:
-                        html.unescape((ET.tostring(string, encoding="unicode")))
-                if args.with_id:
-                    string.attrib["text"] = (
-                        f"""[{string.attrib['id']}]{string.attrib['text']}"""
-                    )
-            if n_entries_xml > 0:
-                print(
-                    f"""{n_change_xml}/{n_entries_xml} ({100 * n_change_xml/n_entries_xml:.0f} %) text entries are changed in {xml_path.name}"""
+    d_matched: Set[str] = set()
+    if len(xml_list) == 0:
+        print(f"""No language files found inside {base_langauge_path}""")
+        return lambda: (n_changes, n_entries, d_matched)
+    if not output_dir.exists() and len(xml_list) > 0 and not args.plan:
+        output_dir.mkdir(parents=True)
+    # 出力ファイルごとの (language_data.xml に載せるパス, 書き直すなら (元のファイル, 出力先, 指紋, 結果))
+    language_files: List[Tuple[str, Optional[Tuple[Path, Path, str, Future]]]] = []
+    for xml_path in xml_list:
+        output_fp = output_dir.joinpath(xml_path.name)
+        en_xml_name = geneatae_en_xml_names(xml_path, args)
+        lookup = select_text_lookup(text_lookups, module_name, en_xml_name, args)
+        ids = read_string_ids(xml_path, module_name, ids_cache)
+        fingerprint = fingerprint_language_xml(xml_path, ids, lookup, args)
+        language_file_path = language_data_path(
+            args, run_type, module_name, xml_path.name
+        )
+        record = None if args.force else manifest.lookup(output_fp, fingerprint)
+        if record is not None:
+            report.note("unchanged_files", "{} is unchanged", xml_path.name)
+            d_matched |= {id for id in ids if lookup.get(id, "") != ""}
+            n_changes += record["n_changes"]
+            n_entries += record["n_entries"]
+            language_files.append((language_file_path, None))
+            continue
+        manifest.stale.append(output_fp)
+        if args.plan:
+            language_files.append((language_file_path, None))
+            continue
+        report.note(
+            "read_files", "Reading {} from {} Module", xml_path.name, module_name
+        )
+        if executor is None:
+            result = Future()
+            result.set_result(
+                (
+                    rewrite_language_file(
+                        xml_path, output_fp, module_name, lookup, args, writer
+                    ),
+                    None,
                 )
-            else:
-                print(f"""no translation entries in {xml_path.name}""")
+            )
         else:
-            warnings.warn(f"{xml_path} is has no strings tag! processing skipped")
-
-        return (n_change_xml, n_entries_xml, pd.DataFrame({"id": ids_matched}))
-
-    def geneatae_en_xml_names(p: Path, args: argparse.Namespace) -> pd.Series:
-        return (
-            pd.Series(p.with_suffix("").name).str.replace(
-                f"""{args.filename_sep}{args.langsuffix}""", ""
-            )[0]
-            + ".xml"
+            result = executor.submit(
+                rewrite_language_file_in_worker,
+                xml_path,
+                output_fp,
+                module_name,
+                en_xml_name,
+            )
+        language_files.append(
+            (language_file_path, (xml_path, output_fp, fingerprint, result))
         )
 
-    d_matched = pd.DataFrame({"id": []})
-    if len(xml_list) > 0:
-        if not output_dir.exists() and len(xml_list) > 0:
-            output_dir.mkdir(parents=True)
+    def finish() -> Tuple[int, int, Set[str]]:
+        nonlocal n_changes, n_entries, d_matched
+        if writer is not None:
+            # manifest に書き込み後の状態を記録するので, ここまでに書き終えておく
+            writer.drain()
         language_data = generate_language_data_xml(
             module_name, lang_id=args.langid, subtitle=args.subtitleext, iso=args.iso
         )
-        for xml_path in xml_list:
-            print(
-                f"""Reading {xml_path.name} from {xml_path.parent.parent.parent.parent.name} Module"""
-            )
-            # edit language_data.xml
-            xml = ET.parse(xml_path)
-            en_xml_name = geneatae_en_xml_names(xml_path, args)
-            # TODO: refactoring
-            if args.legacy_id:
-                d_sub = data.loc[
-                    lambda d: (d["module"] == module_name) & (d["file"] == en_xml_name)
-                ]
-                if d_sub.shape[0] == 0:
-                    warnings.warn(
-                        f"no match entries with {en_xml_name}! subsettings skipped, which cause a bit low performance."
-                    )
-                    d_sub = data.loc[lambda d: (d["module"] == module_name)]
-            else:
-                if args.missing_modulewise:
-                    d_sub = data
-                else:
-                    d_sub = pd.concat(
-                        (data.loc[lambda d: d["file"] == en_xml_name], data_dup)
+        for language_file_path, rewriting in language_files:
+            if rewriting is not None:
+                xml_path, output_fp, fingerprint, result = rewriting
+                counts, report_state = result.result()
+                if report_state is not None:
+                    report.merge(report_state)
+                if counts is None:
+                    report.note(
+                        "no_base_tag",
+                        "{} has no base tag! processing skipped",
+                        xml_path,
+                        warning=True,
                     )
-                    d_sub = d_sub[["id", "text"]].drop_duplicates()
-                    if d_sub.shape[0] == 0:
-                        d_sub = data
-                        warnings.warn(
-                            f"no match entries with {en_xml_name}! subsettings skipped, which cause a bit low performance."
-                        )
-                # TODO: language files get messed since v1.2.
-                # ファイルごとに分けることが無意味になった. IDさえ一意ならいいので元のファイルの分け方を守る必要もなさそうだが, 正誤率を知りたいのでこうする
-            if xml.getroot().tag == "base":
-                n_change_xml, n_entries_xml, ids_matched = (
-                    correct_xml_translations_with_count(
-                        xml, d_sub, module_name, xml_path, args
-                    )
-                )
-                d_matched = pd.concat((d_matched, ids_matched)).drop_duplicates()
+                    continue
+                n_change_xml, n_entries_xml, ids_matched = counts
+                d_matched |= ids_matched
                 n_changes += n_change_xml
                 n_entries += n_entries_xml
-                language_data.getroot().append(
-                    generate_languageFile_element(
-                        f"{Path('/'.join([args.langfolder_output, module_name if run_type == 'module' else '', xml_path.name])).as_posix()}"
-                    )
-                )
-                write_xml_with_default_setting(
-                    xml, output_dir.joinpath(f"""{xml_path.name}""")
+                manifest.put(
+                    output_fp,
+                    fingerprint,
+                    n_changes=n_change_xml,
+                    n_entries=n_entries_xml,
                 )
-            else:
-                warnings.warn(f"{xml_path} has no base tag! processing skipped")
-        write_xml_with_default_setting(
-            language_data, output_dir.joinpath("language_data.xml")
-        )
+            language_data.getroot().append(
+                generate_languageFile_element(language_file_path)
+            )
         if not args.suppress_missing_id and args.missing_modulewise:
             print(f"------ Checking missing IDs in {module_name} ---------")
-            df_original = pd.read_excel("text/MB2BL-JP.xlsx")
+            # plan でも件数と language_data.xml の記載は実際に書き出すときと同じにする
             n_missings = output_missings_modulewise(
                 args,
                 output_dir,
                 module_name,
                 data.loc[lambda d: d["module"] == module_name],
+                manifest,
                 df_original,
             )
-            print(f"{n_missings} missing IDs found!")
+            print(f"{0 if n_missings is None else n_missings} missing IDs found!")
             if n_missings is not None:
                 n_entries += n_missings
                 n_changes += n_missings
+                language_data.getroot().append(
+                    generate_languageFile_element(
+                        language_data_path(
+                            args,
+                            run_type,
+                            module_name,
+                            f"translation-missings-{args.langshort}.xml",
+                        )
+                    )
+                )
+        write_xml_if_changed(
+            language_data, output_dir.joinpath("language_data.xml"), manifest, args
+        )
+        return (n_changes, n_entries, d_matched)
+
+    return finish
+
+
+def language_data_path(
+    args: argparse.Namespace, run_type: str, module: str, fname: str
+) -> str:
+    """
+    language_data.xml の LanguageFile に書く, 言語フォルダからのパス
+    """
+    return Path(
+        "/".join(
+            [args.langfolder_output, module if run_type == "module" else "", fname]
+        )
+    ).as_posix()
+
+
+def rewrite_language_file(
+    xml_path: Path,
+    output_fp: Path,
+    module_name: str,
+    lookup: Mapping[str, str],
+    args: argparse.Namespace,
+    writer: Optional[XMLWriteQueue] = None,
+) -> Optional[Tuple[int, int, Set[str]]]:
+    """
+    言語ファイルを1つ読んで訳を置き換え, 書き出す. `writer` があれば書き出しはそちらに任せる
+    Returns: `correct_xml_translations_with_count` の結果. base タグがなければ None
+    """
+    xml = ET.parse(xml_path)
+    if xml.getroot().tag != "base":
+        return None
+    counts = correct_xml_translations_with_count(
+        xml, lookup, module_name, xml_path, args
+    )
+    if writer is None:
+        write_xml_with_default_setting(xml, output_fp)
     else:
-        print(f"""No language files found inside {base_langauge_path}""")
+        writer.write(xml, output_fp)
+    return counts
+
+
+# --jobs のワーカープロセスが最初に一度だけ受け取る ID -> text の辞書とオプション
+worker_state: Dict[str, Any] = dict()
+
+
+def init_export_worker(
+    text_lookups: Dict[str, dict], args: argparse.Namespace, verbosity: int
+) -> None:
+    worker_state.update(text_lookups=text_lookups, args=args, verbosity=verbosity)
+
+
+def rewrite_language_file_in_worker(
+    xml_path: Path, output_fp: Path, module_name: str, en_xml_name: str
+) -> Tuple[Optional[Tuple[int, int, Set[str]]], tuple]:
+    """
+    ワーカープロセスで `rewrite_language_file` を実行する. 記録した内容は親プロセスで `report.merge` する
+    """
+    args = worker_state["args"]
+    lookup = select_text_lookup(
+        worker_state["text_lookups"], module_name, en_xml_name, args
+    )
+    report.reset(verbosity=worker_state["verbosity"])
+    counts = rewrite_language_file(xml_path, output_fp, module_name, lookup, args)
+    return counts, report.state()
+
+
+def read_string_ids(
+    xml_path: Path, module_name: str, ids_cache: ParseCache
+) -> List[str]:
+    """
+    言語ファイルの string の ID の一覧. `read_vanilla_XML.py` と同じキャッシュを使う
+    """
+    cached = ids_cache.get(xml_path)
+    if cached is None:
+        packed = read_language_strings_packed(xml_path)
+        ids_cache.put(xml_path, packed, file=xml_path.name, module=module_name)
+    else:
+        packed = cached[:4]
+    ids, _, _ = unpack_language_strings(packed)
+    return ids
 
-    return (n_changes, n_entries, d_matched)
+
+def fingerprint_language_xml(
+    xml_path: Path,
+    ids: List[str],
+    lookup: Mapping[str, str],
+    args: argparse.Namespace,
+) -> str:
+    """
+    出力ファイルの内容を決める入力 (書き出し方の版, 元のXML, 含まれるIDの翻訳, オプション) のハッシュ
+    """
+    h = hashlib.sha256()
+    h.update(f"{EXPORT_FORMAT_VERSION}\0".encode("utf-8"))
+    h.update(hash_file(xml_path).encode("utf-8"))
+    h.update(
+        json.dumps(
+            {k: getattr(args, k, None) for k in FINGERPRINT_OPTIONS}, ensure_ascii=False
+        ).encode("utf-8")
+    )
+    for id in ids:
+        h.update(b"\0")
+        h.update(lookup.get(id, "").encode("utf-8"))
+    return h.hexdigest()
 
 
 def write_missings(
@@ -470,15 +1166,10 @@ def write_missings(
                 f"{args.langfolder_output}/Missings/str_missings-{args.langsuffix}.xml"
             )
         )
-        xml_str_missings = generate_string_xml([args.langid])
-        for _, r in df_leftover.iterrows():
-            new_entry = generate_new_string_element(
-                r["id"], removeannoyingchars(r["text"])
-            )
-            xml_str_missings.find("strings").append(new_entry)
-        write_xml_with_default_setting(
-            xml_str_missings,
+        write_string_xml(
             output_dir.joinpath(f"""str_missings-{args.langsuffix}.xml"""),
+            [args.langid],
+            missing_strings(df_leftover),
         )
         write_xml_with_default_setting(
             language_data_missings, output_dir.joinpath("""language_data.xml""")
@@ -501,45 +1192,43 @@ def output_missings_modulewise(
     output_dir: Path,
     module: str,
     df: pd.DataFrame,
+    manifest: ExportManifest,
     df_original: Optional[pd.DataFrame] = None,
-) -> pd.DataFrame:
+) -> Optional[int]:
     """
-    a
+    公式訳のないIDの訳を `translation-missings-<langshort>.xml` に書き出す.
+    内容が前回書き出したときと同じなら書き直さない. plan なら書き出す予定として記録するだけにする.
+    language_data.xml への追加は呼び出し側で行う
+    Returns: ファイルに載る数. なければ None
     """
     if df_original is not None:
-        ids = df_original.loc[
-            lambda d: (d["text_JP_original"] == "") | d["text_JP_original"].isna()
-        ][["id"]]
+        col = f"text_{args.langshort}_original"
+        ids = df_original.loc[lambda d: (d[col] == "") | d[col].isna()][["id"]]
         d_sub = df.merge(ids, on="id", how="inner")
     elif "is_missing" in df.columns:
-        d_sub = df.loc[lambda d: d["id_missing"]]
+        d_sub = df.loc[lambda d: d["is_missing"]]
     else:
         return None
     if d_sub.shape[0] < 1:
         return None
-    xml = generate_string_xml([args.langid])
-    strings = xml.findall("strings")
-    for _, r in d_sub.iterrows():
-        strings.append(
-            generate_new_string_element(r["id"], removeannoyingchars(r["text"]))
-        )
-    write_xml_with_default_setting(
-        xml, output_dir.joinpath(f"translation-missings-{args.langshort}.xml")
-    )
-    with output_dir.joinpath("language_data.xml") as fp:
-        xml_lang_data = ET.parse(fp)
-    lang_data_xml = xml_lang_data.find("LanguageData")
-    new_entry = generate_languageFile_element(
-        path=f"{args.langshort}/{module}/translation-missings-{args.langfolder_output}.xml"
-    )
-    lang_data_xml.append(new_entry)
-    lang_data_xml.write(
-        output_dir.joinpath("language_data.xml"),
-        pretty_print=True,
-        xml_declaration=True,
-        encoding="utf-8",
-    )
-    return d_sub.shape[0]
+    output_fp = output_dir.joinpath(f"translation-missings-{args.langshort}.xml")
+    strings = list(missing_strings(d_sub))
+    h = hashlib.sha256(f"{EXPORT_FORMAT_VERSION}\0{args.langid}".encode("utf-8"))
+    for id, text in strings:
+        h.update(f"\0{id}\0{text}".encode("utf-8"))
+    fingerprint = h.hexdigest()
+    if not args.force and manifest.lookup(output_fp, fingerprint) is not None:
+        report.note("unchanged_files", "{} is unchanged", output_fp.name)
+        return len(strings)
+    manifest.stale.append(output_fp)
+    if not args.plan:
+        write_string_xml(output_fp, [args.langid], strings)
+        manifest.put(output_fp, fingerprint, n_entries=len(strings))
+    return len(strings)
+
+
+def missing_strings(d: pd.DataFrame) -> Iterable[Tuple[str, str]]:
+    return ((id, removeannoyingchars(text)) for id, text in zip(d["id"], d["text"]))
 
 
 def drop_new_duplication_error_manually(
@@ -551,7 +1240,7 @@ def drop_new_duplication_error_manually(
     if string.attrib["id"] in id_list:
         id_ = string.attrib["id"]
         string.getparent().remove(string)
-        print(f"!! duplicated ID ({id_}) dropprd")
+        report.note("duplicated_id_dropped", "!! duplicated ID ({}) dropprd", id_)
         return True
     else:
         return False
@@ -585,52 +1274,51 @@ def generate_language_data_xml(
     return ET.ElementTree(language_data)
 
 
-def generate_string_xml(langids: List[str]) -> ET.ElementTree:
-    """
-    a
-    """
-    xml = ET.fromstring(
-        """
-        <base>
-        <tags></tags>
-        <strings></strings>
-        </base>
-        """
-    )
-    _ = [xml.find("tags").append(ET.fromstring(f'<tag id="{id}" />')) for id in langids]
-    return ET.ElementTree(xml)
-
-
 def generate_tag_element(lang_id: str) -> ET.ElementTree:
     """
     a
     """
-    return ET.fromstring(f'<tag language="{lang_id}" />')
+    return ET.Element("tag", language=lang_id)
 
 
 def generate_languageFile_element(path: str) -> ET.ElementTree:
     """
     a
     """
-    return ET.fromstring(f'<LanguageFile xml_path="{path}" />')
+    return ET.Element("LanguageFile", xml_path=path)
 
 
 def generate_new_string_element(loc_id: str, text: str):
     """
     a
     """
-    new_entry = ET.fromstring("""<string id="PLAHECOLHDER" text="[PLACEHOLDER]" />""")
-    new_entry.attrib["id"] = loc_id
-    new_entry.attrib["text"] = text
-    return new_entry
+    return ET.Element("string", id=loc_id, text=text)
 
 
 def write_xml_with_default_setting(xml: ET.ElementTree, fpath: Path) -> bool:
     """
     a
     """
-    ET.indent(xml, space="  ", level=0)
-    xml.write(fpath, pretty_print=True, xml_declaration=True, encoding="utf-8")
+    write_xml_atomic(xml, fpath)
+    return True
+
+
+def write_xml_if_changed(
+    xml: ET.ElementTree,
+    fpath: Path,
+    manifest: ExportManifest,
+    args: argparse.Namespace,
+) -> bool:
+    """
+    `write_xml_with_default_setting` と同じ内容を, 既存のファイルと異なるときだけ書き込む
+    Returns: 書き込んだ (plan なら書き込む予定の) とき True
+    """
+    content = serialize_xml(xml)
+    if not args.force and fpath.exists() and fpath.read_bytes() == content:
+        return False
+    manifest.stale.append(fpath)
+    if not args.plan:
+        write_bytes_atomic(content, fpath)
     return True
 
 
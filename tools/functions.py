@@ -1,17 +1,21 @@
 #! /usr/bin/env python3
 # encoding: utf-8
 import argparse
-import copy
+import textwrap
 import warnings
+from copy import deepcopy
 from datetime import datetime, timezone
 from pathlib import Path
-from typing import List, Optional, TypedDict
+from typing import Callable, Dict, Iterator, List, Optional, Tuple, TypedDict
 
+import lxml.etree as ET
 import numpy as np
 import pandas as pd
 import polib
 import regex
 import yaml
+from run_report import report
+from translation_memory import THRESHOLD, TranslationMemory, suggest_translations
 
 
 class dict_name_attr(TypedDict):
@@ -267,6 +271,195 @@ FILTERS: List[dict_name_attr] = [
 ]
 
 
+class compiled_filter(TypedDict):
+    params: dict_name_attr
+    tag: str
+    attrs: Tuple[str, ...]
+    ancestor: Optional[str]
+    direct_child: bool
+    xslt_class: str
+    xslt: ET.XPath
+
+
+XSL_NAMESPACES = {"xsl": "http://www.w3.org/1999/XSL/Transform"}
+match_filter_xpath = regex.compile(
+    r"^\.//(?:(?P<ancestor>\w+)(?P<axis>//?))?(?P<tag>\w+)(?P<attrs>(?:\[@\w+\])*)$"
+)
+
+
+def compile_filters(filters: List[dict_name_attr]) -> List[compiled_filter]:
+    """
+    FILTERS の XPath を タグ名, 必須属性, 親(祖先)要素の条件に分解する.
+    XSLT 用の `contains(@match, ...)` だけはXPathのままコンパイルしておく
+    """
+    compiled = []
+    for params in filters:
+        m = match_filter_xpath.match(params["xpath"])
+        if m is None:
+            raise ValueError(f"""unsupported xpath in FILTERS: {params['xpath']}""")
+        xslt_class = params["context"].split(".")[0]
+        compiled += [
+            compiled_filter(
+                params=params,
+                tag=m.group("tag"),
+                attrs=tuple(regex.findall(r"@(\w+)", m.group("attrs"))),
+                ancestor=m.group("ancestor"),
+                direct_child=m.group("axis") == "/",
+                xslt_class=xslt_class,
+                xslt=ET.XPath(
+                    f""".//xsl:template[contains(@match, "{xslt_class}")]//xsl:attribute[@name='{params['key']}']""",
+                    namespaces=XSL_NAMESPACES,
+                ),
+            )
+        ]
+    return compiled
+
+
+COMPILED_FILTERS: List[compiled_filter] = compile_filters(FILTERS)
+COMPILED_FILTERS_BY_TAG: Dict[str, List[int]] = dict()
+for _i, _f in enumerate(COMPILED_FILTERS):
+    COMPILED_FILTERS_BY_TAG.setdefault(_f["tag"], []).append(_i)
+del _i, _f
+
+
+def parse_xml(fpath: Path) -> ET._ElementTree:
+    """
+    ファイルハンドルを確実に閉じて XML/XSLT を読み込む
+    """
+    with fpath.open("r", encoding="utf-8") as f:
+        return ET.parse(f)
+
+
+def _match_compiled_filter(
+    element: ET._Element, root: ET._Element, f: compiled_filter
+) -> bool:
+    for attr in f["attrs"]:
+        if attr not in element.attrib:
+            return False
+    if f["ancestor"] is None:
+        return True
+    if f["direct_child"]:
+        parent = element.getparent()
+        return parent is not root and parent.tag == f["ancestor"]
+    return any(x is not root for x in element.iterancestors(f["ancestor"]))
+
+
+def extract_filter_entries(
+    xml: ET._ElementTree, filetype: str = "xml"
+) -> List[Tuple[dict_name_attr, List[ET._Element]]]:
+    """
+    FILTERS に該当する要素を取り出す. 該当する要素のあったフィルタだけを FILTERS の順に返す.
+    XMLは木を一度だけ走査してタグ名でフィルタに振り分ける. 要素の順序は XPath と同じ文書順になる.
+    XSLTは `xsl:template/@match` と `xsl:attribute/@name` に現れないフィルタを評価しない
+    """
+    found: Dict[int, List[ET._Element]] = dict()
+    if filetype == "xml":
+        root = xml.getroot() if isinstance(xml, ET._ElementTree) else xml
+        # .// はルート要素自身には一致しないので子要素がなければ何もしなくてよい
+        if len(root) > 0:
+            for element in root.iter(*COMPILED_FILTERS_BY_TAG.keys()):
+                if element is root:
+                    continue
+                for i in COMPILED_FILTERS_BY_TAG[element.tag]:
+                    if _match_compiled_filter(element, root, COMPILED_FILTERS[i]):
+                        found.setdefault(i, []).append(element)
+    elif filetype == "xslt":
+        matches = " ".join(
+            xml.xpath(".//xsl:template/@match", namespaces=XSL_NAMESPACES)
+        )
+        names = set(xml.xpath(".//xsl:attribute/@name", namespaces=XSL_NAMESPACES))
+        for i, f in enumerate(COMPILED_FILTERS):
+            if f["params"]["key"] in names and f["xslt_class"] in matches:
+                elements = f["xslt"](xml)
+                if len(elements) > 0:
+                    found[i] = elements
+    else:
+        raise ValueError(f"filetype must be `xml` or `xslt`: {filetype}")
+    return [(COMPILED_FILTERS[i]["params"], found[i]) for i in sorted(found)]
+
+
+def iter_language_strings(
+    fpath: Path, strict_path: bool = True, has_strings: Optional[List[bool]] = None
+) -> Iterator[Tuple[str, str]]:
+    """
+    言語ファイルの `<string id="..." text="..." />` を (id, text) として逐次返す.
+    読み終えた要素はその場で破棄するのでファイルの大きさによらずメモリ使用量はほぼ一定.
+    strict_path: True ならルート直下の `strings/string` のみ, False なら任意の深さの `strings/string`
+    has_strings: 渡されたらファイルに該当する `strings` 要素があったかどうかを末尾に追加する
+    """
+    found = False
+    last_parent = None
+    is_target = False
+    for _, element in ET.iterparse(
+        str(fpath), events=("end",), tag=("string", "strings")
+    ):
+        parent = element.getparent()
+        # 兄弟要素は同じ親を持つので親が変わったときだけ位置を確かめる
+        if parent is not last_parent:
+            if parent is None:
+                continue
+            if element.tag == "strings":
+                found = found or not strict_path or parent.getparent() is None
+                continue
+            last_parent = parent
+            grandparent = parent.getparent()
+            is_target = (
+                parent.tag == "strings"
+                and grandparent is not None
+                and (not strict_path or grandparent.getparent() is None)
+            )
+        if is_target:
+            loc_id = element.get("id")
+            text = element.get("text")
+            if loc_id is not None and text is not None:
+                yield (loc_id, text)
+        parent.remove(element)
+    if has_strings is not None:
+        has_strings.append(found)
+
+
+def read_language_strings(
+    fpath: Path, strict_path: bool = True
+) -> Tuple[List[str], List[str], bool]:
+    """
+    `iter_language_strings` の結果を列ごとのリストにまとめる
+    Returns:
+        ID のリスト
+        テキストのリスト
+        `strings` 要素があったかどうか
+    """
+    has_strings: List[bool] = []
+    ids: List[str] = []
+    texts: List[str] = []
+    for loc_id, text in iter_language_strings(fpath, strict_path, has_strings):
+        ids.append(loc_id)
+        texts.append(text)
+    return (ids, texts, has_strings[0])
+
+
+def read_language_strings_packed(
+    fpath: Path, strict_path: bool = True
+) -> Tuple[str, str, int, bool]:
+    """
+    プロセス間で受け渡すために `read_language_strings` の結果を NUL 区切りの文字列に詰める.
+    XML の属性値に NUL 文字は現れないので区切りとして安全
+    """
+    ids, texts, has_strings = read_language_strings(fpath, strict_path)
+    return ("\0".join(ids), "\0".join(texts), len(ids), has_strings)
+
+
+def unpack_language_strings(
+    packed: Tuple[str, str, int, bool],
+) -> Tuple[List[str], List[str], bool]:
+    """
+    `read_language_strings_packed` の結果を `read_language_strings` と同じ形に戻す
+    """
+    ids, texts, n, has_strings = packed
+    if n == 0:
+        return ([], [], has_strings)
+    return (ids.split("\0"), texts.split("\0"), has_strings)
+
+
 control_char_remove = regex.compile(r"\p{C}")
 match_public_id_legacy = regex.compile(r"^(.+?/.+?/.+?)/.*$")
 match_file_name_id_legacy = regex.compile(r"^.+?/(.+?)/.+?/.*$")
@@ -275,6 +468,18 @@ match_prefix_id = regex.compile(r"^\[.+?\](.*)$")
 
 match_public_id = regex.compile(r"^(.+?)/.+$")
 match_string = regex.compile(r"^.+?/(.+)$")
+suffix_facial = regex.compile(r"(\[ib:.+\]|\[if:.+\])")  # against v1.2 updates
+match_string_id = regex.compile(r"^\{=(.+?)\}(.*)$")
+
+
+def split_string_id(string: str) -> Tuple[str, str]:
+    """
+    `{=ID}text` を ID と text に分ける. ID がなければ ID は空文字列.
+    Mod の XML から読み込むとき (`non_language_xml_to_pddf`) と同じ規則で分ける
+    """
+    if match_string_id.search(string) is None:
+        return ("", string)
+    return (match_string_id.sub(r"\1", string), match_string_id.sub(r"\2", string))
 
 
 def merge_yml(
@@ -307,15 +512,73 @@ def merge_yml(
     return args
 
 
-def public_po(pofile: polib.POFile) -> polib.POFile:
+def public_po(pofile: polib.POFile, copy: bool = True) -> polib.POFile:
+    """
+    msgid を公開用のIDだけにした POFile. `copy=False` なら複製せずにその場で書き換える
+    """
     # TODO: copy of metadata
     # TODO: distinction
-    pofile = copy.deepcopy(pofile)
+    if copy:
+        pofile = deepcopy(pofile)
     for entry in pofile:
         entry.msgid = match_public_id.sub(r"\1", entry.msgid)
     return pofile
 
 
+def public_po_columns(pofile: polib.POFile) -> Optional[Dict[str, list]]:
+    """
+    `public_po(pofile)` のエントリを `write_po_columns` の列にする. `pofile` は変えない.
+    `format_po_entry` で書けない項目 (obsolete, `#.` のコメント, 以前の msgid, 複数形) があれば None
+    """
+    columns = dict(
+        msgid=[], msgstr=[], msgctxt=[], flags=[], occurrences=[], tcomment=[]
+    )
+    for entry in pofile:
+        if (
+            entry.obsolete
+            or entry.comment
+            or entry.msgid_plural
+            or entry.msgstr_plural
+            or entry.previous_msgctxt is not None
+            or entry.previous_msgid is not None
+            or entry.previous_msgid_plural is not None
+        ):
+            return None
+        columns["msgid"].append(match_public_id.sub(r"\1", entry.msgid))
+        columns["msgstr"].append(entry.msgstr)
+        columns["msgctxt"].append(entry.msgctxt)
+        columns["flags"].append(entry.flags)
+        columns["occurrences"].append(entry.occurrences)
+        columns["tcomment"].append(entry.tcomment)
+    return columns
+
+
+def entries_with_source(pofile: polib.POFile) -> List[Tuple[polib.POEntry, str]]:
+    """
+    msgid が `<ID>/<原文>` のエントリとその原文. 公開用のカタログのように msgid がIDだけのエントリは
+    原文と比べられないので警告して除き, 1つも原文がなければ ValueError
+    """
+    entries = []
+    n_without_source = 0
+    for entry in pofile:
+        if entry.msgid == "" or entry.obsolete:
+            continue
+        _, sep, source = entry.msgid.partition("/")
+        if sep == "":
+            n_without_source += 1
+            continue
+        entries.append((entry, source))
+    if n_without_source > 0:
+        if len(entries) == 0:
+            raise ValueError(
+                "the msgids have no source text (`<ID>/<text>`). a public catalog cannot be checked"
+            )
+        warnings.warn(
+            f"{n_without_source} entries without source text are skipped", UserWarning
+        )
+    return entries
+
+
 def po2pddf(
     pofile: polib.POFile,
     drop_prefix_id: bool = True,
@@ -388,6 +651,140 @@ def po2pddf_easy(pofile: polib.POFile, with_id=False) -> pd.DataFrame:
     return d
 
 
+MO_MAGIC = 0x950412DE
+
+
+def read_mo_columns(fpath: Path, encoding: str = "utf-8") -> Dict[str, list]:
+    """
+    MOファイルを polib のエントリを作らずに列ごとに読む.
+    ファイルは mmap し, オフセット表は numpy でまとめて解釈する. 文字列が NUL 区切りで連続して並んでいれば
+    (polib や msgfmt の出力はそうなっている) 一度にデコードして分割し, そうでなければ1件ずつ切り出す
+    Returns: `msgid`, `msgstr`, `msgctxt` のリスト. 先頭のメタデータは除く
+    """
+    buf = np.memmap(fpath, dtype=np.uint8, mode="r")
+    if buf[:4].view("<u4")[0] == MO_MAGIC:
+        dtype = np.dtype("<u4")
+    elif buf[:4].view(">u4")[0] == MO_MAGIC:
+        dtype = np.dtype(">u4")
+    else:
+        raise IOError(f"{fpath} is not a valid MO file")
+    _, _, n, offset_ids, offset_strs = buf[:20].view(dtype)
+    n = int(n)
+
+    def decode_block(offset_table: int) -> List[str]:
+        table = buf[offset_table : offset_table + 8 * n].view(dtype).reshape(n, 2)
+        lengths = table[:, 0].astype(np.int64)
+        offsets = table[:, 1].astype(np.int64)
+        if n > 0 and np.all(offsets[1:] == offsets[:-1] + lengths[:-1] + 1):
+            block = buf[offsets[0] : offsets[-1] + lengths[-1]].tobytes()
+            strings = block.decode(encoding).split("\0")
+            if len(strings) == n:
+                return strings
+        # 複数形のエントリなど, 文字列の中に NUL がある場合
+        return [
+            buf[o : o + l].tobytes().decode(encoding)
+            for o, l in zip(offsets.tolist(), lengths.tolist())
+        ]
+
+    msgids = decode_block(int(offset_ids))
+    msgstrs = decode_block(int(offset_strs))
+    del buf
+    columns = dict(msgid=[], msgstr=[], msgctxt=[])
+    for msgid, msgstr in zip(msgids, msgstrs):
+        msgctxt, sep, msgid = msgid.rpartition("\x04")
+        if msgid == "":
+            continue
+        if "\0" in msgid:
+            # polib と同じく複数形は msgstr に入れない
+            msgid, msgstr = msgid.split("\0")[0], ""
+        columns["msgid"].append(msgid)
+        columns["msgstr"].append(msgstr)
+        columns["msgctxt"].append(msgctxt if sep else None)
+    return columns
+
+
+def write_mo_columns(
+    columns: Dict[str, list], fpath: Path, metadata: str = "", encoding: str = "utf-8"
+) -> int:
+    """
+    `write_po_columns` と同じ列から MOファイルを書く. `POFile.save_as_mofile` とバイト単位で同じ内容になる.
+    訳があり fuzzy でないエントリを (msgctxt + EOT +) msgid のUTF-8のバイト列で一度だけ並べ替え,
+    オフセット表は numpy で長さの累積和から作る. ハッシュ表は polib と同じく作らない
+    metadata: 先頭に置くメタデータのエントリの msgstr (`POFile.metadata_as_entry().msgstr`)
+    Returns: 書き込んだエントリの数. メタデータは除く
+    """
+    n = len(columns["msgid"])
+    msgctxts = columns.get("msgctxt", [None] * n)
+    flags = columns.get("flags", [[]] * n)
+    keys, values = [], []
+    for msgid, msgstr, msgctxt, flag in zip(
+        columns["msgid"], columns["msgstr"], msgctxts, flags
+    ):
+        if msgstr == "" or (flag is not None and "fuzzy" in flag):
+            continue
+        keys.append((f"{msgctxt}\x04{msgid}" if msgctxt else msgid).encode("utf-8"))
+        values.append(msgstr)
+    order = sorted(range(len(keys)), key=keys.__getitem__)
+    if encoding.lower().replace("-", "") == "utf8":
+        keys = [keys[i] for i in order]
+    else:
+        keys = [keys[i].decode("utf-8").encode(encoding) for i in order]
+    keys = [b""] + keys
+    values = [metadata.encode(encoding)] + [values[i].encode(encoding) for i in order]
+    n_entries = len(keys)
+    # ヘッダ (7個の整数), msgid と msgstr の (長さ, 位置) の表, NUL 終端の msgid, msgstr の順に並ぶ
+    keystart = 7 * 4 + 16 * n_entries
+
+    def offset_table(strings: List[bytes], start: int) -> np.ndarray:
+        lengths = np.fromiter(map(len, strings), dtype=np.int64, count=n_entries)
+        offsets = start + np.cumsum(lengths + 1) - (lengths + 1)
+        return np.stack([lengths, offsets], axis=1)
+
+    ids = b"\0".join(keys) + b"\0"
+    table_ids = offset_table(keys, keystart)
+    table_strs = offset_table(values, keystart + len(ids))
+    header = np.array(
+        [MO_MAGIC, 0, n_entries, 7 * 4, 7 * 4 + 8 * n_entries, 0, keystart],
+        dtype=np.int64,
+    )
+    with fpath.open("wb") as f:
+        # polib と同じく実行環境のバイト順で書く
+        f.write(
+            np.concatenate([header, table_ids.ravel(), table_strs.ravel()])
+            .astype(np.uint32)
+            .tobytes()
+        )
+        f.write(ids)
+        f.write(b"\0".join(values) + b"\0")
+    return n_entries - 1
+
+
+def mo2pddf(fpath: Path, drop_prefix_id: bool = True) -> pd.DataFrame:
+    """
+    `read_mo_columns` で読んだMOファイルを `po2pddf` と同じ列の `pandas.DataFrame` にする.
+    MOファイルにはコメント, フラグ, 参照箇所がないので空になる.
+    `msgid` は最初の `/` で公開IDと原文 (`text_EN`) に分ける. 公開用のMOのように原文がなければ `text_EN` は欠損
+    """
+    columns = read_mo_columns(fpath)
+    n = len(columns["msgid"])
+    ids = [x.replace("%%", "%").partition("/") for x in columns["msgid"]]
+    texts = [x.replace("%%", "%") for x in columns["msgstr"]]
+    if drop_prefix_id:
+        texts = [match_prefix_id.sub(r"\1", x) for x in texts]
+    return pd.DataFrame(
+        dict(
+            text=texts,
+            notes="",
+            flags=[[] for _ in range(n)],
+            locations=[[] for _ in range(n)],
+            context=columns["msgctxt"],
+            id=[x[0] for x in ids],
+            text_EN=[x[2] if x[1] else None for x in ids],
+            duplication=0,
+        )
+    )
+
+
 def initializePOFile(
     lang: str, encoding: str = "utf-8", email: Optional[str] = None
 ) -> polib.POFile:
@@ -412,24 +809,22 @@ def initializePOFile(
     return po
 
 
-def pddf2po(
+def pddf2po_columns(
     df: pd.DataFrame,
     with_id: bool = True,
     make_distinct: bool = True,
     regacy_mode: bool = False,
-    locale: str = None,
     col_id_text: str = "text",
     col_text: str = "text",
     col_locations: str = None,
     col_context: str = None,
     col_comments: str = None,
     col_flags: str = None,
-) -> polib.POFile:
+) -> Dict[str, list]:
     """
-    input: `pandas.DataFrame` which contains `id` and `text` columns
+    `pddf2po` の各エントリに渡す引数 (msgid, msgstr, flags, ...) を列ごとのリストで作る.
+    引数の意味は `pddf2po` と同じ
     """
-    if locale is None:
-        locale = "ja_JP"
     if make_distinct:
         df_unique = df.groupby("id").last().reset_index()
         if df.shape[0] != df_unique.shape[0]:
@@ -445,59 +840,224 @@ def pddf2po(
         "",
         df_unique[col_text],
     )
-    pof = initializePOFile(lang="ja_JP")
     if with_id:
         df_unique[col_text] = [
-            f'[{r["id"]}]{r[col_text]}' for _, r in df_unique.iterrows()
+            f"[{id}]{text}" for id, text in zip(df_unique["id"], df_unique[col_text])
         ]
-    print(f"col_flags={col_flags}, {col_flags is None}")
+    n = df_unique.shape[0]
 
-    if not regacy_mode:
+    def column(name: Optional[str], default=None) -> list:
+        if name is not None and name in df_unique.columns:
+            return df_unique[name].tolist()
+        return [default] * n
 
-        def format_arg(dic: dict) -> dict:
-            dic["msgid"] = f"""{dic['id']}/{dic[col_id_text]}"""
-            dic["msgstr"] = dic[col_text]
-            if col_flags is None:
-                dic["flags"] = ["fuzzy"]
-            else:
-                dic["flags"] = dic.get(col_flags)
-            if col_locations is not None:
-                dic["occurrences"] = [(str(x), 0) for x in dic.get(col_locations)]
-            dic["tcomment"] = (
-                dic.get(col_comments, "")
-                if type(dic.get(col_comments, "")) is list
-                else []
+    columns = dict(
+        msgid=[
+            f"""{id}/{text}"""
+            for id, text in zip(
+                df_unique["id"].tolist(), df_unique[col_id_text].tolist()
             )
-            dic["msgctxt"] = dic.get(col_context)
-            return dic
+        ],
+        msgstr=df_unique[col_text].tolist(),
+    )
+    if not regacy_mode:
+        if col_flags is None:
+            columns["flags"] = [["fuzzy"] for _ in range(n)]
+        else:
+            columns["flags"] = column(col_flags)
+        if col_locations is not None:
+            columns["occurrences"] = [
+                [(str(x), 0) for x in v] for v in column(col_locations)
+            ]
+        if col_comments is not None:
+            columns["tcomment"] = [
+                v if type(v) is list else [] for v in column(col_comments, "")
+            ]
+    else:
+        if col_flags is not None:
+            columns["flags"] = [[] if v else ["fuzzy"] for v in column("updated")]
+        elif "flags" in df_unique.columns:
+            columns["flags"] = column("flags")
+        if col_locations is not None:
+            columns["occurrences"] = [[(v, 0)] for v in column(col_locations)]
+        if col_comments is not None:
+            columns["tcomment"] = [[v] for v in column(col_comments, "")]
+    if col_context is not None:
+        columns["msgctxt"] = column(col_context)
+    return columns
+
+
+def pddf2po(
+    df: pd.DataFrame,
+    with_id: bool = True,
+    make_distinct: bool = True,
+    regacy_mode: bool = False,
+    locale: str = None,
+    col_id_text: str = "text",
+    col_text: str = "text",
+    col_locations: str = None,
+    col_context: str = None,
+    col_comments: str = None,
+    col_flags: str = None,
+) -> polib.POFile:
+    """
+    input: `pandas.DataFrame` which contains `id` and `text` columns
+    """
+    if locale is None:
+        locale = "ja_JP"
+    columns = pddf2po_columns(
+        df,
+        with_id=with_id,
+        make_distinct=make_distinct,
+        regacy_mode=regacy_mode,
+        col_id_text=col_id_text,
+        col_text=col_text,
+        col_locations=col_locations,
+        col_context=col_context,
+        col_comments=col_comments,
+        col_flags=col_flags,
+    )
+    pof = initializePOFile(lang="ja_JP")
+    keys = list(columns.keys())
+    for values in zip(*columns.values()):
+        pof.append(polib.POEntry(**dict(zip(keys, values))))
+    return pof
+
 
+PO_WRAPWIDTH = 78
+# polib がエスケープするか, str.splitlines が改行とみなす文字
+po_special_chars = regex.compile(r'[\\\t\r\n\x08\x0b\x0c"\x1c\x1d\x1e\x85\u2028\u2029]')
+
+
+def format_po_field(fieldname: str, field: str) -> List[str]:
+    """
+    polib の `POEntry` が msgctxt, msgid, msgstr を書き出すときと同じ行 (polib 1.2.0 の `_str_field` に合わせた).
+    改行を含めば改行ごとに, 長ければ空白で折り返して空の行から始める
+    """
+    if (
+        len(field) <= PO_WRAPWIDTH - len(fieldname) - 3
+        and po_special_chars.search(field) is None
+    ):
+        return [f'{fieldname} "{field}"']
+    lines = field.splitlines(True)
+    if len(lines) > 1:
+        lines = [""] + lines
     else:
+        escaped = polib.escape(field)
+        # 長さはエスケープ前の文字数で比べるが, エスケープで増えた分だけ幅を広げる
+        if len(field) > PO_WRAPWIDTH - len(fieldname) - 3 + len(escaped) - len(field):
+            lines = [""] + [
+                polib.unescape(x)
+                for x in textwrap.wrap(
+                    escaped,
+                    PO_WRAPWIDTH - 2,
+                    drop_whitespace=False,
+                    break_long_words=False,
+                )
+            ]
+        else:
+            lines = [field]
+    return [f'{fieldname} "{polib.escape(lines[0])}"'] + [
+        f'"{polib.escape(x)}"' for x in lines[1:]
+    ]
+
 
-        def format_arg(dic: dict) -> dict:
-            dic["msgid"] = f"""{dic['id']}/{dic[col_id_text]}"""
-            dic["msgstr"] = dic[col_text]
-            if col_flags is None:
-                pass
+def format_po_entry(
+    msgid: str,
+    msgstr: str = "",
+    msgctxt: Optional[str] = None,
+    flags: Optional[List[str]] = None,
+    occurrences: Optional[List[Tuple[str, int]]] = None,
+    tcomment: str = "",
+) -> str:
+    """
+    `str(polib.POEntry(...))` と同じ文字列を作る
+    """
+    if tcomment and not isinstance(tcomment, str):
+        # 文字列以外のコメントは polib の挙動 (例外) にそのまま任せる
+        return polib.POEntry(
+            msgid=msgid,
+            msgstr=msgstr,
+            msgctxt=msgctxt,
+            flags=[] if flags is None else flags,
+            occurrences=[] if occurrences is None else occurrences,
+            tcomment=tcomment,
+        ).__unicode__(PO_WRAPWIDTH)
+    ret = []
+    if tcomment:
+        for comment in tcomment.split("\n"):
+            if len(comment) + 2 > PO_WRAPWIDTH:
+                ret += textwrap.wrap(
+                    comment,
+                    PO_WRAPWIDTH,
+                    initial_indent="# ",
+                    subsequent_indent="# ",
+                    break_long_words=False,
+                )
             else:
-                dic["flags"] = [] if dic.get("updated") else ["fuzzy"]
-            dic["occurrences"] = [(dic.get(col_locations), 0)]
-            dic["tcomment"] = [dic.get(col_comments, "")]
-            dic["msgctxt"] = dic.get(col_context)
-            return dic
-
-    d = [format_arg(dict(r)) for _, r in df_unique.iterrows()]
-    keys = {"msgid", "msgstr", "flags"}
-    if col_comments is not None:
-        keys.add("tcomment")
-    if col_context is not None:
-        keys.add("msgctxt")
-    if col_locations is not None:
-        keys.add("occurrences")
-    current_keys = list(d[0].keys())
-    _ = [dic.pop(k, None) for dic in d for k in current_keys if k not in keys]
-    for r in d:
-        pof.append(polib.POEntry(**r))
-    return pof
+                ret.append(f"# {comment}")
+    if occurrences:
+        filestr = " ".join(
+            [f"{fpath}:{lineno}" if lineno else fpath for fpath, lineno in occurrences]
+        )
+        if len(filestr) + 3 > PO_WRAPWIDTH:
+            # polib と同じく, ハイフンで折り返さないよう一時的に置き換える
+            ret += [
+                line.replace("*", "-")
+                for line in textwrap.wrap(
+                    filestr.replace("-", "*"),
+                    PO_WRAPWIDTH,
+                    initial_indent="#: ",
+                    subsequent_indent="#: ",
+                    break_long_words=False,
+                )
+            ]
+        else:
+            ret.append(f"#: {filestr}")
+    if flags:
+        ret.append("#, " + ", ".join(flags))
+    if msgctxt is not None:
+        ret += format_po_field("msgctxt", msgctxt)
+    ret += format_po_field("msgid", msgid)
+    ret += format_po_field("msgstr", msgstr)
+    ret.append("")
+    return "\n".join(ret)
+
+
+def format_po_head(pofile: polib.POFile) -> str:
+    """
+    `pofile.save` で書かれるファイルの先頭 (ヘッダのコメントとメタデータのエントリ)
+    """
+    head = polib.POFile(wrapwidth=PO_WRAPWIDTH, encoding=pofile.encoding)
+    head.header = pofile.header
+    head.metadata = pofile.metadata
+    head.metadata_is_fuzzy = pofile.metadata_is_fuzzy
+    return head.__unicode__()
+
+
+def write_po_columns(
+    columns: Dict[str, list],
+    fpath: Path,
+    lang: str = "ja_JP",
+    head: Optional[str] = None,
+) -> int:
+    """
+    `pddf2po_columns` の結果を POFile を作らずに1件ずつ書き込む.
+    `pddf2po(...).save(fpath)` とバイト単位で同じ内容になる (ヘッダの日時を除く)
+    head: ファイルの先頭. 省略すれば `initializePOFile(lang)` のもの. 既存の POFile に合わせるなら `format_po_head`
+    Returns: 書き込んだエントリの数
+    """
+    if head is None:
+        head = format_po_head(initializePOFile(lang=lang))
+    keys = list(columns.keys())
+    n = 0
+    with fpath.open("w", encoding="utf-8") as f:
+        f.write(head)
+        for values in zip(*columns.values()):
+            f.write("\n")
+            f.write(format_po_entry(**dict(zip(keys, values))))
+            n += 1
+    return n
 
 
 def removeannoyingchars(string: str, remove_id=False) -> str:
@@ -509,144 +1069,143 @@ def removeannoyingchars(string: str, remove_id=False) -> str:
     return string
 
 
-def update_with_older_po(
+def index_po_entries(
+    pofile: polib.POFile,
+    key: Optional[Callable[[str], str]] = None,
+    include_obsolete: bool = False,
+) -> Dict[str, polib.POEntry]:
+    """
+    msgid (or `key(msgid)`) をキーにしたエントリの辞書を一度だけ作る.
+    同じキーが複数あれば `polib.POFile.find()` と同様に最初のエントリを優先する
+    """
+    index: Dict[str, polib.POEntry] = dict()
+    for entry in pofile:
+        if entry.obsolete and not include_obsolete:
+            continue
+        index.setdefault(entry.msgid if key is None else key(entry.msgid), entry)
+    return index
+
+
+def match_with_older_po(
     old_po: polib.POFile,
     new_po: polib.POFile,
     all_fuzzy=False,
     ignore_facial=True,
     legacy_id=False,
-) -> polib.POFile:
+) -> Dict[str, int]:
+    """
+    copy translations from `old_po` into `new_po` in place.
+    each new entry is resolved once by the first matching tier: exact msgid, msgid without facial tags, public ID
+    Returns: the number of matched entries per tier
+    """
+    n_match = {"exact": 0, "facial": 0, "public ID": 0, "unmatched": 0}
+    old_exact = index_po_entries(old_po)
     if legacy_id:
+        # the older catalog is corrected before matching, as the sequential implementation did
+        for entry in new_po:
+            old_entry = old_exact.get(entry.msgid)
+            if entry.msgid != "" and old_entry is not None:
+                old_entry.msgstr = match_public_id_legacy.sub(r"\1", old_entry.msgstr)
+        old_public = index_po_entries(
+            old_po,
+            key=lambda x: match_public_id_legacy.sub(r"\1", x),
+            include_obsolete=True,
+        )
         for entry in new_po:
-            if entry.msgid != "":
-                old_entry = old_po.find(entry.msgid)
-                if old_entry is not None:
-                    old_entry.msgstr = match_public_id_legacy.sub(
-                        r"\1", old_entry.msgstr
-                    )
-                    if old_entry.msgstr != "":
-                        new_entry = new_po.find(entry.msgid)
-                        if new_entry is not None:
-                            new_entry.msgstr = old_entry.msgstr
-                            new_entry.tcomment = old_entry.tcomment
+            if entry.msgid == "":
+                continue
+            old_entry = old_exact.get(entry.msgid)
+            if old_entry is not None:
+                if old_entry.msgstr != "":
+                    entry.msgstr = old_entry.msgstr
+                    entry.tcomment = old_entry.tcomment
+                    n_match["exact"] += 1
                 else:
-                    print(f"error: irregular catlog ID={entry.msgid}")
-        # update on public id if not matched
-        old_po_fuzzy = initializePOFile("ja_JP")
-        for entry in old_po:
-            old_po_fuzzy.append(
-                polib.POEntry(
-                    msgid=match_public_id_legacy.sub(r"\1", entry.msgid),
-                    msgstr=entry.msgstr,
-                    tcomment=entry.tcomment,
-                    flags=entry.flags,
-                    msgctxt=entry.msgctxt,
-                    occurrences=entry.occurrences,
-                )
+                    n_match["unmatched"] += 1
+                continue
+            report.note(
+                "irregular_catalog_id",
+                "irregular catlog ID={}",
+                entry.msgid,
+                warning=True,
             )
-        n_match = 0
-        for entry in new_po:
-            if entry.msgid != "":
-                old_entry = old_po_fuzzy.find(
-                    match_public_id_legacy.sub(r"\1", entry.msgid)
-                )
-                if old_entry is not None and old_po.find(entry.msgid) is None:
-                    n_match += 1
-                    new_entry = new_entry.find(entry.msgid)
-                    if new_entry is not None:
-                        new_entry.msgstr = old_entry.msgstr
-                        new_entry.tcomment += old_entry.tcomment
-                        new_entry.flags = (
-                            ["fuzzy"] if all_fuzzy or "fuzzy" in old_entry.flags else []
-                        )
-        print(f"Updated {n_match} entries matched on public ID")
-    else:
-        suffix_facial = regex.compile(r"(\[ib:.+\]|\[if:.+\])")  # against v1.2 updates
-        n_match = 0
-        for entry in new_po:
-            if entry.msgid != "":
-                old_entry = (
-                    old_po.find(suffix_facial.sub("", entry.msgid))
-                    if ignore_facial
-                    else old_po.find(entry.msgid)
+            old_entry = old_public.get(match_public_id_legacy.sub(r"\1", entry.msgid))
+            if old_entry is not None:
+                entry.msgstr = old_entry.msgstr
+                entry.tcomment += old_entry.tcomment
+                entry.flags = (
+                    ["fuzzy"] if all_fuzzy or "fuzzy" in old_entry.flags else []
                 )
-                if old_entry is not None:
-                    if old_entry.msgstr != "":
-                        new_entry = new_po.find(entry.msgid)
-                        if new_entry is not None:
-                            new_entry.msgstr = old_entry.msgstr
-                            new_entry.tcomment += old_entry.tcomment
-                            new_entry.flags = (
-                                ["fuzzy"]
-                                if all_fuzzy or "fuzzy" in old_entry.flags
-                                else []
-                            )
-                            new_entry.fuzzy = (
-                                True
-                                if all_fuzzy or "fuzzy" in old_entry.flags
-                                else False
-                            )
-                            new_entry.msgctxt = old_entry.msgctxt
-                            n_match += 1
-        total_entries = len([m for m in new_po if m.msgid != ""])
-        print(
-            f"Updated {n_match}/{total_entries} entries matched by both the internal ID"
-        )
-        if n_match == total_entries:
-            print("all entries are matched")
+                n_match["public ID"] += 1
+            else:
+                n_match["unmatched"] += 1
+        return n_match
+    old_facial = index_po_entries(old_po, key=lambda x: suffix_facial.sub("", x))
+    old_public = index_po_entries(
+        old_po, key=lambda x: match_public_id.sub(r"\1", x), include_obsolete=True
+    )
+    for entry in new_po:
+        if entry.msgid == "":
+            continue
+        tier = "exact"
+        old_entry = old_exact.get(entry.msgid)
+        if (old_entry is None or old_entry.msgstr == "") and ignore_facial:
+            tier = "facial"
+            old_entry = old_facial.get(suffix_facial.sub("", entry.msgid))
+        if old_entry is not None and old_entry.msgstr != "":
+            entry.msgstr = old_entry.msgstr
+            entry.tcomment += old_entry.tcomment
+            entry.flags = ["fuzzy"] if all_fuzzy or "fuzzy" in old_entry.flags else []
+            entry.msgctxt = old_entry.msgctxt
+            n_match[tier] += 1
+            continue
+        # update on public ID if the original text changed or somewhat get hardcoded
+        old_entry = old_public.get(match_public_id.sub(r"\1", entry.msgid))
+        if (
+            old_entry is not None
+            and old_entry.msgstr != ""
+            and entry.msgid not in old_exact
+            and old_entry.msgstr != entry.msgstr
+        ):
+            entry.msgstr = old_entry.msgstr
+            entry.tcomment += old_entry.tcomment
+            entry.flags = ["fuzzy"]
+            entry.msgctxt = old_entry.msgctxt
+            n_match["public ID"] += 1
         else:
-            # update on public ID if the original text changed or somewhat get hardcoded
-            old_po_fuzzy = initializePOFile("ja_JP")
-            for entry in old_po:
-                old_po_fuzzy.append(
-                    polib.POEntry(
-                        msgid=match_public_id.sub(r"\1", entry.msgid),
-                        msgstr=entry.msgstr,
-                        tcomment=entry.tcomment,
-                        flags=(
-                            set(entry.flags) | set("fuzzy")
-                            if all_fuzzy or "fuzzy" in entry.flags
-                            else list()
-                        ),
-                        msgctxt=entry.msgctxt,
-                    )
-                )
-            n_match = 0
-            for entry in new_po:
-                if entry.msgid != "":
-                    old_entry = old_po_fuzzy.find(
-                        match_public_id.sub(r"\1", entry.msgid)
-                    )
-                    if (
-                        old_entry is not None
-                        and old_entry.msgstr != ""
-                        and old_po.find(entry.msgid) is None
-                        and old_entry.msgstr != entry.msgstr
-                    ):
-                        new_entry = new_po.find(entry.msgid)
-                        if new_entry is not None:
-                            new_entry.msgstr = old_entry.msgstr
-                            new_entry.tcomment += old_entry.tcomment
-                            new_entry.flags = ["fuzzy"]
-                            new_entry.fuzzy = True
-                            new_entry.msgctxt = old_entry.msgctxt
-                            n_match += 1
-            print(f"Updated {n_match} entries matched by the public ID")
-    return new_po
+            n_match["unmatched"] += 1
+    return n_match
 
 
-def export_id_text_list(fpath: Path, output: Path) -> None:
+def update_with_older_po(
+    old_po: polib.POFile,
+    new_po: polib.POFile,
+    all_fuzzy=False,
+    ignore_facial=True,
+    legacy_id=False,
+    memory_top_k: int = 0,
+    memory_threshold: float = THRESHOLD,
+) -> polib.POFile:
     """
-    read pofile and export as csv with id and text columns. mainly used for compare with misassigned IDs in the third-party mods
+    `memory_top_k` > 0 なら, 訳が見つからなかった項目に `old_po` の似た原文の訳を fuzzy で入れる
     """
-    pof = polib.pofile(fpath, encoding="utf-8")
-    d = pd.DataFrame([(x.msgid) for x in pof if x.msgid != ""], columns=["id"])
-    d["text_EN"] = d["id"].str.replace(r"^(.+?)/(.+?)$", r"\2", regex=True)
-    d["id"] = d["id"].str.replace(r"^(.+?)/.+?$", r"\1", regex=True)
-    if output.exists():
-        backup_path = output.parent.joinpath(
-            f"""vanilla-id-{datetime.now().strftime("%Y-%m-%dT%H%M%S")}.csv"""
+    n_match = match_with_older_po(
+        old_po, new_po, all_fuzzy, ignore_facial=ignore_facial, legacy_id=legacy_id
+    )
+    total_entries = sum(n_match.values())
+    for tier, n in n_match.items():
+        print(f"{tier:>10}: {n}/{total_entries} entries")
+    if n_match["unmatched"] == 0:
+        print("all entries are matched")
+    if memory_top_k > 0:
+        untranslated = [
+            x for x in new_po if x.msgid != "" and x.msgstr == "" and not x.obsolete
+        ]
+        n = suggest_translations(
+            TranslationMemory.from_catalog(old_po),
+            untranslated,
+            memory_top_k,
+            memory_threshold,
         )
-        print(f"{output} already exists. the older file is moved to {backup_path}")
-        output.rename(backup_path)
-    d.to_csv(output, index=False)
+        print(f"""{"memory":>10}: {n}/{len(untranslated)} untranslated entries""")
+    return new_po
@@ -1,15 +1,26 @@
-
 import argparse
-import yaml
 from pathlib import Path
-import warnings
 
-from functions import export_id_text_list
+from functions import merge_yml
+from parse_cache import default_cache_dir
+from vanilla_index import open_vanilla_index
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--pofile', type=Path, default=Path('text/MB2BL-JP.po'))
+parser.add_argument('--mb2dir', type=Path, default=None)
+parser.add_argument('--cache-dir', type=Path, default=None)
 
 
 def main():
-    file_dir = Path(__file__).parent.joinpath('vanilla-id.csv')
-    export_id_text_list(Path('text/MB2BL-JP.po'), file_dir)
+    args = parser.parse_args()
+    fp = Path(__file__).parent.joinpath('default.yml')
+    if fp.exists():
+        args = merge_yml(fp, args, parser.parse_args([]))
+    open_vanilla_index(
+        args.pofile,
+        args.mb2dir,
+        default_cache_dir if args.cache_dir is None else args.cache_dir,
+    )
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
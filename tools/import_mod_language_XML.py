@@ -12,21 +12,27 @@ import numpy as np
 import pandas as pd
 import polib
 from functions import (
-    FILTERS,
-    dict_name_attr,
-    export_id_text_list,
-    match_public_id,
-    match_string,
+    extract_filter_entries,
     merge_yml,
-    pddf2po,
+    mo2pddf,
+    parse_xml,
+    read_language_strings,
+    split_string_id,
+    pddf2po_columns,
     po2pddf,
+    write_po_columns,
 )
+from parse_cache import default_cache_dir
+from profiling import add_profile_arguments, open_profiler
+from run_report import add_report_arguments, configure_report, report
+from table_store import write_table
+from xml_writer import XMLWriteQueue, write_xml_atomic
+from vanilla_index import VanillaIndex, open_vanilla_index
 
 if platform.system() == "Windows":
     # import winshell
     from win32com.client import Dispatch
-import html
-from typing import Any, Callable, Optional
+from typing import Any, Callable, Dict, Optional, Tuple
 
 parser = argparse.ArgumentParser()
 parser.add_argument("target_module", type=str, help="target module folder name")
@@ -78,6 +84,14 @@ parser.add_argument("--autoid-digits", default=None, type=int)
 parser.add_argument("--dont-clean", default=None, action="store_true")
 parser.add_argument("--verbose", default=None, action="store_true")
 parser.add_argument("--suppress-shortcut", action="store_true")
+parser.add_argument(
+    "--xlsx",
+    default=None,
+    action="store_true",
+    help="also write the extracted table as .xlsx for reading with a spreadsheet",
+)
+add_profile_arguments(parser)
+add_report_arguments(parser)
 
 
 # TODO: REFACTORING!!!
@@ -99,17 +113,20 @@ def read_mod_languages(target_language: str, language_folder: Path) -> pd.DataFr
     language_files = []
     for lang_data_file in language_folder.rglob("./language_data.xml"):
         xml = ET.parse(lang_data_file)
-        print(ET.tostring(xml))
         xml_lang_data = xml.getroot()
+        report.note(
+            "language_data",
+            "{} (id={})",
+            lang_data_file,
+            xml_lang_data.attrib.get("id"),
+        )
         if xml_lang_data.attrib["id"] == target_language:
-            for x in xml_lang_data.xpath("./LanguageFile"):
-                print(html.unescape((ET.tostring(x, encoding="unicode"))))
             language_files += [
                 language_folder.joinpath(x.attrib["xml_path"])
                 for x in xml_lang_data.xpath("./LanguageFile")
             ]
     for file in language_files:
-        print(f"{target_language} language file: {file.relative_to(language_folder)}")
+        report.note("language_files", "{} language file: {}", target_language, file)
         d = langauge_xml_to_pddf(file, "text", language_folder)
         if d.shape[0] > 0:
             ds += [d]
@@ -127,7 +144,6 @@ def read_mod_languages(target_language: str, language_folder: Path) -> pd.DataFr
 
 def extract_all_text_from_xml(
     module_data_dir: Path,
-    verbose: bool,
 ) -> pd.DataFrame:
     """
     # タグはいろいろあるので翻訳対象の条件づけが正確なのかまだ自信がない
@@ -135,26 +151,34 @@ def extract_all_text_from_xml(
     """
     ds = []
     print(f"reading XML and XSLT files from {module_data_dir}")
-    print(module_data_dir)
     for file in module_data_dir.rglob("./*.xml"):
         if file.relative_to(module_data_dir).parts[0].lower() != "languages":
-            d = non_language_xml_to_pddf(file, module_data_dir, verbose)
-            print(
-                f"""(not language file) {d.shape[0]} entries found in {file.relative_to(module_data_dir)}."""
+            d = non_language_xml_to_pddf(file, module_data_dir)
+            report.note(
+                "xml_files",
+                "(not language file) {} entries found in {}.",
+                d.shape[0],
+                file,
             )
             ds += [d]
     for file in module_data_dir.rglob("./*.xslt"):
         if file.relative_to(module_data_dir).parts[0].lower() != "languages":
-            d = non_language_xslt_to_pddf(file, module_data_dir, verbose)
-            print(
-                f"""(not language file) {d.shape[0]} entries found in {file.relative_to(module_data_dir)}."""
+            d = non_language_xslt_to_pddf(file, module_data_dir)
+            report.note(
+                "xslt_files",
+                "(not language file) {} entries found in {}.",
+                d.shape[0],
+                file,
             )
             ds += [d]
     for en_str in ["English", "EN", ""]:
         for file in module_data_dir.glob(f"languages/{en_str}/*.xml"):
             d = langauge_xml_to_pddf(file, "text_EN", module_data_dir)
-            print(
-                f"""(English language file) {d.shape[0]} entries found in {file.relative_to(module_data_dir)}."""
+            report.note(
+                "english_language_files",
+                "(English language file) {} entries found in {}.",
+                d.shape[0],
+                file,
             )
             if d.shape[0] > 0:
                 ds += [d]
@@ -173,22 +197,18 @@ def extract_all_text_from_xml(
 
 
 def non_language_xml_to_pddf(
-    fpath: Path, base_dir: Optional[Path] = None, verbose: bool = False
+    fpath: Path, base_dir: Optional[Path] = None
 ) -> pd.DataFrame:
     """
     xml to pd.DataFrame
     """
     if base_dir is None:
         base_dir = fpath.parent
-    xml = ET.parse(base_dir.joinpath(fpath).open("r", encoding="utf-8"))
+    xml = parse_xml(base_dir.joinpath(fpath))
     ds = []
-    for name_attrs in FILTERS:
-        xml_entries = xml.xpath(name_attrs["xpath"])
-        if verbose:
-            print(
-                f"""{len(xml_entries)} {name_attrs['context']} attributes found in {name_attrs['key']} tags"""
-            )
+    for name_attrs, xml_entries in extract_filter_entries(xml, "xml"):
         if len(xml_entries) > 0:
+            report.count(f"""entries.{name_attrs['context']}""", len(xml_entries))
             tmp = pd.DataFrame(
                 [
                     (
@@ -219,23 +239,18 @@ def non_language_xml_to_pddf(
 
 
 def non_language_xslt_to_pddf(
-    fpath: Path, base_dir: Optional[Path] = None, verbose: bool = False
+    fpath: Path, base_dir: Optional[Path] = None
 ) -> pd.DataFrame:
     """
     xslt to pd.DataFrame
     """
     if base_dir is None:
         base_dir = fpath.parent
-    xslt = ET.parse(base_dir.joinpath(fpath).open("r", encoding="utf-8"))
+    xslt = parse_xml(base_dir.joinpath(fpath))
     ds = []
-    for name_attrs in FILTERS:
-        print(name_attrs)
-        xslt_entries = extract_elements_from_xslt(xslt, name_attrs)
-        if verbose:
-            print(
-                f"""{len(xslt_entries)} {name_attrs['context']} attributes found in {name_attrs['context']} tags"""
-            )
+    for name_attrs, xslt_entries in extract_filter_entries(xslt, "xslt"):
         if len(xslt_entries) > 0:
+            report.count(f"""entries.{name_attrs['context']}""", len(xslt_entries))
             tmp = pd.DataFrame(
                 [(x.text, f"""{name_attrs['context']}""") for x in xslt_entries],
                 columns=["text_EN", "context"],
@@ -263,12 +278,10 @@ def langauge_xml_to_pddf(
 ) -> pd.DataFrame:
     if base_dir is None:
         base_dir = fpath.parent
-    xml = ET.parse(base_dir.joinpath(fpath))
-    xml_entries = xml.xpath(".//strings/string[@id][@text]")
-    if len(xml_entries) > 0:
+    ids, texts, _ = read_language_strings(base_dir.joinpath(fpath), strict_path=False)
+    if len(ids) > 0:
         d = pd.DataFrame(
-            [(x.attrib["id"], x.attrib["text"], "language.text") for x in xml_entries],
-            columns=["id", text_col_name, "context"],
+            {"id": ids, text_col_name: texts, "context": "language.text"}
         ).assign(attr="string", file=fpath.relative_to(base_dir).as_posix())
         return d
     else:
@@ -294,48 +307,14 @@ def normalize_string_ids(
     keep_redundancies: bool,
     autoid_digits: int,
     keep_vanilla_id: bool,
-    langshort: str,
+    vanilla_index: Optional[VanillaIndex],
     convert_exclam: bool,
     autoid_prefix: str,
 ) -> pd.DataFrame:
     """
     後2つ以外のXML, module_string, language の順で信頼できるはずなので被ったらその優先順位でなんとかする.
+    vanilla_index が None ならバニラのIDとの照合はしない
     """
-    vanilla_id_path = (
-        Path("tools") if "__file__" not in locals() else Path(__file__).parent
-    ).joinpath("vanilla-id.csv")
-    if keep_redundancies:
-        lambda_id = lambda d: np.where(
-            (d["id"] == "") | d["id"].isna(),
-            [
-                f"{autoid_prefix}" + generate_id_sha256(text, autoid_digits)
-                for text in d["context"] + d["attr"] + d["text_EN"]
-            ],  # TODO
-            d["id"],
-        )
-    else:
-        lambda_id = lambda d: np.where(
-            (d["id"] == "") | d["id"].isna(),
-            [
-                f"{autoid_prefix}" + generate_id_sha256(text + str(i), autoid_digits)
-                # TODO
-                for i, text in enumerate(d["context"] + d["attr"] + d["text_EN"])
-            ],
-            d["id"],
-        )
-    if not vanilla_id_path.exists():
-        print(f"{vanilla_id_path} not found. trying to create vanilla-id.csv...")
-        fp_pofile = Path(f"text/MB2BL-{langshort}.po")
-        if fp_pofile.exists():
-            export_id_text_list(fp_pofile, vanilla_id_path)
-        else:
-            warnings.warn(
-                f"""{fp_pofile} not found. this process is skipped, but it will caused some ID detection errors."""
-            )
-            vanilla_ids = pd.DataFrame(columns=["id", "text_EN"])
-
-    if vanilla_id_path.exists():
-        vanilla_ids = pd.read_csv(vanilla_id_path).assign(id_used_in_vanilla=True)
     if not convert_exclam:
         # TODO: なぜ!を付ける人が多いのか? このオプションいるか?
         # TODO: 翻訳が必要ないのは動的に名前が上書きされるテンプレートNPCの名称のみだが, それとは関係なく =! とか =* とか書いている人が多い. なんか独自ルールの記号使ってる人までいる…
@@ -358,35 +337,24 @@ def normalize_string_ids(
                 d["id"].str.contains(exclude_pattern, regex=True), "", d["id"]
             )
         )
-    if not keep_vanilla_id:
+    if not keep_vanilla_id and vanilla_index is not None:
         # テキストを変更しているのにバニラのIDを使いまわしている, あるいは偶然に被っている場合はIDを削除する
         # erase entry if both ID and the original string is the same.
         n = data.loc[lambda d: d["id"] != ""].shape[0]
-        data = data.merge(
-            vanilla_ids.rename(columns={"text_EN": "text_EN_original"}),
-            on="id",
-            how="left",
+        id_used_in_vanilla, same_as_vanilla = vanilla_index.lookup(
+            data["id"], data["text_EN"]
         )
         data = data.assign(
-            id=lambda d: np.where(
-                d["id_used_in_vanilla"] & (d["text_EN"] != d["text_EN_original"]),
-                "",
-                d["id"],
-            )
+            id=np.where(id_used_in_vanilla & ~same_as_vanilla, "", data["id"])
         )
         print(
             f"""---- {n - data.loc[lambda d: d['id'] != ''].shape[0]} abused IDs which are used in vanilla are reset. ----"""
         )
         n = data.shape[0]
-        data = data.loc[
-            lambda d: ~(
-                d["id_used_in_vanilla"] & (d["text_EN"] == d["text_EN_original"])
-            )
-        ]
+        data = data.loc[~same_as_vanilla]
         print(
             f"""---- {n - data.shape[0]} entries which are identical to vanilla ones dropped. -----"""
         )
-        data = data.drop(columns=["text_EN_original", "id_used_in_vanilla"])
         # TODO: 常にバニラと比較するように
     data = data.assign(
         missing_id=lambda d: (d["id"].str.contains(r"^[?!\*]$"))
@@ -426,10 +394,103 @@ def normalize_string_ids(
     n = data.shape[0]
     data = data.drop_duplicates(["id", "text_EN"])
     print(f"""{n - data.shape[0]} duplicated entries are dropped""")
-    data = data.assign(id=lambda_id)
+    data = data.assign(
+        id=generate_missing_ids(
+            data,
+            how_distinct=how_distinct,
+            keep_redundancies=keep_redundancies,
+            autoid_digits=autoid_digits,
+            autoid_prefix=autoid_prefix,
+            vanilla_index=vanilla_index,
+        )
+    )
     return data
 
 
+def generate_missing_ids(
+    data: pd.DataFrame,
+    how_distinct: str,
+    keep_redundancies: bool,
+    autoid_digits: int,
+    autoid_prefix: str,
+    vanilla_index: Optional[VanillaIndex],
+) -> np.ndarray:
+    """
+    ID のないエントリに内容から決まる ID をまとめて付ける. 行の順番には依存しない.
+    keep_redundancies なら context, attr, text_EN が同じエントリは同じ ID になる (従来どおり).
+    そうでなければ file も加え, それでも同じものには出現順の番号を付けて区別する.
+    Mod の既存の ID, バニラの ID, 他の自動生成 ID と被ったら, 元の文字列の順に試行番号を加えて再計算する
+    Returns: 新しい id 列
+    """
+    is_missing = ((data["id"] == "") | data["id"].isna()).to_numpy()
+    if keep_redundancies:
+        keys = (data["context"] + data["attr"] + data["text_EN"])[is_missing].tolist()
+    else:
+        if how_distinct == "context":
+            # 同じ context と attr の中で text_EN は一意なので, 増減しうるファイルの一覧は使わない
+            files = pd.Series("", index=data.index)
+        else:
+            files = data["file"].map(
+                lambda x: "\0".join(x) if isinstance(x, list) else x
+            )
+        contents = (
+            data["context"]
+            + "\0"
+            + data["attr"]
+            + "\0"
+            + files
+            + "\0"
+            + data["text_EN"]
+        )[is_missing].tolist()
+        occurrences: Dict[str, int] = dict()
+        keys = []
+        for content in contents:
+            k = occurrences.get(content, 0)
+            occurrences[content] = k + 1
+            keys.append(content if k == 0 else f"{content}\0{k}")
+    unique_keys = sorted(set(keys))
+    ids = [
+        f"{autoid_prefix}" + generate_id_sha256(key, autoid_digits)
+        for key in unique_keys
+    ]
+    taken = set(data["id"][~is_missing])
+    if vanilla_index is not None:
+        taken |= {
+            id for id, row in zip(ids, vanilla_index.find_ids(ids).tolist()) if row >= 0
+        }
+    id_by_key: Dict[str, str] = dict()
+    n_collisions = 0
+    for key, id in zip(unique_keys, ids):
+        attempt = 0
+        while id in taken or (
+            attempt > 0 and vanilla_index is not None and id in vanilla_index
+        ):
+            attempt += 1
+            id = f"{autoid_prefix}" + generate_id_sha256(
+                f"{key}\0{attempt}", autoid_digits
+            )
+        n_collisions += attempt > 0
+        taken.add(id)
+        id_by_key[key] = id
+    if n_collisions > 0:
+        print(
+            f"""---- {n_collisions} generated IDs collided and are regenerated ----"""
+        )
+    new_ids = data["id"].to_numpy(dtype=object, copy=True)
+    new_ids[is_missing] = [id_by_key[key] for key in keys]
+    return new_ids
+
+
+def vanilla_id_source(langshort: str) -> Path:
+    """
+    バニラのIDの索引を作る元のファイル. 翻訳ファイルがなければ旧来の vanilla-id.csv を使う
+    """
+    fp_pofile = Path(f"text/MB2BL-{langshort}.po")
+    if fp_pofile.exists():
+        return fp_pofile
+    return Path(__file__).parent.joinpath("vanilla-id.csv")
+
+
 def merge_language_file(
     data: pd.DataFrame,
     data_language: Optional[pd.DataFrame] = None,
@@ -536,78 +597,127 @@ def export_corrected_xml_xslt_id(
     outdir: Path,
     target_module: str,
     filetype: str,
+    id_index: Optional[Dict[str, Dict[str, Dict[str, int]]]] = None,
+    writer: Optional[XMLWriteQueue] = None,
 ) -> None:
     """
     read and correct wrong IDs in XML/XSLT files, and export them
+    id_index: `build_id_correction_index` の結果. なければここで作る
+    writer: あれば書き出しをスレッドに回す. 呼び出し側で drain すること
     """
+    if id_index is None:
+        id_index = build_id_correction_index(data)
     n_changed_files = 0
     for file in module_data_dir.rglob(f"./*.{filetype}"):
-        print(f"""checking {file.relative_to(module_data_dir)}""")
+        report.note("checked_files", "checking {}", file)
         any_changes = False
         if file.relative_to(module_data_dir).parts[0].lower() != "languages":
-            xml = ET.parse(file.open("r", encoding="utf-8"))
-            for name_attrs in FILTERS:
-                if filetype == "xml":
-                    xml_entries = xml.xpath(name_attrs["xpath"])
-                elif filetype == "xslt":
-                    xml_entries = extract_elements_from_xslt(xml, name_attrs)
-                d_sub = data.loc[
-                    lambda d: (d["context"] == f"""{name_attrs['context']}""")
-                    | (d["context"].isin(["module.string", "text.string"]))
-                ].assign(new_string=lambda d: "{=" + d["id"] + "}" + d["text_EN"])
+            xml = parse_xml(file)
+            for name_attrs, xml_entries in extract_filter_entries(xml, filetype):
                 for entry in xml_entries:
                     if filetype == "xslt":
                         old_string = entry.text
                     else:
                         old_string = entry.attrib[name_attrs["key"]]
-                    entry_id = match_public_id.sub(r"\1", old_string)
-                    entry_text = match_string.sub(r"\1", old_string)
-                    r = d_sub[
-                        lambda d: (d["id"] != entry_id) & (d["text_EN"] == entry_text)
-                    ].reset_index()
-                    if r.shape[0] > 0:
-                        any_changes = True
-                        print(
-                            f"""{entry_id}/{entry_text} -> {r.shape[0]}, {r['new_string']}"""
+                    if old_string is None:
+                        continue
+                    entry_id, entry_text = split_string_id(old_string)
+                    new_id = lookup_canonical_id(
+                        id_index, name_attrs["context"], entry_text, entry_id
+                    )
+                    if new_id is None:
+                        continue
+                    new_string = "{=" + new_id + "}" + entry_text
+                    if new_string == old_string:
+                        continue
+                    any_changes = True
+                    report.note(
+                        "id_corrections",
+                        "{}/{} -> {}",
+                        entry_id,
+                        entry_text,
+                        new_string,
+                    )
+                    if filetype == "xml":
+                        entry = replace_id_xml(
+                            entry, attr=name_attrs["key"], new_string=new_string
                         )
-                        if filetype == "xml":
-                            entry = replace_id_xml(
-                                entry,
-                                attr=name_attrs["key"],
-                                new_string=r["new_string"][0],
-                            )
-                        elif filetype == "xslt":
-                            entry = replace_id_xslt(
-                                entry,
-                                attr=name_attrs["key"],
-                                new_string=r["new_string"][0],
-                            )
-                        else:
-                            Warning("Incorrect file type")
+                    elif filetype == "xslt":
+                        entry = replace_id_xslt(
+                            entry, attr=name_attrs["key"], new_string=new_string
+                        )
+                    else:
+                        Warning("Incorrect file type")
         if any_changes:
             n_changed_files += 1
-            print(f"{file.name} is needed to be overwritten")
+            report.note(
+                "overwritten_files", "{} is needed to be overwritten", file.name
+            )
             outfp = outdir.joinpath(
                 f"{target_module}/ModuleData/{file.relative_to(module_data_dir)}"
             )
             if not dont_clean and outfp.exists():
-                print(f"deleting output old {outfp.name}")
+                report.note("deleted_files", "deleting output old {}", outfp.name)
                 outfp.unlink()
             if not outfp.parent.exists():
                 outfp.parent.mkdir(parents=True, exist_ok=True)
-            ET.indent(xml, space="  ", level=0)
-            xml.write(outfp, pretty_print=True, xml_declaration=True, encoding="utf-8")
+            if writer is None:
+                write_xml_atomic(xml, outfp)
+            else:
+                writer.write(xml, outfp)
         any_changes = False
     print(f"""{n_changed_files} {filetype.upper()} files exported""")
 
 
+# どのファイルの要素でも照合の対象にする context
+ID_FALLBACK_CONTEXTS = ["module.string", "text.string"]
+
+
+def build_id_correction_index(
+    data: pd.DataFrame,
+) -> Dict[str, Dict[str, Dict[str, int]]]:
+    """
+    context -> text_EN -> (ID -> 最初に現れた行番号) の索引を一度だけ作る. ID は現れた順に並ぶ
+    """
+    index: Dict[str, Dict[str, Dict[str, int]]] = dict()
+    for pos, (context, text, id) in enumerate(
+        zip(data["context"], data["text_EN"], data["id"])
+    ):
+        if not isinstance(text, str) or not isinstance(id, str):
+            continue
+        index.setdefault(context, dict()).setdefault(text, dict()).setdefault(id, pos)
+    return index
+
+
+def lookup_canonical_id(
+    id_index: Dict[str, Dict[str, Dict[str, int]]],
+    context: str,
+    text: str,
+    entry_id: str,
+) -> Optional[str]:
+    """
+    要素に付けるべき ID. 今の ID が候補に含まれていれば変更不要なので None.
+    候補は context が一致するか ID_FALLBACK_CONTEXTS のもので, 複数あれば元の DataFrame で先に現れたもの
+    """
+    best: Optional[Tuple[int, str]] = None
+    for ctx in [context] + ID_FALLBACK_CONTEXTS:
+        ids = id_index.get(ctx, dict()).get(text)
+        if ids is None:
+            continue
+        if entry_id in ids:
+            return None
+        id, pos = next(iter(ids.items()))
+        if best is None or pos < best[0]:
+            best = (pos, id)
+    return None if best is None else best[1]
+
+
 def replace_id_xml(name_attrs: ET.Element, attr: str, new_string: str) -> ET.Element:
     name_attrs.attrib[attr] = new_string
     return name_attrs
 
 
 def replace_id_xslt(name_attrs: ET.Element, attr: str, new_string: str) -> ET.Element:
-    print(name_attrs)
     name_attrs.text = new_string
     return name_attrs
 
@@ -616,25 +726,19 @@ def read_po_as_df(pofile: Path) -> pd.DataFrame:
     """
     read po as pd.DataFrame
     """
+    if pofile.suffix == ".mo":
+        return mo2pddf(pofile, drop_prefix_id=False)
     if pofile.exists():
         pof = polib.pofile(pofile)
     elif pofile.with_suffix(".mo").exists():
-        pof = polib.mofile(pofile.with_suffix(".mo"))
         print(f"{pofile.with_suffix('.mo')} loaded insteadly")
+        return mo2pddf(pofile.with_suffix(".mo"), drop_prefix_id=False)
     return po2pddf(pof, drop_prefix_id=False)
 
 
-def extract_elements_from_xslt(xml: ET.Element, param: dict_name_attr) -> ET.Element:
-    """
-    TODO: more rigorous conditioning
-    """
-    return xml.xpath(
-        f""".//xsl:template[contains(@match, "{param['context'].split('.')[0]}")]//xsl:attribute[@name='{param['key']}']""",
-        namespaces={"xsl": "http://www.w3.org/1999/XSL/Transform"},
-    )
-
-
 def main(arguments: argparse.Namespace):
+    configure_report(arguments)
+    profiler = open_profiler(arguments, "import_mod_language_XML")
     module_data_dir = arguments.mb2dir.joinpath(
         f"Modules/{arguments.target_module}/ModuleData"
     )
@@ -652,80 +756,103 @@ def main(arguments: argparse.Namespace):
             )
         else:
             raise (f"""{module_data_dir} not found!""")
-    d_mod = extract_all_text_from_xml(module_data_dir, arguments.verbose)
+    with profiler.stage("parse"):
+        d_mod = extract_all_text_from_xml(module_data_dir)
     n = d_mod.shape[0]
     print(f"""---- {n} entries detected from this mod ----""")
-    d_mod = normalize_string_ids(
-        data=d_mod,
-        how_distinct=arguments.how_distinct,
-        exclude_pattern=arguments.id_exclude_regex,
-        keep_redundancies=arguments.keep_redundancies,
-        autoid_digits=arguments.autoid_digits,
-        keep_vanilla_id=arguments.keep_vanilla_id,
-        langshort=arguments.langshort,
-        convert_exclam=arguments.convert_exclam,
-        autoid_prefix=arguments.autoid_prefix,
-    )
+    with profiler.stage("normalize"):
+        d_mod = normalize_string_ids(
+            data=d_mod,
+            how_distinct=arguments.how_distinct,
+            exclude_pattern=arguments.id_exclude_regex,
+            keep_redundancies=arguments.keep_redundancies,
+            autoid_digits=arguments.autoid_digits,
+            keep_vanilla_id=arguments.keep_vanilla_id,
+            vanilla_index=open_vanilla_index(
+                vanilla_id_source(arguments.langshort),
+                arguments.mb2dir,
+                default_cache_dir,
+            ),
+            convert_exclam=arguments.convert_exclam,
+            autoid_prefix=arguments.autoid_prefix,
+        )
     print(f"""---- {d_mod.shape[0]} entries left. ----""")
     print(
         f"---- Extract {arguments.langid} strings from ModuleData/Lanugages/ folders.----"
     )
-    d_mod_lang = read_mod_languages(
-        arguments.langid, module_data_dir.joinpath("Languages")
-    )
+    with profiler.stage("parse"):
+        d_mod_lang = read_mod_languages(
+            arguments.langid, module_data_dir.joinpath("Languages")
+        )
     print(f"""---- {d_mod_lang.shape[0]} entries found. ----""")
-    if arguments.pofile is not None:
-        if arguments.pofile.exists():
-            d_po = read_po_as_df(arguments.pofile).drop(columns=["duplication"])
+    with profiler.stage("parse"):
+        if arguments.pofile is not None:
+            if arguments.pofile.exists():
+                d_po = read_po_as_df(arguments.pofile).drop(columns=["duplication"])
+            else:
+                warnings.warn(f"""{arguments.pofile} not found""")
+                d_po = None
         else:
-            warnings.warn(f"""{arguments.pofile} not found""")
+            print(
+                "---- PO file not specified. mergeing with previous translation skipped. ----"
+            )
             d_po = None
-    else:
-        print(
-            "---- PO file not specified. mergeing with previous translation skipped. ----"
+    with profiler.stage("merge"):
+        d_mod = merge_language_file(
+            d_mod,
+            None if arguments.drop_original_language else d_mod_lang,
+            d_po,
+            "both",
         )
-        d_po = None
-    d_mod = merge_language_file(
-        d_mod, None if arguments.drop_original_language else d_mod_lang, d_po, "both"
-    )
-    if "text" not in d_mod.columns:
-        d_mod["text"] = ""
-    for filetype in ["xml", "xslt"]:
-        print(f"""---- Checking {filetype.upper()} files ----""")
-        export_corrected_xml_xslt_id(
+        if "text" not in d_mod.columns:
+            d_mod["text"] = ""
+        id_index = build_id_correction_index(d_mod)
+    with profiler.stage("XML write"), XMLWriteQueue() as writer:
+        for filetype in ["xml", "xslt"]:
+            print(f"""---- Checking {filetype.upper()} files ----""")
+            export_corrected_xml_xslt_id(
+                d_mod,
+                module_data_dir,
+                dont_clean=arguments.dont_clean,
+                outdir=arguments.outdir,
+                target_module=arguments.target_module,
+                filetype=filetype,
+                id_index=id_index,
+                writer=writer,
+            )
+    with profiler.stage("PO build"):
+        if "flags" in d_mod:
+            d_mod = d_mod.assign(flags=lambda d: [list(s) for s in d["flags"]])
+        else:
+            d_mod = d_mod.assign(flags=lambda d: [["fuzzy"]] * d.shape[0])
+        po_columns = pddf2po_columns(
             d_mod,
-            module_data_dir,
-            dont_clean=arguments.dont_clean,
-            outdir=arguments.outdir,
-            target_module=arguments.target_module,
-            filetype=filetype,
+            with_id=False,
+            make_distinct=False,
+            regacy_mode=False,
+            col_id_text="text_EN",
+            col_text="text",
+            col_comments="note",
+            col_context="context",
+            col_locations="file",
+            col_flags="flags",
         )
-    if "flags" in d_mod:
-        d_mod = d_mod.assign(flags=lambda d: [list(s) for s in d["flags"]])
-    else:
-        d_mod = d_mod.assign(flags=lambda d: [["fuzzy"]] * d.shape[0])
-    pof = pddf2po(
-        d_mod,
-        with_id=False,
-        make_distinct=False,
-        regacy_mode=False,
-        col_id_text="text_EN",
-        col_text="text",
-        col_comments="note",
-        col_context="context",
-        col_locations="file",
-        col_flags="flags",
-    )
-    fp_current_xlsx = arguments.outdir.joinpath(f"{arguments.target_module}.xlsx")
-    backup_if_exists(
-        fp_current_xlsx, f"""{datetime.now().strftime("%Y-%m-%dT%H-%M-%S")}.xlsx"""
-    )
-    d_mod.to_excel(fp_current_xlsx, index=False)
-    fp_current_po = arguments.outdir.joinpath(f"{arguments.target_module}.po")
-    backup_if_exists(
-        fp_current_po, f"""{datetime.now().strftime("%Y-%m-%dT%H-%M-%S")}.po"""
-    )
-    pof.save(fp_current_po)
+    with profiler.stage("table write"):
+        fp_current_table = arguments.outdir.joinpath(
+            f"{arguments.target_module}.parquet"
+        )
+        for suffix in [".parquet"] + ([".xlsx"] if arguments.xlsx else []):
+            backup_if_exists(
+                fp_current_table.with_suffix(suffix),
+                f"""{datetime.now().strftime("%Y-%m-%dT%H-%M-%S")}{suffix}""",
+            )
+        write_table(d_mod, fp_current_table, xlsx=arguments.xlsx)
+    with profiler.stage("PO write"):
+        fp_current_po = arguments.outdir.joinpath(f"{arguments.target_module}.po")
+        backup_if_exists(
+            fp_current_po, f"""{datetime.now().strftime("%Y-%m-%dT%H-%M-%S")}.po"""
+        )
+        write_po_columns(po_columns, fp_current_po)
     if platform.system() == "Windows" and not arguments.suppress_shortcut:
         shell = Dispatch("WScript.Shell")
         shortcut = shell.CreateShortCut(
@@ -734,6 +861,8 @@ def main(arguments: argparse.Namespace):
         shortcut.Targetpath = str(module_data_dir.parent)
         shortcut.WorkingDirectory = str(module_data_dir.parent)
         shortcut.save()
+    report.finish(arguments, "import_mod_language_XML")
+    profiler.save()
 
 
 def read_if_exists(fp: Path, func: Callable) -> Any:
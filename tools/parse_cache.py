@@ -0,0 +1,163 @@
+#! /usr/bin/env python3
+# encoding: utf-8
+import hashlib
+import json
+import os
+import time
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+default_cache_dir = Path(__file__).parent.joinpath(".cache")
+CACHE_VERSION = 1
+
+
+def hash_file(fpath: Path) -> str:
+    """
+    ファイルの内容の SHA-256
+    """
+    h = hashlib.sha256()
+    with fpath.open("rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class ParseCache:
+    """
+    言語ファイルから取り出した (id, text, file, module) をファイルごとに保存するディスクキャッシュ.
+    キーはファイルのパス, サイズ, 更新時刻, 内容のハッシュ. サイズと更新時刻が一致すれば stat だけで済ませ,
+    更新時刻だけが変わったときは内容のハッシュを比べる.
+    id と text は NUL 区切りで連結した UTF-8 のバイト列を列ごとに .npz に保存する.
+    合計サイズが `max_bytes` を超えたら最後に使われたのが古いものから削除する
+    """
+
+    def __init__(self, cache_dir: Path, max_bytes: int, name: str = "language-xml"):
+        self.dir = cache_dir.joinpath(name)
+        self.max_bytes = max_bytes
+        self.fp_index = self.dir.joinpath("index.json")
+        self.index: Dict[str, dict] = dict()
+        self.n_hit = 0
+        self.n_miss = 0
+        if self.fp_index.exists():
+            with self.fp_index.open("r", encoding="utf-8") as f:
+                index = json.load(f)
+            if index.get("version") == CACHE_VERSION:
+                self.index = index["entries"]
+
+    @staticmethod
+    def key(fpath: Path) -> str:
+        return str(fpath.resolve())
+
+    def blob_path(self, key: str) -> Path:
+        return self.dir.joinpath(
+            hashlib.sha256(key.encode("utf-8")).hexdigest()[:32] + ".npz"
+        )
+
+    def get(self, fpath: Path) -> Optional[Tuple[str, str, int, bool, str, str]]:
+        """
+        Returns: `read_language_strings_packed` と同じ形式に file, module を加えたもの. キャッシュがなければ None
+        """
+        key = self.key(fpath)
+        entry = self.index.get(key)
+        if entry is None:
+            self.n_miss += 1
+            return None
+        stat = fpath.stat()
+        if stat.st_size != entry["size"]:
+            self.n_miss += 1
+            return None
+        if stat.st_mtime_ns != entry["mtime_ns"]:
+            if hash_file(fpath) != entry["sha256"]:
+                self.n_miss += 1
+                return None
+            entry["mtime_ns"] = stat.st_mtime_ns
+        blob = self.blob_path(key)
+        if not blob.exists():
+            self.n_miss += 1
+            return None
+        with np.load(blob) as columns:
+            ids = columns["id"].tobytes().decode("utf-8")
+            texts = columns["text"].tobytes().decode("utf-8")
+        entry["last_used"] = time.time()
+        self.n_hit += 1
+        return (
+            ids,
+            texts,
+            entry["n"],
+            entry["has_strings"],
+            entry["file"],
+            entry["module"],
+        )
+
+    def put(
+        self,
+        fpath: Path,
+        packed: Tuple[str, str, int, bool],
+        file: str,
+        module: str,
+    ) -> None:
+        """
+        `read_language_strings_packed` の結果を保存する
+        """
+        if not self.dir.exists():
+            self.dir.mkdir(parents=True)
+        key = self.key(fpath)
+        stat = fpath.stat()
+        ids, texts, n, has_strings = packed
+        blob = self.blob_path(key)
+        # 索引と同じく一時ファイルに書いてから置き換え, 書きかけの .npz を残さない
+        fp_tmp = blob.with_suffix(".tmp")
+        with fp_tmp.open("wb") as f:
+            np.savez(
+                f,
+                id=np.frombuffer(ids.encode("utf-8"), dtype=np.uint8),
+                text=np.frombuffer(texts.encode("utf-8"), dtype=np.uint8),
+            )
+        os.replace(fp_tmp, blob)
+        self.index[key] = dict(
+            size=stat.st_size,
+            mtime_ns=stat.st_mtime_ns,
+            sha256=hash_file(fpath),
+            n=n,
+            has_strings=has_strings,
+            file=file,
+            module=module,
+            bytes=blob.stat().st_size,
+            last_used=time.time(),
+        )
+
+    def clear(self) -> None:
+        """
+        すべてのキャッシュを破棄する
+        """
+        for key in list(self.index.keys()):
+            self.evict(key)
+        if self.fp_index.exists():
+            self.fp_index.unlink()
+        print(f"cache cleared: {self.dir}")
+
+    def evict(self, key: str) -> None:
+        blob = self.blob_path(key)
+        if blob.exists():
+            blob.unlink()
+        del self.index[key]
+
+    def save(self) -> None:
+        """
+        上限を超えた分を古い順に削除してから索引を書き込む
+        """
+        total = sum(x["bytes"] for x in self.index.values())
+        for key in sorted(self.index, key=lambda k: self.index[k]["last_used"]):
+            if total <= self.max_bytes:
+                break
+            total -= self.index[key]["bytes"]
+            self.evict(key)
+        if not self.dir.exists():
+            return
+        fp_tmp = self.fp_index.with_suffix(".tmp")
+        with fp_tmp.open("w", encoding="utf-8") as f:
+            json.dump(dict(version=CACHE_VERSION, entries=self.index), f)
+        os.replace(fp_tmp, self.fp_index)
+        print(f"parse cache: {self.n_hit} hits, {self.n_miss} misses, {total} bytes")
@@ -0,0 +1,218 @@
+#! /usr/bin/env python3
+# encoding: utf-8
+import argparse
+import warnings
+from pathlib import Path
+
+import export_vanilla_XML
+import read_vanilla_XML
+from export_manifest import ExportManifest
+from functions import merge_yml
+from parse_cache import default_cache_dir
+from profiling import add_profile_arguments, open_profiler
+from run_report import add_report_arguments, configure_report, report
+from text_markup import check_catalog_markup, read_function_names, write_markup_issues
+
+# パイプラインのオプションのうち, 同じ名前で各段階のスクリプトに渡すもの
+SHARED_OPTIONS = [
+    "mb2dir",
+    "langshort",
+    "langid",
+    "modules",
+    "output_type",
+    "jobs",
+    "cache_dir",
+    "plan",
+    "force",
+    "suppress_missing_id",
+    "verbose",
+    "xlsx",
+    "debug_tables",
+    "memory_top_k",
+    "memory_threshold",
+]
+
+parser = argparse.ArgumentParser()
+parser.add_argument(
+    "--mb2dir",
+    type=Path,
+    default=None,
+    help="to specify Mount and Blade II installation folder",
+)
+parser.add_argument("--langshort", type=str, default=None)
+parser.add_argument("--langid", type=str, default=None)
+parser.add_argument(
+    "--catalog",
+    type=Path,
+    default=Path("text/MB2BL-JP.po"),
+    help="translation catalog. its translations are merged into the new catalog, which is written back only with --write-catalog",
+)
+parser.add_argument(
+    "--pofile",
+    type=Path,
+    default=None,
+    help="older .PO file path to merge. Default: --catalog",
+)
+parser.add_argument(
+    "--output", type=Path, default=Path("Modules"), help="output folder of the XMLs"
+)
+parser.add_argument("--modules", nargs="*", default=None)
+parser.add_argument("--output-type", type=str, default="module")
+parser.add_argument(
+    "--write-catalog",
+    default=None,
+    action="store_true",
+    help="write the merged catalog to --catalog (the old one is renamed) and publish the public catalogs",
+)
+parser.add_argument(
+    "--write-table",
+    default=None,
+    action="store_true",
+    help="write the original text table to text/MB2BL-<langshort>.parquet",
+)
+parser.add_argument(
+    "--xlsx",
+    default=None,
+    action="store_true",
+    help="also write the tables as .xlsx for reading with a spreadsheet",
+)
+parser.add_argument(
+    "--debug-tables",
+    default=None,
+    action="store_true",
+    help="write the intermediate tables for debugging",
+)
+parser.add_argument(
+    "--memory-top-k",
+    type=int,
+    default=None,
+    help="fill untranslated entries with similar translations in --pofile as fuzzy",
+)
+parser.add_argument("--memory-threshold", type=float, default=None)
+parser.add_argument(
+    "--jobs",
+    type=int,
+    default=None,
+    help="number of processes to parse and to rewrite the language files",
+)
+parser.add_argument("--cache-dir", type=Path, default=None)
+parser.add_argument(
+    "--plan",
+    default=None,
+    action="store_true",
+    help="list the files to be rewritten without writing anything",
+)
+parser.add_argument(
+    "--force",
+    default=None,
+    action="store_true",
+    help="rewrite all files even if their inputs are unchanged",
+)
+parser.add_argument(
+    "--suppress-missing-id",
+    default=None,
+    action="store_true",
+    help="to supress to output unmatched IDs",
+)
+parser.add_argument(
+    "--verbose", default=None, action="store_true", help="output verbose log"
+)
+parser.add_argument(
+    "--check-markup",
+    type=Path,
+    nargs="?",
+    const=Path("markup-report.csv"),
+    default=None,
+    help="check the variables and control tokens of the merged catalog before exporting and write the flagged entries. Default path: markup-report.csv",
+)
+add_profile_arguments(parser)
+add_report_arguments(parser)
+
+
+def main():
+    """
+    `read_vanilla_XML.py` と `export_vanilla_XML.py` を続けて実行する.
+    読み込んだ言語ファイルとカタログはファイルを経由せずに渡し, 原文と公式訳の表も一度だけ作る
+    """
+    args = parser.parse_args()
+    if args.pofile is None:
+        args.pofile = args.catalog
+    print(args)
+    configure_report(args)
+    profiler = open_profiler(args, "pipeline")
+    read_args = stage_arguments(
+        read_vanilla_XML.parser, args, output=args.catalog, pofile=args.pofile
+    )
+    export_args = stage_arguments(
+        export_vanilla_XML.parser, args, input=args.catalog, output=args.output
+    )
+    if export_args.langfolder_output is None:
+        export_args.langfolder_output = export_args.langshort
+    if args.output_type == "both":
+        run_types = ["module", "overwriter"]
+    elif args.output_type in ["module", "overwriter"]:
+        run_types = [args.output_type]
+    else:
+        warnings.warn(
+            f'{args.output_type} must be "module", "overwriter", or "both" ',
+            UserWarning,
+        )
+        return
+    df_original, catalog = read_vanilla_XML.build_catalog(
+        read_args, profiler, store_table=bool(args.write_table) and not args.plan
+    )
+    if args.check_markup is not None:
+        with profiler.stage("markup"):
+            functions = read_function_names(
+                Path(__file__).parent.parent.joinpath("Modules", export_args.functions)
+            )
+            write_markup_issues(
+                check_catalog_markup(catalog, functions), args.check_markup
+            )
+    write_catalog = bool(args.write_catalog) and not args.plan
+    if write_catalog:
+        with profiler.stage("PO write"):
+            read_vanilla_XML.write_catalog(read_args, catalog)
+    for run_type in run_types:
+        export_vanilla_XML.export_modules(
+            export_args, run_type, profiler, catalog=catalog, df_original=df_original
+        )
+    if write_catalog:
+        with profiler.stage("PO write"):
+            # export_modules も同じマニフェストを読み書きするので, 書き出しが終わってから記録する
+            cache_dir = (
+                default_cache_dir
+                if export_args.cache_dir is None
+                else Path(export_args.cache_dir)
+            )
+            manifest = ExportManifest(cache_dir.joinpath("export-manifest.json"))
+            publishing = export_vanilla_XML.publish_public_catalog(
+                catalog, manifest, export_args
+            )
+            if publishing is not None:
+                publishing.result()
+                manifest.save()
+    report.finish(args, "pipeline")
+    profiler.save()
+
+
+def stage_arguments(
+    stage_parser: argparse.ArgumentParser, args: argparse.Namespace, **overrides
+) -> argparse.Namespace:
+    """
+    各段階のスクリプトの既定値に default.yml を重ね, パイプラインで指定したオプションで上書きする
+    """
+    stage_args = stage_parser.parse_args([])
+    for k in SHARED_OPTIONS:
+        if hasattr(stage_args, k) and getattr(args, k) is not None:
+            setattr(stage_args, k, getattr(args, k))
+    for k, v in overrides.items():
+        setattr(stage_args, k, v)
+    fp = Path(__file__).parent.joinpath("default.yml")
+    if fp.exists():
+        stage_args = merge_yml(fp, stage_args, stage_parser.parse_args([]))
+    return stage_args
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,249 @@
+#! /usr/bin/env python3
+# encoding: utf-8
+import argparse
+import cProfile
+import json
+import platform
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional
+
+TOP_ALLOCATIONS = 10
+
+
+def add_profile_arguments(parser: argparse.ArgumentParser) -> None:
+    """
+    各スクリプトに共通の `--profile` オプションを加える
+    """
+    parser.add_argument(
+        "--profile",
+        type=Path,
+        nargs="?",
+        const=Path(""),
+        default=None,
+        help="record wall time, CPU time, peak RSS and the top allocators of each stage as JSON. Default path: <script>-profile-<datetime>.json. It makes the run considerably slower",
+    )
+    parser.add_argument(
+        "--profile-cprofile",
+        default=None,
+        action="store_true",
+        help="with --profile, also dump cProfile statistics of each stage next to the JSON",
+    )
+
+
+def peak_rss_bytes() -> Optional[int]:
+    """
+    プロセスの最大常駐メモリ. 取得できなければ None
+    """
+    if platform.system() == "Windows":
+        import ctypes
+        from ctypes import wintypes
+
+        class PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+            _fields_ = [
+                ("cb", wintypes.DWORD),
+                ("PageFaultCount", wintypes.DWORD),
+                ("PeakWorkingSetSize", ctypes.c_size_t),
+                ("WorkingSetSize", ctypes.c_size_t),
+                ("QuotaPeakPagedPoolUsage", ctypes.c_size_t),
+                ("QuotaPagedPoolUsage", ctypes.c_size_t),
+                ("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t),
+                ("QuotaNonPagedPoolUsage", ctypes.c_size_t),
+                ("PagefileUsage", ctypes.c_size_t),
+                ("PeakPagefileUsage", ctypes.c_size_t),
+            ]
+
+        counters = PROCESS_MEMORY_COUNTERS()
+        counters.cb = ctypes.sizeof(counters)
+        ok = ctypes.windll.psapi.GetProcessMemoryInfo(
+            ctypes.windll.kernel32.GetCurrentProcess(),
+            ctypes.byref(counters),
+            counters.cb,
+        )
+        return counters.PeakWorkingSetSize if ok else None
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux は KiB, macOS はバイト
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+class StageProfiler:
+    """
+    名前を付けた処理 (stage) ごとに経過時間, CPU時間, 最大常駐メモリ, tracemalloc で見た割り当ての多い行を記録する.
+    同じ名前の stage を何度も通ったときは合算する. 無効なら何もしない
+    """
+
+    def __init__(
+        self,
+        script: str,
+        fpath: Optional[Path] = None,
+        with_cprofile: bool = False,
+    ):
+        self.script = script
+        self.enabled = fpath is not None
+        if self.enabled and fpath == Path(""):
+            fpath = Path(
+                f"""{script}-profile-{datetime.now().strftime("%Y-%m-%dT%H%M%S")}.json"""
+            )
+        self.fpath = fpath
+        self.with_cprofile = with_cprofile
+        self.stages: Dict[str, dict] = dict()
+        self.cprofiles: Dict[str, cProfile.Profile] = dict()
+        # 入れ子になった stage の tracemalloc のピーク. reset_peak で外側の値が消えないように持ち回る
+        self.peak_stack: List[int] = []
+        self.started = datetime.now().isoformat(timespec="seconds")
+        self.wall = time.perf_counter()
+        self.cpu = time.process_time()
+        if self.enabled:
+            tracemalloc.start()
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        if not self.enabled:
+            yield
+            return
+        if len(self.peak_stack) > 0:
+            self.peak_stack[-1] = max(
+                self.peak_stack[-1], tracemalloc.get_traced_memory()[1]
+            )
+        tracemalloc.reset_peak()
+        self.peak_stack.append(0)
+        snapshot = tracemalloc.take_snapshot()
+        rss = peak_rss_bytes()
+        profile = None
+        if self.with_cprofile and len(self.peak_stack) == 1:
+            # cProfile は同時に1つしか有効にできないので外側の stage だけ
+            profile = self.cprofiles.setdefault(name, cProfile.Profile())
+            profile.enable()
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        try:
+            yield
+        finally:
+            wall = time.perf_counter() - wall
+            cpu = time.process_time() - cpu
+            if profile is not None:
+                profile.disable()
+            peak = max(self.peak_stack.pop(), tracemalloc.get_traced_memory()[1])
+            if len(self.peak_stack) > 0:
+                self.peak_stack[-1] = max(self.peak_stack[-1], peak)
+            self.record(
+                name,
+                wall,
+                cpu,
+                rss,
+                peak,
+                tracemalloc.take_snapshot().compare_to(snapshot, "lineno"),
+            )
+
+    def record(
+        self,
+        name: str,
+        wall: float,
+        cpu: float,
+        rss_before: Optional[int],
+        traced_peak: int,
+        diffs: List[tracemalloc.StatisticDiff],
+    ) -> None:
+        rss = peak_rss_bytes()
+        stage = self.stages.setdefault(
+            name,
+            dict(
+                calls=0,
+                wall_seconds=0.0,
+                cpu_seconds=0.0,
+                peak_rss_bytes=None,
+                peak_rss_growth_bytes=0,
+                traced_peak_bytes=0,
+                allocations=dict(),
+            ),
+        )
+        stage["calls"] += 1
+        stage["wall_seconds"] += wall
+        stage["cpu_seconds"] += cpu
+        if rss is not None and rss_before is not None:
+            stage["peak_rss_bytes"] = max(stage["peak_rss_bytes"] or 0, rss)
+            stage["peak_rss_growth_bytes"] += rss - rss_before
+        stage["traced_peak_bytes"] = max(stage["traced_peak_bytes"], traced_peak)
+        for diff in diffs:
+            if diff.size_diff <= 0:
+                continue
+            frame = diff.traceback[0]
+            location = f"{frame.filename}:{frame.lineno}"
+            size, count = stage["allocations"].get(location, (0, 0))
+            stage["allocations"][location] = (
+                size + diff.size_diff,
+                count + diff.count_diff,
+            )
+
+    def report(self) -> dict:
+        stages = dict()
+        for name, stage in self.stages.items():
+            top = sorted(stage["allocations"].items(), key=lambda x: -x[1][0])
+            stages[name] = dict(
+                {k: v for k, v in stage.items() if k != "allocations"},
+                top_allocations=[
+                    dict(location=location, size_bytes=size, count=count)
+                    for location, (size, count) in top[:TOP_ALLOCATIONS]
+                ],
+            )
+            if name in self.cprofiles:
+                stages[name]["cprofile"] = str(self.cprofile_path(name))
+        return dict(
+            script=self.script,
+            argv=sys.argv,
+            started=self.started,
+            python=sys.version.split()[0],
+            platform=platform.platform(),
+            wall_seconds=time.perf_counter() - self.wall,
+            cpu_seconds=time.process_time() - self.cpu,
+            peak_rss_bytes=peak_rss_bytes(),
+            traced_peak_bytes=max(
+                [x["traced_peak_bytes"] for x in self.stages.values()]
+                + [tracemalloc.get_traced_memory()[1]]
+            ),
+            stages=stages,
+        )
+
+    def cprofile_path(self, name: str) -> Path:
+        stage = "".join(c if c.isalnum() else "_" for c in name)
+        return self.fpath.with_name(f"{self.fpath.stem}-{stage}.prof")
+
+    def save(self) -> None:
+        """
+        JSON とあれば cProfile の統計を書き出して要約を表示する
+        """
+        if not self.enabled:
+            return
+        report = self.report()
+        tracemalloc.stop()
+        if not self.fpath.parent.exists():
+            self.fpath.parent.mkdir(parents=True)
+        with self.fpath.open("w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        for name, profile in self.cprofiles.items():
+            profile.dump_stats(self.cprofile_path(name))
+        print(f"PROFILE: {self.fpath}")
+        for name, stage in report["stages"].items():
+            rss = stage["peak_rss_bytes"]
+            print(
+                f"""  {name:<12} wall {stage['wall_seconds']:8.2f}s  cpu {stage['cpu_seconds']:8.2f}s  peak RSS {'-' if rss is None else f'{rss / 1024**2:.0f}MB'}  traced peak {stage['traced_peak_bytes'] / 1024**2:.0f}MB"""
+            )
+
+
+def open_profiler(args: argparse.Namespace, script: str) -> StageProfiler:
+    """
+    `add_profile_arguments` のオプションから作る. `--profile` がなければ何もしないものを返す
+    """
+    return StageProfiler(
+        script,
+        getattr(args, "profile", None),
+        with_cprofile=bool(getattr(args, "profile_cprofile", False)),
+    )
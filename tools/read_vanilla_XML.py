@@ -2,15 +2,25 @@
 # encoding: utf-8
 import argparse
 import warnings
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
 from pathlib import Path
-from typing import Optional
+from typing import Dict, List, Optional, Tuple
 
-import lxml.etree as ET
 import numpy as np
 import pandas as pd
 import polib
-from functions import initializePOFile, merge_yml, update_with_older_po
+from functions import (
+    initializePOFile,
+    merge_yml,
+    read_language_strings_packed,
+    unpack_language_strings,
+    update_with_older_po,
+)
+from parse_cache import ParseCache, default_cache_dir
+from profiling import StageProfiler, add_profile_arguments, open_profiler
+from run_report import add_report_arguments, configure_report, report
+from table_store import write_table
 
 default_output_path = Path("text/MB2BL-JP.po")
 # *_functions.xml?
@@ -59,117 +69,211 @@ parser.add_argument("--legacy-id", default=False, action="store_true")
 parser.add_argument("--duplication-in-comment", default=False, action="store_true")
 parser.add_argument("--drop-multiplayer", default=None, action="store_true")
 parser.add_argument("--dont-evaluate-facial", default=False, action="store_true")
+parser.add_argument(
+    "--memory-top-k",
+    type=int,
+    default=None,
+    help="fill untranslated entries with the translation of the most similar text in the older PO as fuzzy, listing up to N candidates in the comment. Default: 0 (off)",
+)
+parser.add_argument(
+    "--memory-threshold",
+    type=float,
+    default=None,
+    help="min similarity (character 3-gram Jaccard index) of the candidates. Default: 0.5",
+)
+parser.add_argument(
+    "--jobs",
+    type=int,
+    default=None,
+    help="number of processes to parse the language files. Default: 1 (no parallel)",
+)
+parser.add_argument(
+    "--cache-dir",
+    type=Path,
+    default=None,
+    help=f"folder to cache the parsed language files. Default: {default_cache_dir}",
+)
+parser.add_argument(
+    "--cache-size",
+    type=int,
+    default=None,
+    help="max size of the parse cache in MB. Default: 512",
+)
+parser.add_argument(
+    "--no-cache", default=None, action="store_true", help="don't use the parse cache"
+)
+parser.add_argument(
+    "--clear-cache",
+    default=None,
+    action="store_true",
+    help="discard the parse cache before reading",
+)
+parser.add_argument(
+    "--xlsx",
+    default=None,
+    action="store_true",
+    help="also write the tables as .xlsx for reading with a spreadsheet",
+)
+parser.add_argument(
+    "--debug-tables",
+    default=None,
+    action="store_true",
+    help="write the intermediate tables for debugging",
+)
+add_profile_arguments(parser)
+add_report_arguments(parser)
 
 
 def main(args: argparse.Namespace):
     """
     a
     """
-    df_new = read_xmls(args, how_join="outer")
-    dup = check_duplication(df_new)
+    configure_report(args)
+    profiler = open_profiler(args, "read_vanilla_XML")
+    _, new_one = build_catalog(args, profiler)
+    with profiler.stage("PO write"):
+        write_catalog(args, new_one)
+    report.finish(args, "read_vanilla_XML")
+    profiler.save()
 
-    df_new.to_excel(f"text/MB2BL-{args.langshort}.xlsx", index=False)
 
-    df_new = escape_for_po(df_new, ["text_EN", f"text_{args.langshort}_original"])
-    if args.legacy_id:
-        df_new = df_new.assign(
-            id_original=lambda d: d["id"],
-            id_short=lambda d: d["module"] + "/" + d["file"] + "/" + d["id"],
-            id=lambda d: d["id"] + "/" + d["text_EN"],
-        )
-    else:
-        df_new = df_new.assign(
-            id_original=lambda d: d["id"], id=lambda d: d["id"] + "/" + d["text_EN"]
-        )
-    df_new[f"text_{args.langshort}_original"] = df_new[
-        f"text_{args.langshort}_original"
-    ].fillna("")
-    df_new = df_new.reset_index(drop=True)
+def build_catalog(
+    args: argparse.Namespace,
+    profiler: Optional[StageProfiler] = None,
+    store_table: bool = True,
+) -> Tuple[pd.DataFrame, polib.POFile]:
+    """
+    ゲーム本体の言語ファイルを読み, 古い翻訳ファイルの訳を引き継いだカタログを作る. カタログの書き出しはしない
+    Returns:
+        原文と公式訳の表. `store_table` なら `text/MB2BL-{langshort}.parquet` にも書き出す
+        カタログ
+    """
+    if profiler is None:
+        profiler = StageProfiler("read_vanilla_XML")
+    with profiler.stage("parse"):
+        df_original = read_xmls(args, how_join="outer")
+        dup = check_duplication(df_original)
 
-    if args.distinct:
-        print("Dropping duplicated IDs")
-        # TODO: この辺がクソ遅い, たぶん row-wise な処理の実装がアレ
-        duplicates = (
-            df_new[["id", "file", "module"]]
-            .assign(locations=lambda d: (d["module"] + "/" + d["file"]).astype(str))
-            .groupby("id")
-            .agg(
-                {
-                    "locations": [
-                        lambda locs: [(x, 0) for x in locs],
-                        lambda locs: len(locs),
-                    ]
-                }
+    if store_table:
+        with profiler.stage("table write"):
+            write_table(
+                df_original,
+                Path(f"text/MB2BL-{args.langshort}.parquet"),
+                xlsx=args.xlsx,
             )
-            .reset_index()
+
+    with profiler.stage("normalize"):
+        df_new = escape_for_po(
+            df_original.copy(), ["text_EN", f"text_{args.langshort}_original"]
         )
-        duplicates.to_csv("hanakuso.csv", index=False)
-        duplicates.columns = ["id", "locations", "duplication"]
-        df_new = drop_duplicates(df_new, compare_module=True, compare_file=True)
-        df_new = df_new.merge(duplicates, on="id", how="left")
-        if args.duplication_in_comment:
+        if args.legacy_id:
             df_new = df_new.assign(
-                notes=lambda d: np.where(
-                    d["duplication"] > 1,
-                    [
-                        ",".join(
-                            [
-                                x
-                                for x in [note, f"""{ndup} ID duplications"""]
-                                if x != ""
-                            ]
-                        )
-                        for note, ndup in zip(d["notes"], d["duplication"])
-                    ],
-                    d["notes"],
-                )
+                id_original=lambda d: d["id"],
+                id_short=lambda d: d["module"] + "/" + d["file"] + "/" + d["id"],
+                id=lambda d: d["id"] + "/" + d["text_EN"],
             )
+        else:
+            df_new = df_new.assign(
+                id_original=lambda d: d["id"], id=lambda d: d["id"] + "/" + d["text_EN"]
+            )
+        df_new[f"text_{args.langshort}_original"] = df_new[
+            f"text_{args.langshort}_original"
+        ].fillna("")
+        df_new = df_new.reset_index(drop=True)
 
-    new_pof = initializePOFile("ja_JP")
-    if args.only_diff:
-        for _, r in df_new.iterrows():
-            new_pof.append(polib.POEntry(msgid=r["id"], flags=["fuzzy"]))
-    else:
-        for _, r in df_new.iterrows():
-            new_pof.append(
-                polib.POEntry(
-                    msgid=r["id"],
-                    msgstr=r[f"text_{args.langshort}_original"],
-                    tcomment="" if r["notes"] == "" else "\n".join([r["notes"]]),
-                    occurrences=r["locations"],
-                    flags=["fuzzy"],
+        if args.distinct:
+            print("Dropping duplicated IDs")
+            # TODO: この辺がクソ遅い, たぶん row-wise な処理の実装がアレ
+            duplicates = (
+                df_new[["id", "file", "module"]]
+                .assign(locations=lambda d: (d["module"] + "/" + d["file"]).astype(str))
+                .groupby("id")
+                .agg(
+                    {
+                        "locations": [
+                            lambda locs: [(x, 0) for x in locs],
+                            lambda locs: len(locs),
+                        ]
+                    }
                 )
+                .reset_index()
             )
-    if args.pofile.exists():
-        if args.pofile.suffix == ".po":
-            old_po = polib.pofile(args.pofile, encoding="utf-8")
-        elif args.pofile.suffix == ".mo":
-            old_po = polib.mofile(args.pofile, encoding="utf-8")
+            duplicates.columns = ["id", "locations", "duplication"]
+            if args.debug_tables:
+                write_table(duplicates, Path("hanakuso.parquet"), xlsx=args.xlsx)
+            df_new = drop_duplicates(df_new, compare_module=True, compare_file=True)
+            df_new = df_new.merge(duplicates, on="id", how="left")
+            if args.duplication_in_comment:
+                df_new = df_new.assign(
+                    notes=lambda d: np.where(
+                        d["duplication"] > 1,
+                        [
+                            ",".join(
+                                [
+                                    x
+                                    for x in [note, f"""{ndup} ID duplications"""]
+                                    if x != ""
+                                ]
+                            )
+                            for note, ndup in zip(d["notes"], d["duplication"])
+                        ],
+                        d["notes"],
+                    )
+                )
+
+    with profiler.stage("PO build"):
+        new_pof = initializePOFile("ja_JP")
+        if args.only_diff:
+            for _, r in df_new.iterrows():
+                new_pof.append(polib.POEntry(msgid=r["id"], flags=["fuzzy"]))
         else:
-            old_po = None
-        if old_po is None:
-            warnings.warn("Old translation file path may be misspecified!")
+            for _, r in df_new.iterrows():
+                new_pof.append(
+                    polib.POEntry(
+                        msgid=r["id"],
+                        msgstr=r[f"text_{args.langshort}_original"],
+                        tcomment="" if r["notes"] == "" else "\n".join([r["notes"]]),
+                        occurrences=r["locations"],
+                        flags=["fuzzy"],
+                    )
+                )
+    with profiler.stage("merge"):
+        if args.pofile.exists():
+            if args.pofile.suffix == ".po":
+                old_po = polib.pofile(args.pofile, encoding="utf-8")
+            elif args.pofile.suffix == ".mo":
+                old_po = polib.mofile(args.pofile, encoding="utf-8")
+            else:
+                old_po = None
+            if old_po is None:
+                warnings.warn("Old translation file path may be misspecified!")
+            else:
+                new_one = update_with_older_po(
+                    old_po,
+                    new_pof,
+                    args.all_fuzzy,
+                    ignore_facial=False,
+                    legacy_id=args.legacy_id,
+                    memory_top_k=args.memory_top_k,
+                    memory_threshold=args.memory_threshold,
+                )
         else:
-            new_one = update_with_older_po(
-                old_po,
-                new_pof,
-                args.all_fuzzy,
-                ignore_facial=False,
-                legacy_id=args.legacy_id,
-            )
-    else:
-        print("Old PO file not found. merging is skipped")
-        new_one = new_pof
+            print("Old PO file not found. merging is skipped")
+            new_one = new_pof
+    return df_original, new_one
 
-    df_new = df_new.set_index("id")
 
+def write_catalog(args: argparse.Namespace, pof: polib.POFile) -> None:
+    """
+    既存のファイルは日時を付けた名前に変えて残す
+    """
     if args.output.exists():
         backup_path = args.output.parent.joinpath(
             f"""{args.output.with_suffix('').name}-{datetime.now().strftime("%Y-%m-%dT%H%M%S")}.po"""
         )
         args.output.rename(backup_path)
         print(f"""old file is renamed to {backup_path.name}""")
-    new_one.save(args.output)
+    pof.save(args.output)
     print(f"""WRITE AT: {args.output}""")
 
 
@@ -185,9 +289,14 @@ def read_xmls(args: argparse.Namespace, how_join="left") -> pd.DataFrame:
         ("Native", "std_mpitems_xml.xml"),
         ("Native", "std_multiplayer_strings_xml.xml"),
     ]
-    d = dict()
-    d["EN"] = []
-    d[args.langshort] = []
+    # 列ごとのバッファに追記して最後に一度だけ DataFrame にする
+    buffers: Dict[str, Dict[str, List[str]]] = {
+        lang: dict(id=[], text=[], file=[], module=[])
+        for lang in ["EN", args.langshort]
+    }
+
+    # 読むファイルの順序を先に確定させておけば, 並列に読んでも行の順序は逐次処理と同じになる
+    tasks: List[Tuple[Path, str, str, str]] = []
     for module in args.vanilla_modules:
         dp = (
             args.mb2dir.joinpath("Modules")
@@ -196,39 +305,54 @@ def read_xmls(args: argparse.Namespace, how_join="left") -> pd.DataFrame:
         )
         for fp in dp.joinpath(args.langshort).glob("*.xml"):
             if not args.drop_multiplayer or (module, fp.name) not in MULTIPLATERS:
-                xml = ET.parse(fp)
-                if xml.find("strings") is not None:
-                    print(f"reading {args.langshort} file: {fp}")
-                    d[args.langshort] += [
-                        pd.DataFrame(
-                            [
-                                (x.attrib["id"], x.attrib["text"])
-                                for x in xml.findall("strings/string")
-                            ],
-                            columns=["id", f"text_{args.langshort}_original"],
-                        ).assign(file=fp.name, module=module)
-                    ]
+                tasks += [(fp, module, args.langshort, args.langshort)]
         for fp in dp.glob("*.xml"):
             if not args.drop_multiplayer or (module, fp.name) not in MULTIPLATERS:
-                xml = ET.parse(fp)
-                if xml.find("strings") is not None:
-                    print(f"reading English file: {fp}")
-                    d["EN"] += [
-                        pd.DataFrame(
-                            [
-                                (x.attrib["id"], x.attrib["text"])
-                                for x in xml.findall("strings/string")
-                            ],
-                            columns=["id", "text_EN"],
-                        ).assign(file=fp.name, module=module)
-                    ]
-    d["EN"] = pd.concat(d["EN"])
+                tasks += [(fp, module, "EN", "English")]
+
+    results: List[Optional[Tuple[str, str, int, bool]]] = [None] * len(tasks)
+    cache = open_parse_cache(args)
+    if cache is not None:
+        for i, (fp, module, _, _) in enumerate(tasks):
+            cached = cache.get(fp)
+            if cached is not None:
+                results[i] = cached[:4]
+    i_missing = [i for i, x in enumerate(results) if x is None]
+    fp_missing = [tasks[i][0] for i in i_missing]
+    if args.jobs is not None and args.jobs > 1 and len(fp_missing) > 1:
+        print(f"parsing {len(fp_missing)} files with {args.jobs} processes")
+        with ProcessPoolExecutor(max_workers=args.jobs) as executor:
+            parsed = list(executor.map(read_language_strings_packed, fp_missing))
+    else:
+        parsed = [read_language_strings_packed(fp) for fp in fp_missing]
+    for i, packed in zip(i_missing, parsed):
+        results[i] = packed
+        if cache is not None:
+            cache.put(tasks[i][0], packed, file=tasks[i][0].name, module=tasks[i][1])
+    if cache is not None:
+        cache.save()
+    del parsed
+    for (fp, module, lang, lang_name), packed in zip(tasks, results):
+        ids, texts, has_strings = unpack_language_strings(packed)
+        if has_strings:
+            report.note("language_files", "reading {} file: {}", lang_name, fp)
+            buffers[lang]["id"] += ids
+            buffers[lang]["text"] += texts
+            buffers[lang]["file"] += [fp.name] * len(ids)
+            buffers[lang]["module"] += [module] * len(ids)
+    del results
+    d = {
+        lang: pd.DataFrame(buffer).rename(columns={"text": text_col})
+        for (lang, buffer), text_col in zip(
+            buffers.items(), ["text_EN", f"text_{args.langshort}_original"]
+        )
+    }
+    del buffers
     d["EN"] = d["EN"].assign(
         text_EN=lambda d: d["text_EN"].str.replace(
             "[\u00a0\u180e\u2007\u200b\u200f\u202f\u2060\ufeff]", "", regex=True
         )
     )
-    d[args.langshort] = pd.concat(d[args.langshort])
     d[args.langshort][f"text_{args.langshort}_original"] = d[args.langshort][
         f"text_{args.langshort}_original"
     ].str.replace("[\u00a0\u180e\u2007\u200b\u200f\u202f\u2060\ufeff]", "", regex=True)
@@ -269,6 +393,21 @@ def read_xmls(args: argparse.Namespace, how_join="left") -> pd.DataFrame:
     return d_bilingual
 
 
+def open_parse_cache(args: argparse.Namespace) -> Optional[ParseCache]:
+    """
+    オプションに従って解析結果のキャッシュを開く. --no-cache なら None
+    """
+    if args.no_cache:
+        return None
+    cache = ParseCache(
+        default_cache_dir if args.cache_dir is None else args.cache_dir,
+        max_bytes=(512 if args.cache_size is None else args.cache_size) * 1024**2,
+    )
+    if args.clear_cache:
+        cache.clear()
+    return cache
+
+
 def check_duplication(df_bilingual: pd.DataFrame) -> pd.DataFrame:
     """
     a
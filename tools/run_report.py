@@ -0,0 +1,174 @@
+#! /usr/bin/env python3
+# encoding: utf-8
+import argparse
+import json
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+QUIET = 0
+NORMAL = 1
+VERBOSE = 2
+MAX_SAMPLES = 5
+
+
+def add_report_arguments(parser: argparse.ArgumentParser) -> None:
+    """
+    各スクリプトに共通の `--report`, `--quiet` オプションを加える
+    """
+    parser.add_argument(
+        "--report",
+        type=Path,
+        nargs="?",
+        const=Path(""),
+        default=None,
+        help="write the counters and samples of the run as JSON. Default path: <script>-report-<datetime>.json",
+    )
+    parser.add_argument(
+        "--quiet",
+        default=None,
+        action="store_true",
+        help="show only the number of warnings at the end",
+    )
+
+
+class RunReport:
+    """
+    ファイルや項目ごとのループで print や warnings.warn する代わりに件数と最初の数件の例だけを集める.
+    メッセージは書式と値のまま持っておき, 整形は要約を出すときまで遅らせる.
+    VERBOSE のときだけその場で表示する
+    """
+
+    def __init__(self, verbosity: int = NORMAL, max_samples: int = MAX_SAMPLES):
+        self.reset(verbosity, max_samples)
+
+    def reset(self, verbosity: int = NORMAL, max_samples: int = MAX_SAMPLES) -> None:
+        self.verbosity = verbosity
+        self.max_samples = max_samples
+        self.counters: Dict[str, int] = dict()
+        self.messages: Dict[str, Tuple[str, bool]] = dict()
+        self.samples: Dict[str, List[tuple]] = dict()
+
+    def count(self, key: str, n: int = 1) -> None:
+        self.counters[key] = self.counters.get(key, 0) + n
+
+    def note(self, key: str, message: str, *values, warning: bool = False) -> None:
+        """
+        Args:
+            message: `str.format` の書式. 同じ key では同じものを渡す
+            values: 書式に埋める値. 整形せずに保存する
+        """
+        n = self.counters.get(key, 0)
+        self.counters[key] = n + 1
+        if n == 0:
+            self.messages[key] = (message, warning)
+            self.samples[key] = []
+        if n < self.max_samples:
+            self.samples[key].append(values)
+        if self.verbosity >= VERBOSE:
+            print(("WARNING: " if warning else "") + message.format(*values))
+
+    def state(self) -> tuple:
+        """
+        `merge` に渡すための記録. ワーカープロセスから親プロセスに送る
+        """
+        return (self.counters, self.messages, self.samples)
+
+    def merge(self, state: tuple) -> None:
+        """
+        別の RunReport の `state` を加える. 例は上限まで, 渡された順に足す
+        """
+        counters, messages, samples = state
+        for key, n in counters.items():
+            self.counters[key] = self.counters.get(key, 0) + n
+            if key in messages:
+                self.messages.setdefault(key, messages[key])
+                kept = self.samples.setdefault(key, [])
+                kept += samples[key][: max(self.max_samples - len(kept), 0)]
+
+    def formatted_samples(self, key: str) -> List[str]:
+        message, _ = self.messages[key]
+        return [message.format(*values) for values in self.samples[key]]
+
+    def to_dict(self, script: str) -> dict:
+        return dict(
+            script=script,
+            created=datetime.now().isoformat(timespec="seconds"),
+            counters={k: v for k, v in self.counters.items() if k not in self.messages},
+            notes={
+                key: dict(
+                    level="warning" if warning else "info",
+                    count=self.counters[key],
+                    samples=self.formatted_samples(key),
+                )
+                for key, (_, warning) in self.messages.items()
+            },
+        )
+
+    def summary(self) -> List[str]:
+        """
+        QUIET なら警告の件数だけ, それ以外は警告の例とその他の件数も並べる.
+        `entries.Item.name` のような内訳は VERBOSE でなければ `entries` にまとめる
+        """
+        lines = []
+        warnings_keys = [k for k, (_, warning) in self.messages.items() if warning]
+        for key in warnings_keys:
+            lines += [f"WARNING {key}: {self.counters[key]} times"]
+            if self.verbosity >= NORMAL:
+                lines += [f"    {x}" for x in self.formatted_samples(key)]
+                if self.counters[key] > len(self.samples[key]):
+                    lines += ["    ..."]
+        if self.verbosity >= NORMAL:
+            groups: Dict[str, List[int]] = dict()
+            for key, n in self.counters.items():
+                if key in warnings_keys:
+                    continue
+                if key in self.messages:
+                    lines += [f"{key}: {n} (e.g. {self.formatted_samples(key)[0]})"]
+                elif "." in key and self.verbosity < VERBOSE:
+                    groups.setdefault(key.split(".")[0], []).append(n)
+                else:
+                    lines += [f"{key}: {n}"]
+            for group, ns in groups.items():
+                lines += [f"{group}: {sum(ns)} in {len(ns)} kinds"]
+        return lines
+
+    def finish(self, args: argparse.Namespace, script: str) -> None:
+        """
+        要約を表示し, `--report` があれば JSON に書き出す
+        """
+        lines = self.summary()
+        if len(lines) > 0:
+            print("---- run report ----")
+            for line in lines:
+                print(line)
+        fpath = getattr(args, "report", None)
+        if fpath is None:
+            return
+        if fpath == Path(""):
+            fpath = Path(
+                f"""{script}-report-{datetime.now().strftime("%Y-%m-%dT%H%M%S")}.json"""
+            )
+        if not fpath.parent.exists():
+            fpath.parent.mkdir(parents=True)
+        with fpath.open("w", encoding="utf-8") as f:
+            json.dump(self.to_dict(script), f, ensure_ascii=False, indent=2)
+        print(f"REPORT: {fpath}")
+
+
+# 各モジュールはこれに記録する. スクリプトの開始時に `configure_report` で設定する
+report = RunReport()
+
+
+def configure_report(args: argparse.Namespace) -> RunReport:
+    """
+    `--quiet`, `--verbose` から表示の詳しさを決め, 記録を空にする
+    """
+    if getattr(args, "quiet", None):
+        verbosity = QUIET
+    elif getattr(args, "verbose", None):
+        verbosity = VERBOSE
+    else:
+        verbosity = NORMAL
+    report.reset(verbosity=verbosity)
+    return report
@@ -0,0 +1,437 @@
+#! /usr/bin/env python3
+# encoding: utf-8
+import argparse
+import json
+import os
+import random
+from html import escape
+from pathlib import Path
+from typing import Dict, List, Optional, Set, Tuple
+
+from functions import COMPILED_FILTERS, compiled_filter, merge_yml, write_po_columns
+
+SYNTHETIC_VERSION = 1
+ALNUM = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz"
+WORDS = (
+    "the of and to a in is you that it for on with as his they be at one have this "
+    "from by hot word but what some we can out other were all there when up use your "
+    "how said an each she which do their time if will way about many then them write "
+    "would like so these her long make thing see him two has look more day could go "
+    "come did number sound no most people my over know water than call first who may "
+    "down side been now find lord clan kingdom town village caravan siege army party "
+    "sword shield horse bow arrow gold denar battle prisoner ransom fief vassal"
+).split()
+PLACEHOLDERS = [
+    "{PLAYER.NAME}",
+    "{SETTLEMENT}",
+    "{?PLAYER.GENDER}lady{?}lord{\\?}",
+    "{GOLD_ICON}",
+    "{.link}",
+    "{NUMBER}",
+]
+KANA = "あいうえおかきくけこさしすせそたちつてとなにぬねのはひふへほまみむめもやゆよらりるれろわをん"
+
+parser = argparse.ArgumentParser()
+parser.add_argument("output", type=Path, help="folder to generate the fake install")
+parser.add_argument(
+    "--size",
+    type=int,
+    default=10000,
+    help="number of vanilla strings. the mod has the same number of entries. Default: 10000",
+)
+parser.add_argument("--mod-size", type=int, default=None)
+parser.add_argument(
+    "--modules", nargs="*", default=None, help="Default: Native SandBox"
+)
+parser.add_argument("--mod-name", type=str, default="SyntheticMod")
+parser.add_argument("--strings-per-file", type=int, default=2000)
+parser.add_argument("--game-version", type=str, default="v1.2.12")
+parser.add_argument("--seed", type=int, default=0)
+parser.add_argument("--langshort", type=str, default=None)
+parser.add_argument("--langid", type=str, default=None)
+parser.add_argument("--langsuffix", type=str, default="jpn")
+
+
+class SyntheticText:
+    """
+    種を固定した乱数で ID, 英語の原文, 翻訳を作る
+    """
+
+    def __init__(self, seed: int):
+        self.rng = random.Random(seed)
+        self.used_ids: Set[str] = set()
+
+    def new_id(self, k: int = 6) -> str:
+        while True:
+            id = "".join(self.rng.choices(ALNUM, k=k))
+            if id not in self.used_ids:
+                self.used_ids.add(id)
+                return id
+
+    def english(self) -> str:
+        words = self.rng.choices(WORDS, k=self.rng.randint(1, 24))
+        if self.rng.random() < 0.2:
+            words.insert(
+                self.rng.randrange(len(words) + 1), self.rng.choice(PLACEHOLDERS)
+            )
+        text = " ".join(words)
+        if self.rng.random() < 0.03:
+            text += "\n" + " ".join(self.rng.choices(WORDS, k=5))
+        if self.rng.random() < 0.03:
+            text = f'"{text}" & {self.rng.choice(WORDS)}'
+        return text[0].upper() + text[1:]
+
+    def translation(self, english: str) -> str:
+        # プレースホルダは訳にも残す
+        kept = [x for x in PLACEHOLDERS if x in english]
+        body = "".join(self.rng.choices(KANA, k=max(1, len(english) // 3)))
+        return "".join(kept) + body
+
+    def modified(self, english: str) -> str:
+        return english + " " + self.rng.choice(WORDS)
+
+
+def xml_header() -> List[str]:
+    return ['<?xml version="1.0" encoding="utf-8"?>']
+
+
+def language_xml(language: str, strings: List[Tuple[str, str]]) -> str:
+    lines = xml_header() + [
+        '<base xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" type="string">',
+        "  <tags>",
+        f'    <tag language="{escape(language)}" />',
+        "  </tags>",
+        "  <strings>",
+    ]
+    lines += [
+        f'    <string id="{escape(id)}" text="{escape_attr(text)}" />'
+        for id, text in strings
+    ]
+    lines += ["  </strings>", "</base>", ""]
+    return "\n".join(lines)
+
+
+def language_data_xml(langid: str, xml_paths: List[str]) -> str:
+    lines = xml_header() + [f'<LanguageData id="{escape(langid)}">']
+    lines += [f'  <LanguageFile xml_path="{escape(x)}" />' for x in xml_paths]
+    lines += ["</LanguageData>", ""]
+    return "\n".join(lines)
+
+
+def escape_attr(text: str) -> str:
+    return escape(text).replace("\n", "&#xA;")
+
+
+def split_chunks(n: int, size: int) -> List[int]:
+    return [min(size, n - i) for i in range(0, n, max(size, 1))]
+
+
+def link_lowercase_languages(module_data_dir: Path) -> None:
+    """
+    書き出しスクリプトは `languages` (小文字) を読むので, 大文字小文字を区別するファイルシステムではリンクを張る
+    """
+    lower = module_data_dir.joinpath("languages")
+    if not lower.exists():
+        try:
+            os.symlink("Languages", lower, target_is_directory=True)
+        except OSError:
+            pass
+
+
+def generate_vanilla_modules(
+    root: Path, args: argparse.Namespace, text: SyntheticText
+) -> List[Dict[str, str]]:
+    """
+    Modules/<module>/ModuleData/Languages 以下に英語と翻訳先の言語ファイルを作る
+    Returns: 作った文字列. バニラの翻訳ファイルを作るのに使う
+    """
+    entries = []
+    n_modules = len(args.modules)
+    for i_module, module in enumerate(args.modules):
+        n = args.size // n_modules + (1 if i_module < args.size % n_modules else 0)
+        module_data_dir = root.joinpath(f"Modules/{module}/ModuleData")
+        lang_dir = module_data_dir.joinpath(f"Languages/{args.langshort}")
+        lang_dir.mkdir(parents=True, exist_ok=True)
+        link_lowercase_languages(module_data_dir)
+        xml_paths = []
+        for i_file, n_file in enumerate(split_chunks(n, args.strings_per_file)):
+            file = f"std_{module.lower()}_{i_file}_xml.xml"
+            file_translated = file.replace(".xml", f"_{args.langsuffix}.xml")
+            strings_en, strings_translated = [], []
+            for _ in range(n_file):
+                id = text.new_id()
+                english = text.english()
+                strings_en += [(id, english)]
+                translated = None
+                if text.rng.random() < 0.9:
+                    translated = text.translation(english)
+                    strings_translated += [(id, translated)]
+                entries += [
+                    dict(
+                        id=id,
+                        text_EN=english,
+                        text=translated,
+                        module=module,
+                        file=file,
+                    )
+                ]
+            module_data_dir.joinpath(f"Languages/{file}").write_text(
+                language_xml("English", strings_en), encoding="utf-8"
+            )
+            lang_dir.joinpath(file_translated).write_text(
+                language_xml(args.langid, strings_translated), encoding="utf-8"
+            )
+            xml_paths += [f"{args.langshort}/{file_translated}"]
+        lang_dir.joinpath("language_data.xml").write_text(
+            language_data_xml(args.langid, xml_paths), encoding="utf-8"
+        )
+    fp_submodule = root.joinpath("Modules/Native/SubModule.xml")
+    fp_submodule.parent.mkdir(parents=True, exist_ok=True)
+    fp_submodule.write_text(
+        "\n".join(
+            xml_header()
+            + [
+                "<Module>",
+                '  <Name value="Native" />',
+                '  <Id value="Native" />',
+                f'  <Version value="{escape(args.game_version)}" />',
+                "</Module>",
+                "",
+            ]
+        ),
+        encoding="utf-8",
+    )
+    return entries
+
+
+def mod_text(
+    text: SyntheticText, vanilla: List[Dict[str, str]]
+) -> Tuple[Optional[str], str]:
+    """
+    Mod の XML に書かれる `{=ID}原文`. ID がない, `!` の, バニラの ID を流用したものも混ぜる
+    Returns: ID と原文
+    """
+    p = text.rng.random()
+    if p < 0.05 and len(vanilla) > 0:
+        entry = text.rng.choice(vanilla)
+        if text.rng.random() < 0.5:
+            return (entry["id"], entry["text_EN"])
+        return (entry["id"], text.modified(entry["text_EN"]))
+    english = text.english()
+    if p < 0.75:
+        return (text.new_id(8), english)
+    if p < 0.85:
+        return ("!", english)
+    return (None, english)
+
+
+def with_id_prefix(id: Optional[str], english: str) -> str:
+    return english if id is None else f"{{={id}}}{english}"
+
+
+def filter_element(f: compiled_filter, object_id: str, value: str, indent: str) -> str:
+    attrs = {a: object_id if a == "id" else "placeholder" for a in f["attrs"]}
+    if "id" not in attrs and f["ancestor"] is None:
+        attrs["id"] = object_id
+    attrs[f["params"]["key"]] = value
+    return (
+        f"{indent}<{f['tag']} "
+        + " ".join([f'{k}="{escape_attr(v)}"' for k, v in attrs.items()])
+        + " />"
+    )
+
+
+def generate_mod(
+    root: Path,
+    args: argparse.Namespace,
+    text: SyntheticText,
+    vanilla: List[Dict[str, str]],
+) -> List[Dict[str, str]]:
+    """
+    FILTERS のスキーマをすべて含む Mod を Modules/<mod-name>/ModuleData に作る.
+    XML のほか XSLT と, 英語と翻訳先の言語ファイルも作る
+    Returns: ID が明示された文字列. Mod の翻訳ファイルを作るのに使う
+    """
+    module_data_dir = root.joinpath(f"Modules/{args.mod_name}/ModuleData")
+    lang_dir = module_data_dir.joinpath(f"Languages/{args.langshort}")
+    lang_dir.mkdir(parents=True, exist_ok=True)
+    n_xslt = max(1, args.mod_size // 100)
+    shares = split_chunks(
+        args.mod_size - n_xslt,
+        -(-(args.mod_size - n_xslt) // (len(COMPILED_FILTERS) + 1)),
+    )
+    entries = []
+    strings_translated = []
+
+    def add_entry(id: Optional[str], english: str, context: str, file: str):
+        if id is None or id == "!":
+            return
+        entries.append(dict(id=id, text_EN=english, context=context, file=file))
+        if text.rng.random() < 0.5:
+            strings_translated.append((id, text.translation(english)))
+
+    for i, f in enumerate(COMPILED_FILTERS):
+        n = shares[i] if i < len(shares) else 0
+        file = f"{f['params']['context'].replace('.', '_')}.xml"
+        root_tag = f["params"]["xml_name_id"] or "Objects"
+        lines = xml_header() + [f"<{root_tag}>"]
+        indent = "  "
+        if f["ancestor"] is not None:
+            lines += [f"  <{f['ancestor']}>"]
+            indent = "    "
+        for _ in range(n):
+            id, english = mod_text(text, vanilla)
+            lines += [
+                filter_element(
+                    f, f"obj_{text.new_id(8)}", with_id_prefix(id, english), indent
+                )
+            ]
+            add_entry(id, english, f["params"]["context"], file)
+        if f["ancestor"] is not None:
+            lines += [f"  </{f['ancestor']}>"]
+        lines += [f"</{root_tag}>", ""]
+        module_data_dir.joinpath(file).write_text("\n".join(lines), encoding="utf-8")
+    # XSLT によるバニラの上書き
+    lines = xml_header() + [
+        '<xsl:stylesheet version="1.0" xmlns:xsl="http://www.w3.org/1999/XSL/Transform">',
+        '  <xsl:output omit-xml-declaration="yes" />',
+        '  <xsl:template match="@*|node()">',
+        '    <xsl:copy><xsl:apply-templates select="@*|node()" /></xsl:copy>',
+        "  </xsl:template>",
+    ]
+    xslt_filters = [f for f in COMPILED_FILTERS if f["params"]["xml_name_id"] != ""]
+    for i in range(n_xslt):
+        f = xslt_filters[i % len(xslt_filters)]
+        id, english = mod_text(text, vanilla)
+        lines += [
+            f"""  <xsl:template match="{f['xslt_class']}[@id='obj_{text.new_id(8)}']/@{f['params']['key']}">""",
+            f"""    <xsl:attribute name="{f['params']['key']}">{escape(with_id_prefix(id, english), quote=False)}</xsl:attribute>""",
+            "  </xsl:template>",
+        ]
+        add_entry(id, english, f["params"]["context"], "patches.xslt")
+    lines += ["</xsl:stylesheet>", ""]
+    module_data_dir.joinpath("patches.xslt").write_text(
+        "\n".join(lines), encoding="utf-8"
+    )
+    # 言語ファイル
+    strings_en = []
+    file = f"std_{args.mod_name.lower()}.xml"
+    for _ in range(shares[-1] if len(shares) > len(COMPILED_FILTERS) else 0):
+        id = text.new_id(8)
+        english = text.english()
+        strings_en += [(id, english)]
+        add_entry(id, english, "language.text", f"Languages/{file}")
+    module_data_dir.joinpath(f"Languages/{file}").write_text(
+        language_xml("English", strings_en), encoding="utf-8"
+    )
+    file_translated = file.replace(".xml", f"_{args.langsuffix}.xml")
+    lang_dir.joinpath(file_translated).write_text(
+        language_xml(args.langid, strings_translated), encoding="utf-8"
+    )
+    lang_dir.joinpath("language_data.xml").write_text(
+        language_data_xml(args.langid, [f"{args.langshort}/{file_translated}"]),
+        encoding="utf-8",
+    )
+    return entries
+
+
+def write_vanilla_po(
+    fpath: Path, entries: List[Dict[str, str]], text: SyntheticText, older: bool
+) -> int:
+    """
+    read_vanilla_XML.py の出力と同じ形式の翻訳ファイルを書く.
+    older なら一部の原文が変わり, 一部の項目がない古い版にする
+    """
+    columns = dict(msgid=[], msgstr=[], msgctxt=[], flags=[], occurrences=[])
+    for entry in entries:
+        english = entry["text_EN"]
+        translated = entry["text"] or ""
+        if older:
+            p = text.rng.random()
+            if p < 0.03:
+                continue
+            if p < 0.07:
+                english = text.modified(english)
+            if text.rng.random() < 0.1:
+                translated = text.translation(english)
+        location = f"{entry['module']}/{entry['file']}"
+        columns["msgid"] += [f"{entry['id']}/{english}"]
+        columns["msgstr"] += [translated]
+        columns["msgctxt"] += [location]
+        columns["flags"] += [["fuzzy"] if text.rng.random() < 0.3 else []]
+        columns["occurrences"] += [[(location, 0)]]
+    return write_po_columns(columns, fpath)
+
+
+def write_mod_po(
+    fpath: Path, entries: List[Dict[str, str]], text: SyntheticText
+) -> int:
+    """
+    import_mod_language_XML.py の出力と同じ形式の, Mod の以前の翻訳ファイルを書く
+    """
+    columns = dict(msgid=[], msgstr=[], flags=[], occurrences=[], msgctxt=[])
+    for entry in entries:
+        if text.rng.random() < 0.3:
+            continue
+        columns["msgid"] += [f"{entry['id']}/{entry['text_EN']}"]
+        columns["msgstr"] += [text.translation(entry["text_EN"])]
+        columns["flags"] += [["fuzzy"]]
+        columns["occurrences"] += [[(entry["file"], 0)]]
+        columns["msgctxt"] += [entry["context"]]
+    return write_po_columns(columns, fpath)
+
+
+def generate_install(args: argparse.Namespace) -> dict:
+    """
+    ゲームのインストールフォルダを模したフォルダを作る. 同じ引数なら同じ内容になる.
+    text/ 以下にはバニラの翻訳ファイル, その古い版, Mod の以前の翻訳ファイルを置く
+    Returns: 作ったファイルの概要. `synthetic.json` にも書き出す
+    """
+    root: Path = args.output
+    if args.mod_size is None:
+        args.mod_size = args.size
+    if args.modules is None:
+        args.modules = ["Native", "SandBox"]
+    text = SyntheticText(args.seed)
+    print(f"generating {args.size} vanilla strings in {root}")
+    vanilla = generate_vanilla_modules(root, args, text)
+    print(f"generating {args.mod_size} entries of {args.mod_name}")
+    mod = generate_mod(root, args, text, vanilla)
+    root.joinpath("text").mkdir(parents=True, exist_ok=True)
+    fp_po = root.joinpath(f"text/MB2BL-{args.langshort}.po")
+    fp_po_old = root.joinpath(f"text/MB2BL-{args.langshort}-old.po")
+    fp_po_mod = root.joinpath(f"text/{args.mod_name}.po")
+    summary = dict(
+        version=SYNTHETIC_VERSION,
+        size=args.size,
+        mod_size=args.mod_size,
+        seed=args.seed,
+        modules=args.modules,
+        mod_name=args.mod_name,
+        strings_per_file=args.strings_per_file,
+        game_version=args.game_version,
+        langshort=args.langshort,
+        langid=args.langid,
+        langsuffix=args.langsuffix,
+        n_po=write_vanilla_po(fp_po, vanilla, text, older=False),
+        n_po_old=write_vanilla_po(fp_po_old, vanilla, text, older=True),
+        n_po_mod=write_mod_po(fp_po_mod, mod, text),
+    )
+    with root.joinpath("synthetic.json").open("w", encoding="utf-8") as f:
+        json.dump(summary, f, ensure_ascii=False, indent=2)
+    print(
+        f"WRITE AT: {fp_po} ({summary['n_po']} entries), {fp_po_old} ({summary['n_po_old']} entries), {fp_po_mod} ({summary['n_po_mod']} entries)"
+    )
+    return summary
+
+
+def main():
+    args = parser.parse_args()
+    fp = Path(__file__).parent.joinpath("default.yml")
+    if fp.exists():
+        args = merge_yml(fp, args, parser.parse_args([args.output.as_posix()]))
+    generate_install(args)
+
+
+if __name__ == "__main__":
+    main()
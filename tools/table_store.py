@@ -0,0 +1,66 @@
+#! /usr/bin/env python3
+# encoding: utf-8
+import os
+from pathlib import Path
+
+import pandas as pd
+import pyarrow as pa
+from xml_writer import temporary_path
+
+TABLE_SUFFIX = ".parquet"
+
+
+def table_path(fpath: Path) -> Path:
+    """
+    表の保存先. `.xlsx` などを渡しても拡張子は `.parquet` にする
+    """
+    return fpath.with_suffix(TABLE_SUFFIX)
+
+
+def arrow_compatible(d: pd.DataFrame) -> pd.DataFrame:
+    """
+    タプルの入った列など Arrow の型にできない列だけを文字列にする
+    """
+    columns = dict()
+    for c in d.columns:
+        if d[c].dtype != object:
+            continue
+        try:
+            pa.array(d[c], from_pandas=True)
+        except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError):
+            columns[c] = d[c].astype(str)
+    return d.assign(**columns) if len(columns) > 0 else d
+
+
+def write_table(d: pd.DataFrame, fpath: Path, xlsx: bool = False) -> Path:
+    """
+    中間の表を Parquet で書き出す. `xlsx` なら人が読むための Excel も同じ名前で書き出す
+    Returns: Parquet のパス
+    """
+    fp = table_path(fpath)
+    if not fp.parent.exists():
+        fp.parent.mkdir(parents=True)
+    # 同じ表を同時に書くプロセスやスレッドがあっても一時ファイルが重ならないようにする
+    fp_tmp = temporary_path(fp)
+    try:
+        arrow_compatible(d).to_parquet(fp_tmp, index=False)
+        os.replace(fp_tmp, fp)
+    except BaseException:
+        fp_tmp.unlink(missing_ok=True)
+        raise
+    if xlsx:
+        d.to_excel(fp.with_suffix(".xlsx"), index=False)
+    return fp
+
+
+def read_table(fpath: Path) -> pd.DataFrame:
+    """
+    Parquet の表を読む. なければ以前の形式の Excel を読む
+    """
+    fp = table_path(fpath)
+    if fp.exists():
+        return pd.read_parquet(fp)
+    fp_xlsx = fp.with_suffix(".xlsx")
+    if fp_xlsx.exists():
+        return pd.read_excel(fp_xlsx)
+    raise FileNotFoundError(f"{fp} not found")
@@ -0,0 +1,255 @@
+#! /usr/bin/env python3
+# encoding: utf-8
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+import pandas as pd
+import polib
+from functions import entries_with_source
+from run_report import report
+
+# 用語集. 列は "category","changed","text","text_wrong","text_EN","注記"
+TERMINOLOGY_FILES = [
+    Path(__file__).parent.parent.joinpath("AI/terminologies/vanilla.csv"),
+    Path(__file__).parent.parent.joinpath("comparison.csv"),
+]
+REPORT_COLUMNS = ["msgctxt", "msgid", "kind", "text_EN", "text", "found"]
+
+
+class AhoCorasick:
+    """
+    複数の文字列を1回の走査で探すオートマトン
+    """
+
+    def __init__(self, patterns: Iterable[str]):
+        self.patterns: List[str] = []
+        self.goto: List[Dict[str, int]] = [dict()]
+        # 各状態で見つかるパターンの番号. 失敗遷移の先で見つかるものも含む
+        self.out: List[Tuple[int, ...]] = [()]
+        for pattern in patterns:
+            self.add(pattern)
+        self.build()
+
+    def add(self, pattern: str) -> None:
+        if pattern == "":
+            return
+        state = 0
+        for c in pattern:
+            nxt = self.goto[state].get(c)
+            if nxt is None:
+                nxt = len(self.goto)
+                self.goto[state][c] = nxt
+                self.goto.append(dict())
+                self.out.append(())
+            state = nxt
+        self.out[state] += (len(self.patterns),)
+        self.patterns.append(pattern)
+
+    def build(self) -> None:
+        """
+        幅優先で失敗遷移を求める
+        """
+        self.fail = [0] * len(self.goto)
+        queue = list(self.goto[0].values())
+        for state in queue:
+            for c, nxt in self.goto[state].items():
+                queue.append(nxt)
+                f = self.fail[state]
+                while f > 0 and c not in self.goto[f]:
+                    f = self.fail[f]
+                self.fail[nxt] = self.goto[f].get(c, 0)
+                self.out[nxt] += self.out[self.fail[nxt]]
+
+    def finditer(self, text: str) -> Iterator[Tuple[int, int, int]]:
+        """
+        重なりも含めてすべての出現を返す
+        Returns: (開始位置, 終了位置, パターンの番号)
+        """
+        goto, fail, out, patterns = self.goto, self.fail, self.out, self.patterns
+        state = 0
+        for i, c in enumerate(text):
+            while state > 0 and c not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(c, 0)
+            for k in out[state]:
+                yield (i + 1 - len(patterns[k]), i + 1, k)
+
+
+def outermost(matches: Iterable[Tuple[int, int, int]]) -> List[Tuple[int, int, int]]:
+    """
+    他の出現に含まれる出現を除く. "Vlandian Banner Knight" の中の "Banner Knight" など
+    """
+    kept = []
+    max_end = -1
+    for start, end, k in sorted(matches, key=lambda x: (x[0], -x[1])):
+        if end <= max_end:
+            continue
+        kept.append((start, end, k))
+        max_end = end
+    return kept
+
+
+def is_word_boundary(text: str, start: int, end: int) -> bool:
+    return (start == 0 or not text[start - 1].isalnum()) and (
+        end == len(text) or not text[end].isalnum()
+    )
+
+
+def read_terminology(fpaths: Iterable[Path]) -> pd.DataFrame:
+    """
+    用語集の CSV をまとめて読む. 重複する行は1つにする
+    """
+    d = pd.concat(
+        [pd.read_csv(fp, dtype=str, keep_default_na=False) for fp in fpaths],
+        ignore_index=True,
+    )
+    d = d[["text_EN", "text", "text_wrong"]].apply(lambda x: x.str.strip())
+    return d.loc[lambda d: d["text_EN"] != ""].drop_duplicates()
+
+
+class TerminologyScanner:
+    """
+    原文に用語があるのに訳に正しい訳語がない項目と, 誤った訳語を使った項目を探す.
+    英語の用語と日本語の訳語 (正誤とも) をそれぞれ1つのオートマトンにまとめ, 原文と訳を1回ずつ走査する.
+    誤った訳語には一般的な語 (山賊, 軍馬など) も多いので, 対応する英語の用語が原文にある項目だけで調べる
+    """
+
+    def __init__(self, terms: pd.DataFrame):
+        self.terms_en: List[str] = []
+        self.expected: List[Set[str]] = []
+        self.wrong: List[Set[str]] = []
+        index: Dict[str, int] = dict()
+        for en, ja, ja_wrong in terms[["text_EN", "text", "text_wrong"]].itertuples(
+            index=False
+        ):
+            if en not in index:
+                index[en] = len(self.terms_en)
+                self.terms_en.append(en)
+                self.expected.append(set())
+                self.wrong.append(set())
+            i = index[en]
+            if ja != "":
+                self.expected[i].add(ja)
+            if ja_wrong != "" and ja_wrong != ja:
+                self.wrong[i].add(ja_wrong)
+        for i in range(len(self.terms_en)):
+            # 正しい訳語と同じ誤訳は (別の行で正しいとされていれば) 誤りとしない
+            self.wrong[i] -= self.expected[i]
+        # 小文字で始まる用語 (perk など) は文頭の大文字も探す
+        variants = [(en, i) for en, i in index.items()] + [
+            (en[0].upper() + en[1:], i)
+            for en, i in index.items()
+            if en[0].islower() and en[0].upper() + en[1:] not in index
+        ]
+        self.en_term_ids = [i for _, i in variants]
+        self.en = AhoCorasick([en for en, _ in variants])
+        ja_terms = sorted(set().union(*self.expected, *self.wrong))
+        self.ja = AhoCorasick(ja_terms)
+        correct = set().union(*self.expected)
+        self.ja_is_correct = [x in correct for x in ja_terms]
+
+    def source_terms(self, source: str) -> List[int]:
+        matches = [
+            (start, end, self.en_term_ids[k])
+            for start, end, k in self.en.finditer(source)
+            if is_word_boundary(source, start, end)
+        ]
+        return sorted({k for _, _, k in outermost(matches)})
+
+    def scan(self, source: str, translation: str) -> List[Tuple[str, str, str, str]]:
+        """
+        Returns: (種類, 英語の用語, 正しい訳語, 見つかった誤訳) のリスト. 種類は "missing" か "wrong"
+        """
+        if translation == "":
+            return []
+        term_ids = self.source_terms(source)
+        if len(term_ids) == 0:
+            return []
+        matches = list(self.ja.finditer(translation))
+        spans_correct = [(s, e) for s, e, k in matches if self.ja_is_correct[k]]
+        found_correct = {
+            self.ja.patterns[k] for _, _, k in matches if self.ja_is_correct[k]
+        }
+        # 正しい訳語の一部として現れたもの (『アンバサダー』の中のアンバサダーなど) は誤訳としない
+        found_wrong = {
+            self.ja.patterns[k]
+            for s, e, k in matches
+            if not self.ja_is_correct[k]
+            and not any(s0 <= s and e <= e0 for s0, e0 in spans_correct)
+        }
+        issues = []
+        for i in term_ids:
+            expected = " / ".join(sorted(self.expected[i]))
+            if len(self.expected[i]) > 0 and self.expected[i].isdisjoint(found_correct):
+                issues.append(("missing", self.terms_en[i], expected, ""))
+            for x in sorted(self.wrong[i] & found_wrong):
+                issues.append(("wrong", self.terms_en[i], expected, x))
+        return issues
+
+
+def scan_catalog(
+    pof: polib.POFile, scanner: TerminologyScanner, include_fuzzy: bool = True
+) -> pd.DataFrame:
+    """
+    カタログの訳のある項目を調べる. msgid は `<ID>/<原文>`
+    Returns: REPORT_COLUMNS の表
+    """
+    rows = []
+    for entry, source in entries_with_source(pof):
+        if not include_fuzzy and "fuzzy" in entry.flags:
+            continue
+        for kind, en, expected, found in scanner.scan(source, entry.msgstr):
+            rows.append((entry.msgctxt, entry.msgid, kind, en, expected, found))
+            if kind == "missing":
+                report.note(
+                    "terminology.missing",
+                    "{}: {} should be {}",
+                    entry.msgid,
+                    en,
+                    expected,
+                    warning=True,
+                )
+            else:
+                report.note(
+                    "terminology.wrong",
+                    "{}: {} is translated as {} instead of {}",
+                    entry.msgid,
+                    en,
+                    found,
+                    expected,
+                    warning=True,
+                )
+    return pd.DataFrame(rows, columns=REPORT_COLUMNS)
+
+
+def open_terminology_scanner(
+    fpaths: Optional[Iterable[Path]] = None,
+) -> TerminologyScanner:
+    return TerminologyScanner(
+        read_terminology(TERMINOLOGY_FILES if fpaths is None else fpaths)
+    )
+
+
+def check_terminology(
+    catalog: Path,
+    output: Optional[Path] = None,
+    term_files: Optional[Iterable[Path]] = None,
+    include_fuzzy: bool = True,
+) -> pd.DataFrame:
+    """
+    カタログ (.po か .mo) を用語集と照合し, `output` があれば結果を CSV に書き出す
+    """
+    if catalog.suffix == ".mo":
+        pof = polib.mofile(catalog, encoding="utf-8")
+    else:
+        pof = polib.pofile(catalog, encoding="utf-8")
+    d = scan_catalog(pof, open_terminology_scanner(term_files), include_fuzzy)
+    print(
+        f"""terminology: {(d["kind"] == "missing").sum()} missing and {(d["kind"] == "wrong").sum()} wrong terms in {d["msgid"].nunique()} entries"""
+    )
+    if output is not None:
+        if not output.parent.exists():
+            output.parent.mkdir(parents=True)
+        d.to_csv(output, index=False)
+        print(f"saved to {output}")
+    return d
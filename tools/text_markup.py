@@ -0,0 +1,234 @@
+#! /usr/bin/env python3
+# encoding: utf-8
+import re
+from pathlib import Path
+from typing import Optional, Set
+
+import lxml.etree as ET
+import pandas as pd
+import polib
+from functions import entries_with_source
+from run_report import report
+
+# 言語ごとの関数の定義. `{PLURAL({ITEM})}` のように呼ぶ
+FUNCTIONS_FILE = Path(__file__).parent.parent.joinpath("Modules/jp_functions.xml")
+REPORT_COLUMNS = [
+    "msgctxt",
+    "msgid",
+    "issue",
+    "token",
+    "n_source",
+    "n_translation",
+]
+
+# 原文と訳の文字列の制御記号の文法. 上から順に試す
+MARKUP = re.compile(
+    r"""(?P<id>\{=[^{}]*\})"""
+    r"""|(?P<endif>\{\\\?\})"""
+    r"""|(?P<else>\{\?\}|\{:\})"""
+    r"""|(?P<elif>\{:\?[^{}]+\})"""
+    r"""|(?P<if>\{\?[^{}]+\})"""
+    r"""|(?P<call>\{(?P<function>[A-Za-z_]\w*)\((?:[^{}()]|\{[^{}]*\})*\)\})"""
+    r"""|(?P<var>\{[^{}]*\})"""
+    r"""|(?P<facial>\[(?:ib|if):[^\]]*\])"""
+    r"""|(?P<broken>[{}])"""
+)
+TOKEN_KINDS = ["id", "endif", "else", "elif", "if", "call", "var", "facial", "broken"]
+# 原文と訳で数が同じであるべきもの
+COMPARED = {
+    "id": "id",
+    "var": "variable",
+    "if": "control",
+    "elif": "control",
+    "else": "control",
+    "endif": "control",
+    "facial": "facial",
+}
+match_leading_id = re.compile(r"^\{=[^{}]*\}")
+match_argument_var = re.compile(r"(\{[^{}]*\})")
+
+
+def read_function_names(fpath: Path = FUNCTIONS_FILE) -> Set[str]:
+    """
+    `<function functionName=...>` の名前
+    """
+    return {
+        x.attrib["functionName"]
+        for x in ET.parse(fpath).iterfind(".//function")
+        if "functionName" in x.attrib
+    }
+
+
+def tokenize(texts: pd.Series) -> pd.DataFrame:
+    """
+    各文字列の制御記号を出現順に取り出す. 先頭の `{=ID}` は除く.
+    関数の引数の中の変数は, 関数呼び出しの後に変数としても加える
+    Returns: `texts` の索引 (`entry`) と出現順 (`match`) の MultiIndex で, `kind`, `token`, `function` 列を持つ表
+    """
+    found = texts.str.replace(match_leading_id, "", regex=True).str.extractall(MARKUP)
+    if found.shape[0] == 0:
+        return pd.DataFrame(
+            columns=["kind", "token", "function"],
+            index=pd.MultiIndex.from_arrays([[], []], names=["entry", "match"]),
+        )
+    kinds = found[TOKEN_KINDS]
+    # 各行で一致した種類はちょうど1つ
+    tokens = pd.DataFrame(
+        {
+            "kind": kinds.notna().idxmax(axis=1),
+            "token": kinds.bfill(axis=1).iloc[:, 0],
+            "function": found["function"],
+        }
+    ).rename_axis(["entry", "match"])
+    calls = tokens.loc[tokens["kind"] == "call", "token"]
+    if calls.shape[0] == 0:
+        return tokens
+    # 外側の括弧を除いて, 引数の中の `{...}` を探す
+    args = calls.str.slice(1, -1).str.extractall(match_argument_var)
+    # 呼び出しと同じ位置に置く. 変数の順番は調べないので位置が重なってもよい
+    args = pd.DataFrame(
+        {"kind": "var", "token": args[0].to_numpy(), "function": None},
+        index=args.index.droplevel(-1),
+    )
+    return pd.concat([tokens, args]).sort_index()
+
+
+def conditional_issues(tokens: pd.DataFrame) -> pd.DataFrame:
+    """
+    `{?X}` と `{\\?}` の対応が取れていない, あるいは条件の外に `{:}` などがある文字列
+    """
+    ctrl = tokens.loc[tokens["kind"].isin(["if", "elif", "else", "endif"])]
+    delta = ctrl["kind"].map({"if": 1, "endif": -1}).fillna(0).astype(int)
+    depth = delta.groupby(level="entry").cumsum()
+    # else や elif の直前の深さは, 自身の増減が0なので自身の位置の深さと同じ
+    outside = (depth < 0) | (ctrl["kind"].isin(["elif", "else"]) & (depth == 0))
+    bad = outside.groupby(level="entry").any() | (
+        depth.groupby(level="entry").last() != 0
+    )
+    return pd.DataFrame(
+        {"issue": "unbalanced", "token": "", "n_source": 0, "n_translation": 0},
+        index=bad.index[bad.to_numpy()],
+    )
+
+
+def validate_markup(
+    d: pd.DataFrame,
+    functions: Set[str],
+    source: str = "text_EN",
+    target: str = "text",
+) -> pd.DataFrame:
+    """
+    原文と訳の変数, 条件分岐, 表情タグ, `{=ID}` の数を比べ, 訳の条件分岐の対応と関数名を調べる.
+    原文にもある関数は組み込みとみなす. 訳が空の行は調べない
+    Returns: `d` の索引を `entry` とした `issue`, `token`, `n_source`, `n_translation` の表
+    """
+    d = d.loc[d[target].fillna("") != ""]
+    tokens_src = tokenize(d[source].fillna(""))
+    tokens_dst = tokenize(d[target])
+    counts = (
+        pd.concat(
+            [
+                tokens_src.assign(side="n_source"),
+                tokens_dst.assign(side="n_translation"),
+            ]
+        )
+        .loc[lambda x: x["kind"].isin(COMPARED.keys())]
+        .assign(issue=lambda x: x["kind"].map(COMPARED))
+        .reset_index()
+        .groupby(["entry", "issue", "token", "side"])
+        .size()
+        .unstack("side", fill_value=0)
+        .reindex(columns=["n_source", "n_translation"], fill_value=0)
+    )
+    mismatched = counts.loc[lambda x: x["n_source"] != x["n_translation"]].reset_index(
+        ["issue", "token"]
+    )
+    calls_src = pd.MultiIndex.from_arrays(
+        [
+            tokens_src.index.get_level_values("entry"),
+            tokens_src["function"].where(tokens_src["kind"] == "call"),
+        ]
+    )
+    in_source = pd.MultiIndex.from_arrays(
+        [tokens_dst.index.get_level_values("entry"), tokens_dst["function"]]
+    ).isin(calls_src)
+    unknown = (
+        tokens_dst.loc[
+            lambda x: (x["kind"] == "call")
+            & ~x["function"].isin(functions)
+            & ~in_source
+        ]
+        .assign(issue="unknown function", n_source=0, n_translation=1)
+        .droplevel("match")[["issue", "token", "n_source", "n_translation"]]
+    )
+    broken = (
+        tokens_dst.loc[lambda x: x["kind"] == "broken"]
+        .assign(issue="broken", n_source=0, n_translation=1)
+        .droplevel("match")[["issue", "token", "n_source", "n_translation"]]
+    )
+    issues = pd.concat(
+        [mismatched, conditional_issues(tokens_dst), unknown, broken]
+    ).rename_axis("entry")
+    return issues.sort_index(kind="stable")
+
+
+def check_catalog_markup(
+    pof: polib.POFile, functions: Optional[Set[str]] = None
+) -> pd.DataFrame:
+    """
+    カタログの訳のある項目を調べる. msgid は `<ID>/<原文>`
+    Returns: REPORT_COLUMNS の表
+    """
+    if functions is None:
+        functions = read_function_names()
+    entries = entries_with_source(pof)
+    d = pd.DataFrame(
+        {
+            "msgctxt": [x.msgctxt for x, _ in entries],
+            "msgid": [x.msgid for x, _ in entries],
+            "text_EN": [source for _, source in entries],
+            "text": [x.msgstr for x, _ in entries],
+        },
+        dtype=object,
+    )
+    issues = validate_markup(d, functions)
+    issues = d[["msgctxt", "msgid"]].join(issues, how="inner")[REPORT_COLUMNS]
+    for msgid, issue, token in issues[["msgid", "issue", "token"]].itertuples(
+        index=False
+    ):
+        report.note(
+            f"markup.{issue.replace(' ', '_')}",
+            "{}: {} {}",
+            msgid,
+            issue,
+            token,
+            warning=True,
+        )
+    return issues.reset_index(drop=True)
+
+
+def check_markup(
+    catalog: Path,
+    output: Optional[Path] = None,
+    functions_file: Path = FUNCTIONS_FILE,
+) -> pd.DataFrame:
+    """
+    カタログ (.po か .mo) の制御記号を調べ, `output` があれば結果を CSV に書き出す
+    """
+    if catalog.suffix == ".mo":
+        pof = polib.mofile(catalog, encoding="utf-8")
+    else:
+        pof = polib.pofile(catalog, encoding="utf-8")
+    return write_markup_issues(
+        check_catalog_markup(pof, read_function_names(functions_file)), output
+    )
+
+
+def write_markup_issues(d: pd.DataFrame, output: Optional[Path]) -> pd.DataFrame:
+    print(f"""markup: {d.shape[0]} issues in {d["msgid"].nunique()} entries""")
+    if output is not None:
+        if not output.parent.exists():
+            output.parent.mkdir(parents=True)
+        d.to_csv(output, index=False)
+        print(f"saved to {output}")
+    return d
@@ -0,0 +1,224 @@
+#! /usr/bin/env python3
+# encoding: utf-8
+from typing import List, Sequence, Tuple
+
+import numpy as np
+import polib
+
+# MinHash のビン数と, LSH でまとめて比べる行数. 16バンド x 4行で類似度 0.5 前後から候補に残る
+N_BINS = 64
+ROWS_PER_BAND = 4
+# 同じバンドの値を持つ文字列がこれより多ければ先頭からこの数だけを候補にする
+MAX_BUCKET = 8
+# 類似度を一度に計算する組の数
+PAIR_CHUNK = 1 << 18
+TOP_K = 3
+THRESHOLD = 0.5
+
+U64 = np.uint64
+
+
+def normalize_text(text: str) -> str:
+    """
+    大小文字と空白の違いは無視する. 両端の空白は3文字未満の文字列にも n-gram を作るため
+    """
+    return " " + " ".join(text.lower().split()) + " "
+
+
+def mix64(x: np.ndarray) -> np.ndarray:
+    """
+    splitmix64 の最後の撹拌. uint64 の配列をそのまま1つの乱数に写す
+    """
+    x = x ^ (x >> U64(30))
+    x = x * U64(0xBF58476D1CE4E5B9)
+    x = x ^ (x >> U64(27))
+    x = x * U64(0x94D049BB133111EB)
+    return x ^ (x >> U64(31))
+
+
+def trigram_hashes(texts: Sequence[str]) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    正規化済みの文字列すべての文字3-gramのハッシュ
+    Returns: (ハッシュ, 各ハッシュがどの文字列のものか)
+    """
+    lengths = np.fromiter((len(x) for x in texts), dtype=np.int64, count=len(texts))
+    cps = np.frombuffer("".join(texts).encode("utf-32-le"), dtype=np.uint32).astype(U64)
+    # コードポイントは21bitに収まるので3文字を重ならずに詰められる
+    grams = (cps[:-2] << U64(42)) | (cps[1:-1] << U64(21)) | cps[2:]
+    owner = np.repeat(np.arange(len(texts)), lengths)[:-2]
+    # 文字列をまたぐ (各文字列の最後の2文字から始まる) ものを除く
+    ends = np.cumsum(lengths)
+    valid = np.ones(len(grams), dtype=bool)
+    valid[(ends - 1)[:-1]] = False
+    valid[(ends - 2)[:-1]] = False
+    grams, owner = grams[valid], owner[valid]
+    return mix64(grams), owner
+
+
+def minhash_signatures(texts: Sequence[str]) -> np.ndarray:
+    """
+    1回のハッシュをビンに分ける MinHash (one permutation hashing) の署名.
+    n-gram の少ない文字列の空きビンは右隣の埋まったビンの値で埋める (rotation densification)
+    比べるときの速さとメモリのため各ビンの下位16bitだけを残す. 偶然一致する割合は 1/65536 で無視できる
+    Returns: (文字列数, N_BINS) の uint16
+    """
+    hashes, owner = trigram_hashes(texts)
+    empty = np.iinfo(np.uint32).max
+    sig = np.full((len(texts), N_BINS), empty, dtype=np.uint32)
+    bins = (hashes >> U64(64 - 6)).astype(np.int64)
+    np.minimum.at(sig.reshape(-1), owner * N_BINS + bins, hashes.astype(np.uint32))
+    filled = sig != empty
+    # 2周分並べて, 各ビンから右へ見て最初に埋まっているビンを求める
+    cols = np.arange(2 * N_BINS, dtype=np.int16)
+    nearest = np.where(np.tile(filled, 2), cols, np.int16(2 * N_BINS))
+    nearest = np.minimum.accumulate(nearest[:, ::-1], axis=1)[:, ::-1][:, :N_BINS]
+    has_any = filled.any(axis=1)
+    nearest[~has_any] = np.arange(N_BINS)
+    distance = (nearest - np.arange(N_BINS)).astype(np.uint32)
+    rows = np.arange(len(texts))[:, None]
+    # 借りた距離を混ぜて, 元から埋まっているビンの値と区別する
+    sig = sig[rows, nearest % N_BINS] + distance * np.uint32(0x9E3779B1)
+    return sig.astype(np.uint16)
+
+
+def band_keys(sig: np.ndarray) -> np.ndarray:
+    """
+    Returns: (文字列数, バンド数) の uint64
+    """
+    n_bands = N_BINS // ROWS_PER_BAND
+    keys = np.zeros((sig.shape[0], n_bands), dtype=U64)
+    for i in range(ROWS_PER_BAND):
+        keys = mix64(keys ^ sig[:, i::ROWS_PER_BAND].astype(U64))
+    return keys
+
+
+class TranslationMemory:
+    """
+    以前の翻訳ファイルの英語原文を文字3-gramの MinHash で索引し,
+    原文が少し変わった項目に似た原文の訳を探す.
+    同じ原文と訳の組は最初のIDだけを残す
+    """
+
+    def __init__(self, ids: List[str], texts: List[str], translations: List[str]):
+        seen = dict()
+        for id, text, translation in zip(ids, texts, translations):
+            key = (normalize_text(text), translation)
+            if text.strip() != "" and translation != "" and key not in seen:
+                seen[key] = id
+        self.ids = list(seen.values())
+        self.translations = [x for _, x in seen.keys()]
+        self.signatures = minhash_signatures([x for x, _ in seen.keys()])
+        keys = band_keys(self.signatures)
+        self.band_order = np.argsort(keys, axis=0, kind="stable")
+        self.band_sorted = np.take_along_axis(keys, self.band_order, axis=0)
+
+    @classmethod
+    def from_catalog(cls, pof: polib.POFile) -> "TranslationMemory":
+        """
+        訳のある項目すべて (obsolete を含む). msgid は `<ID>/<原文>`
+        """
+        ids, texts, translations = [], [], []
+        for entry in pof:
+            if entry.msgid == "" or entry.msgstr == "":
+                continue
+            id, _, text = entry.msgid.partition("/")
+            ids.append(id)
+            texts.append(text)
+            translations.append(entry.msgstr)
+        return cls(ids, texts, translations)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def candidates(self, sig: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        どれかのバンドの値が一致する (問い合わせ, 索引の行) の組
+        """
+        keys = band_keys(sig)
+        queries, rows = [], []
+        for band in range(keys.shape[1]):
+            sorted_keys = self.band_sorted[:, band]
+            left = np.searchsorted(sorted_keys, keys[:, band], side="left")
+            right = np.searchsorted(sorted_keys, keys[:, band], side="right")
+            n = np.minimum(right - left, MAX_BUCKET)
+            q = np.repeat(np.arange(len(keys)), n)
+            offsets = np.arange(n.sum()) - np.repeat(np.cumsum(n) - n, n)
+            queries.append(q)
+            rows.append(self.band_order[left[q] + offsets, band])
+        # 複数のバンドで一致した組を1つにする
+        pairs = np.sort(
+            np.concatenate(queries).astype(np.int64) * len(self) + np.concatenate(rows)
+        )
+        pairs = pairs[np.r_[True, pairs[1:] != pairs[:-1]]]
+        return pairs // len(self), pairs % len(self)
+
+    def search(
+        self, texts: Sequence[str], top_k: int = TOP_K, threshold: float = THRESHOLD
+    ) -> List[List[Tuple[int, float]]]:
+        """
+        各文字列に似た原文を, 推定した3-gramの Jaccard 係数の高い順に `top_k` 件まで探す
+        Returns: 文字列ごとの (索引の行, 類似度) のリスト
+        """
+        results: List[List[Tuple[int, float]]] = [[] for _ in texts]
+        targets = [i for i, x in enumerate(texts) if x.strip() != ""]
+        if len(self) == 0 or len(targets) == 0:
+            return results
+        sig = minhash_signatures([normalize_text(texts[i]) for i in targets])
+        queries, rows = self.candidates(sig)
+        # 一致したビンの数. 組が多いときにメモリを使いすぎないよう区切って数える
+        matches = np.concatenate(
+            [
+                (
+                    sig[queries[i : i + PAIR_CHUNK]]
+                    == self.signatures[rows[i : i + PAIR_CHUNK]]
+                )
+                .view(np.uint8)
+                .sum(axis=1, dtype=np.uint8)
+                for i in range(0, len(queries), PAIR_CHUNK)
+            ]
+            + [np.zeros(0, dtype=np.uint8)]
+        )
+        keep = matches >= threshold * N_BINS
+        queries, rows = queries[keep], rows[keep]
+        scores = matches[keep] / N_BINS
+        order = np.lexsort((rows, -scores, queries))
+        queries, rows, scores = queries[order], rows[order], scores[order]
+        # 問い合わせごとの順位
+        first = np.searchsorted(queries, queries, side="left")
+        rank = np.arange(len(queries)) - first
+        for q, row, score in zip(
+            *[x[rank < top_k].tolist() for x in (queries, rows, scores)]
+        ):
+            results[targets[q]].append((row, score))
+        return results
+
+
+def suggest_translations(
+    memory: TranslationMemory,
+    entries: List[polib.POEntry],
+    top_k: int = TOP_K,
+    threshold: float = THRESHOLD,
+) -> int:
+    """
+    訳のない項目に最も似た原文の訳を fuzzy で入れ, 候補の元のIDと類似度をコメントに残す
+    Returns: 訳を入れた項目の数
+    """
+    results = memory.search(
+        [x.msgid.partition("/")[2] for x in entries], top_k, threshold
+    )
+    n = 0
+    for entry, found in zip(entries, results):
+        if len(found) == 0:
+            continue
+        lines = [
+            f"TM {score:.2f} {memory.ids[row]}: {memory.translations[row]!r}"
+            for row, score in found
+        ]
+        entry.msgstr = memory.translations[found[0][0]]
+        entry.tcomment = "\n".join(
+            ([entry.tcomment] if entry.tcomment != "" else []) + lines
+        )
+        if "fuzzy" not in entry.flags:
+            entry.flags.append("fuzzy")
+        n += 1
+    return n
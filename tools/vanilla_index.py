@@ -0,0 +1,311 @@
+#! /usr/bin/env python3
+# encoding: utf-8
+import hashlib
+import json
+import os
+import shutil
+import warnings
+from pathlib import Path
+from typing import Iterable, List, Optional, Tuple
+
+import lxml.etree as ET
+import numpy as np
+import pandas as pd
+import polib
+from parse_cache import hash_file
+
+INDEX_VERSION = 1
+ARRAYS = [
+    "id_keys",
+    "id_rows",
+    "pair_keys",
+    "pair_rows",
+    "bloom",
+    "id_offsets",
+    "id_bytes",
+    "text_offsets",
+    "text_bytes",
+]
+
+
+def hash64(s: str) -> int:
+    """
+    プロセスをまたいで変わらない64bitのハッシュ. 0 は空きスロットの印なので使わない
+    """
+    h = int.from_bytes(
+        hashlib.blake2b(s.encode("utf-8"), digest_size=8).digest(), "little"
+    )
+    return h if h != 0 else 1
+
+
+def hash64_array(strings: Iterable[str]) -> np.ndarray:
+    return np.fromiter((hash64(s) for s in strings), dtype=np.uint64)
+
+
+def read_game_version(mb2dir: Optional[Path]) -> str:
+    """
+    `Modules/Native/SubModule.xml` に書かれたゲームのバージョン
+    """
+    if mb2dir is None:
+        return "unknown"
+    fp = Path(mb2dir).joinpath("Modules/Native/SubModule.xml")
+    if not fp.exists():
+        warnings.warn(f"{fp} not found. the game version is treated as unknown")
+        return "unknown"
+    version = ET.parse(fp).find("Version")
+    if version is None:
+        return "unknown"
+    return version.attrib.get("value", "unknown")
+
+
+def read_vanilla_ids(fpath: Path) -> Tuple[List[str], List[str]]:
+    """
+    バニラの翻訳ファイル (PO) あるいは旧来の vanilla-id.csv から ID と英語の原文を読む
+    """
+    if fpath.suffix == ".csv":
+        d = pd.read_csv(fpath, dtype=str, keep_default_na=False)
+        return (d["id"].tolist(), d["text_EN"].tolist())
+    pof = polib.pofile(fpath, encoding="utf-8")
+    ids, texts = [], []
+    for entry in pof:
+        if entry.msgid == "":
+            continue
+        id, _, text = entry.msgid.partition("/")
+        ids.append(id)
+        texts.append(text)
+    return (ids, texts)
+
+
+def pack_strings(strings: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+    encoded = [s.encode("utf-8") for s in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(b) for b in encoded], out=offsets[1:])
+    return (offsets, np.frombuffer(b"".join(encoded), dtype=np.uint8))
+
+
+class VanillaIndex:
+    """
+    バニラの ID -> 英語の原文 の索引. ゲームのバージョンごとに一度だけ作り, 以後は .npy を mmap して使う.
+    ID と (ID, 原文) の組をそれぞれ開番地法のハッシュ表に入れ, ID にはブルームフィルタも付ける.
+    Mod の大半の ID はバニラにないので, ほとんどはフィルタだけで判定が済む
+    """
+
+    def __init__(self, index_dir: Path):
+        self.dir = index_dir
+        with index_dir.joinpath("meta.json").open("r", encoding="utf-8") as f:
+            self.meta = json.load(f)
+        for name in ARRAYS:
+            setattr(
+                self, name, np.load(index_dir.joinpath(f"{name}.npy"), mmap_mode="r")
+            )
+
+    def __len__(self) -> int:
+        return self.meta["n_pairs"]
+
+    @classmethod
+    def build(
+        cls, ids: List[str], texts: List[str], index_dir: Path, meta: dict
+    ) -> "VanillaIndex":
+        """
+        ID と原文の一覧から索引を作って `index_dir` に保存する
+        """
+        pairs = list(dict.fromkeys(zip(ids, texts)))
+        first_row = dict()
+        for row, (id, _) in enumerate(pairs):
+            first_row.setdefault(id, row)
+        arrays = dict()
+        arrays["id_keys"], arrays["id_rows"] = build_hash_table(
+            hash64_array(first_row.keys()), np.fromiter(first_row.values(), np.int64)
+        )
+        arrays["pair_keys"], arrays["pair_rows"] = build_hash_table(
+            hash64_array(f"{id}\0{text}" for id, text in pairs),
+            np.arange(len(pairs), dtype=np.int64),
+        )
+        arrays["bloom"] = build_bloom_filter(hash64_array(first_row.keys()))
+        arrays["id_offsets"], arrays["id_bytes"] = pack_strings([x[0] for x in pairs])
+        arrays["text_offsets"], arrays["text_bytes"] = pack_strings(
+            [x[1] for x in pairs]
+        )
+        tmp_dir = index_dir.with_name(index_dir.name + ".tmp")
+        if tmp_dir.exists():
+            shutil.rmtree(tmp_dir)
+        tmp_dir.mkdir(parents=True)
+        for name in ARRAYS:
+            np.save(tmp_dir.joinpath(f"{name}.npy"), arrays[name])
+        meta = dict(
+            meta,
+            index_version=INDEX_VERSION,
+            n_ids=len(first_row),
+            n_pairs=len(pairs),
+        )
+        with tmp_dir.joinpath("meta.json").open("w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False)
+        if index_dir.exists():
+            shutil.rmtree(index_dir)
+        os.replace(tmp_dir, index_dir)
+        return cls(index_dir)
+
+    def id_at(self, row: int) -> str:
+        return (
+            self.id_bytes[self.id_offsets[row] : self.id_offsets[row + 1]]
+            .tobytes()
+            .decode("utf-8")
+        )
+
+    def text_at(self, row: int) -> str:
+        return (
+            self.text_bytes[self.text_offsets[row] : self.text_offsets[row + 1]]
+            .tobytes()
+            .decode("utf-8")
+        )
+
+    def text_EN(self, id: str) -> Optional[str]:
+        """
+        ID に対応する英語の原文. 複数あれば最初のもの. バニラの ID でなければ None
+        """
+        row = self.find_ids([id])[0]
+        return None if row < 0 else self.text_at(row)
+
+    def __contains__(self, id: str) -> bool:
+        return self.find_ids([id])[0] >= 0
+
+    def find_ids(self, ids: List[str]) -> np.ndarray:
+        """
+        Returns: 各IDの行番号. バニラのIDでなければ -1
+        """
+        hashes = hash64_array(ids)
+        rows = np.full(len(ids), -1, dtype=np.int64)
+        maybe = np.flatnonzero(bloom_contains(self.bloom, hashes))
+        found = probe_hash_table(self.id_keys, self.id_rows, hashes[maybe])
+        for i, row in zip(maybe.tolist(), found.tolist()):
+            if row >= 0 and self.id_at(row) == ids[i]:
+                rows[i] = row
+        return rows
+
+    def lookup(
+        self, ids: Iterable[str], texts: Iterable[str]
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Returns:
+            バニラで使われている ID か
+            その ID と原文の組がバニラにもあるか (つまりテキストが変更されていないか)
+        """
+        ids = [x if isinstance(x, str) else "" for x in ids]
+        texts = [x if isinstance(x, str) else None for x in texts]
+        is_vanilla = self.find_ids(ids) >= 0
+        is_unchanged = np.zeros(len(ids), dtype=bool)
+        candidates = np.flatnonzero(is_vanilla).tolist()
+        keys = [f"{ids[i]}\0{texts[i]}" for i in candidates]
+        found = probe_hash_table(self.pair_keys, self.pair_rows, hash64_array(keys))
+        for i, row in zip(candidates, found.tolist()):
+            is_unchanged[i] = (
+                row >= 0 and self.id_at(row) == ids[i] and self.text_at(row) == texts[i]
+            )
+        return (is_vanilla, is_unchanged)
+
+
+def build_hash_table(
+    hashes: np.ndarray, rows: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    線形探査のハッシュ表. 大きさは要素数の2倍以上の2の冪
+    """
+    size = 1 << max(4, int(2 * max(len(hashes), 1) - 1).bit_length())
+    mask = size - 1
+    keys = [0] * size
+    slot_rows = [-1] * size
+    for h, row in zip(hashes.tolist(), rows.tolist()):
+        slot = h & mask
+        while keys[slot] != 0:
+            if keys[slot] == h:
+                warnings.warn(f"hash collision in the vanilla ID index (row {row})")
+                break
+            slot = (slot + 1) & mask
+        else:
+            keys[slot] = h
+            slot_rows[slot] = row
+    return (np.array(keys, dtype=np.uint64), np.array(slot_rows, dtype=np.int64))
+
+
+def probe_hash_table(
+    keys: np.ndarray, rows: np.ndarray, hashes: np.ndarray
+) -> np.ndarray:
+    """
+    `build_hash_table` の表を全要素まとめて探索する
+    Returns: 行番号. 見つからなければ -1
+    """
+    mask = np.uint64(keys.shape[0] - 1)
+    slots = hashes & mask
+    result = np.full(hashes.shape[0], -1, dtype=np.int64)
+    pending = np.arange(hashes.shape[0])
+    while pending.size > 0:
+        k = keys[slots[pending]]
+        hit = k == hashes[pending]
+        result[pending[hit]] = rows[slots[pending[hit]]]
+        pending = pending[~hit & (k != 0)]
+        slots[pending] = (slots[pending] + np.uint64(1)) & mask
+    return result
+
+
+BLOOM_BITS_PER_KEY = 16
+
+
+def bloom_bit_indices(hashes: np.ndarray, n_bits: int) -> List[np.ndarray]:
+    mask = np.uint64(n_bits - 1)
+    return [(hashes >> np.uint64(shift)) & mask for shift in (0, 21, 42)]
+
+
+def build_bloom_filter(hashes: np.ndarray) -> np.ndarray:
+    n_bits = 1 << max(6, int(BLOOM_BITS_PER_KEY * max(len(hashes), 1) - 1).bit_length())
+    bits = np.zeros(n_bits // 64, dtype=np.uint64)
+    for index in bloom_bit_indices(hashes, n_bits):
+        np.bitwise_or.at(
+            bits, index >> np.uint64(6), np.uint64(1) << (index & np.uint64(63))
+        )
+    return bits
+
+
+def bloom_contains(bits: np.ndarray, hashes: np.ndarray) -> np.ndarray:
+    n_bits = bits.shape[0] * 64
+    result = np.ones(hashes.shape[0], dtype=bool)
+    for index in bloom_bit_indices(hashes, n_bits):
+        word = bits[index >> np.uint64(6)]
+        result &= (word >> (index & np.uint64(63))) & np.uint64(1) == np.uint64(1)
+    return result
+
+
+def open_vanilla_index(
+    source: Path, mb2dir: Optional[Path], cache_dir: Path
+) -> Optional[VanillaIndex]:
+    """
+    ゲームのバージョンに対応する索引を開く. ないか, 元のファイルが変わっていれば作り直す
+    Args:
+        source: バニラの翻訳ファイル (PO) か旧来の vanilla-id.csv
+    """
+    version = read_game_version(mb2dir)
+    index_dir = cache_dir.joinpath("vanilla-index").joinpath(
+        "".join(c if c.isalnum() or c in ".-_" else "_" for c in version)
+    )
+    fp_meta = index_dir.joinpath("meta.json")
+    if fp_meta.exists():
+        index = VanillaIndex(index_dir)
+        if index.meta.get("index_version") == INDEX_VERSION and (
+            not source.exists() or index.meta.get("sha256") == hash_file(source)
+        ):
+            return index
+        del index
+    if not source.exists():
+        warnings.warn(
+            f"""{source} not found. the vanilla ID check is skipped, but it will caused some ID detection errors."""
+        )
+        return None
+    print(f"building the vanilla ID index for {version} from {source}...")
+    ids, texts = read_vanilla_ids(source)
+    index = VanillaIndex.build(
+        ids,
+        texts,
+        index_dir,
+        meta=dict(game_version=version, source=str(source), sha256=hash_file(source)),
+    )
+    print(f"{index.meta['n_ids']} vanilla IDs indexed in {index_dir}")
+    return index
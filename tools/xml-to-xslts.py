@@ -5,10 +5,9 @@
 
 from pathlib import Path
 import pandas as pd
-import lxml.etree as ET
 from typing import Iterable, List, Tuple
 import argparse
-from functions import FILTERS
+from functions import extract_filter_entries, parse_xml
 
 parser = argparse.ArgumentParser()
 parser.add_argument('target_module', type=str, help='target module folder name')
@@ -170,13 +169,12 @@ def extract_entries_to_translate(file_path: Path) -> pd.DataFrame:
         context
         xpath
     """
-    xml = ET.parse(file_path)
-    xml_root = xml.getroot()
+    xml = parse_xml(file_path)
     ds: List[pd.DataFrame] = []
-    for params in FILTERS:
+    for params, elements in extract_filter_entries(xml, 'xml'):
         d_xmls = (
             pd.DataFrame(
-                [(x.attrib.get('id'), x.attrib.get(params['key'])) for x in xml_root.xpath(params['xpath'])], columns=['id', 'text']
+                [(x.attrib.get('id'), x.attrib.get(params['key'])) for x in elements], columns=['id', 'text']
             )
             .assign(
                 loc_id = lambda d: d['text'].str.replace(r'^\{=(.+?)\}(.+?)$', r'\1', regex=True),  #???
@@ -202,6 +200,10 @@ def extract_entries_to_translate(file_path: Path) -> pd.DataFrame:
             ]
         )
         ds += [d_xmls]
+    if len(ds) == 0:
+        return pd.DataFrame(
+            columns=['id', 'text', 'loc_id', 'name', 'context', 'xpath', 'xml_name_id', 'xml_path_to_output', 'xslt']
+        )
     return pd.concat(ds)
 
 
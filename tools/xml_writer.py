@@ -0,0 +1,159 @@
+#! /usr/bin/env python3
+# encoding: utf-8
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from itertools import chain
+from pathlib import Path
+from typing import Iterable, List, Tuple
+
+import lxml.etree as ET
+
+# 書き出し待ちの木の上限. これを超えると `XMLWriteQueue.write` が空きを待つ
+MAX_PENDING_WRITES = 32
+WRITER_THREADS = 4
+
+
+def serialize_xml(xml: ET.ElementTree) -> bytes:
+    """
+    インデントを整え, 宣言付きで直列化する
+    """
+    ET.indent(xml, space="  ", level=0)
+    # tree.write と同じバイト列にするため宣言のエンコーディング名は大文字にする
+    return ET.tostring(xml, pretty_print=True, xml_declaration=True, encoding="UTF-8")
+
+
+def temporary_path(fpath: Path) -> Path:
+    return fpath.with_name(f".{fpath.name}.{os.getpid()}-{threading.get_ident()}.tmp")
+
+
+def write_bytes_atomic(content: bytes, fpath: Path) -> None:
+    """
+    同じフォルダの一時ファイルに書いてから置き換える. 途中で止まっても書きかけのファイルは残らない
+    """
+    fp_tmp = temporary_path(fpath)
+    try:
+        with fp_tmp.open("wb") as f:
+            f.write(content)
+        os.replace(fp_tmp, fpath)
+    except BaseException:
+        fp_tmp.unlink(missing_ok=True)
+        raise
+
+
+def write_xml_atomic(xml: ET.ElementTree, fpath: Path) -> None:
+    write_bytes_atomic(serialize_xml(xml), fpath)
+
+
+def write_string_xml(
+    fpath: Path, langids: Iterable[str], strings: Iterable[Tuple[str, str]]
+) -> int:
+    """
+    `<base><tags><tag language/></tags><strings><string id text/></strings></base>` の言語ファイルを
+    木を作らずに1行ずつ書き出す. `serialize_xml` と同じバイト列になる.
+    `strings` はジェネレーターでよく, 全体をメモリに置かない
+    Returns: 書き出した string の数
+    """
+    n = 0
+    fp_tmp = temporary_path(fpath)
+    try:
+        with fp_tmp.open("wb") as f:
+            with ET.xmlfile(f, encoding="UTF-8") as xf:
+                xf.write_declaration()
+                with xf.element("base"):
+                    write_children(
+                        xf, "tags", (("tag", dict(language=x)) for x in langids)
+                    )
+                    n = write_children(
+                        xf,
+                        "strings",
+                        (("string", dict(id=id, text=text)) for id, text in strings),
+                    )
+                    xf.write("\n")
+            # serialize_xml と同じく末尾に改行を置く. xmlfile は要素の外にテキストを書けない
+            f.write(b"\n")
+        os.replace(fp_tmp, fpath)
+    except BaseException:
+        fp_tmp.unlink(missing_ok=True)
+        raise
+    return n
+
+
+def write_children(xf, tag: str, children: Iterable[Tuple[str, dict]]) -> int:
+    """
+    `base` 直下の要素を1つ書き, 子要素を `ET.indent` と同じ字下げで並べる. 子がなければ空要素にする
+    """
+    xf.write("\n  ")
+    children = iter(children)
+    first = next(children, None)
+    if first is None:
+        xf.write(ET.Element(tag))
+        return 0
+    n = 0
+    with xf.element(tag):
+        for child_tag, attrib in chain([first], children):
+            xf.write("\n    ")
+            # 属性は Element に渡して lxml にエスケープさせる
+            xf.write(ET.Element(child_tag, attrib))
+            n += 1
+        xf.write("\n  ")
+    return n
+
+
+class XMLWriteQueue:
+    """
+    XML の直列化と書き込みをスレッドプールに回し, 次のファイルの処理と重ねる.
+    直列化は lxml の C コードで GIL を手放すので, スレッドでも重なる.
+    待ちが `max_pending` に達すると `write` は空きができるまで待つ.
+    `drain` ですべての書き込みを待ち, 失敗していればその例外を送出する
+    """
+
+    def __init__(
+        self, max_workers: int = WRITER_THREADS, max_pending: int = MAX_PENDING_WRITES
+    ):
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="xml-writer"
+        )
+        self.slots = threading.BoundedSemaphore(max_pending)
+        self.pending: List[Future] = []
+
+    def write(self, xml: ET.ElementTree, fpath: Path) -> Future:
+        """
+        `xml` は書き終わるまで変更しないこと
+        """
+        self.slots.acquire()
+        try:
+            future = self.executor.submit(write_xml_atomic, xml, fpath)
+        except BaseException:
+            self.slots.release()
+            raise
+        future.add_done_callback(lambda _: self.slots.release())
+        # 成功したものは忘れ, 未完了と失敗だけを drain まで持っておく
+        self.pending = [
+            x for x in self.pending if not x.done() or x.exception() is not None
+        ]
+        self.pending.append(future)
+        return future
+
+    def drain(self) -> None:
+        pending, self.pending = self.pending, []
+        errors = [x.exception() for x in pending]
+        errors = [x for x in errors if x is not None]
+        if len(errors) > 0:
+            raise errors[0]
+
+    def shutdown(self) -> None:
+        """
+        残りの書き込みを待ってスレッドを止める. 失敗は送出しないので, 先に `drain` すること
+        """
+        self.executor.shutdown(wait=True)
+
+    def __enter__(self) -> "XMLWriteQueue":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        try:
+            if exc_type is None:
+                self.drain()
+        finally:
+            self.shutdown()